@@ -0,0 +1,82 @@
+import io
+from PIL import Image
+from ImageHeader import getImageSize
+from Metrics import Metrics
+
+class BaseImageNormalizer:
+  """Shrinks an uploaded base image before it is sent to every MMG and reducer.
+
+  A mosaic's tile grid and size depend only on the base image's aspect ratio:
+  it is `tilesAcross` tiles across and `int(height / (width / tilesAcross))`
+  tiles down, rendered at `renderedTileSize` pixels per tile.  A base image
+  wider than `tilesAcross * renderedTileSize` carries detail that no mosaic
+  can show, so it is resized to that width (with a height that keeps the same
+  number of tile rows), decoded once and re-encoded compactly.  Images that
+  are already small enough, or that would not get smaller, are used as-is.
+  """
+
+  def __init__(self, jpegQuality = 90, metrics = None):
+    self.jpegQuality = jpegQuality
+
+    if metrics is None:
+      metrics = Metrics()
+    self.metrics = metrics
+    metrics.counter("mosaic_base_image_bytes_total", "Bytes of uploaded base images, before (uploaded) and after (normalized) normalization")
+
+  def verticalTiles(self, width, height, tilesAcross):
+    # Same math as `MosaicWorker` (and the MMGs) use for the tile grid:
+    d = width / tilesAcross
+    return int(height / d)
+
+  def targetSize(self, width, height, tilesAcross, renderedTileSize):
+    """The smallest (width, height) with the same tile grid and mosaic size, or None to keep the image."""
+    targetWidth = tilesAcross * renderedTileSize
+    if targetWidth >= width:
+      return None
+
+    verticalTiles = self.verticalTiles(width, height, tilesAcross)
+    if verticalTiles < 1:
+      return None
+
+    # Keep the aspect ratio, but never round into a different number of tile rows:
+    targetHeight = round(height * targetWidth / width)
+    targetHeight = max(targetHeight, verticalTiles * renderedTileSize)
+    targetHeight = min(targetHeight, (verticalTiles + 1) * renderedTileSize - 1)
+    if self.verticalTiles(targetWidth, targetHeight, tilesAcross) != verticalTiles:
+      return None
+
+    return targetWidth, targetHeight
+
+  def normalize(self, baseImage, tilesAcross, renderedTileSize):
+    self.metrics.increment("mosaic_base_image_bytes_total", len(baseImage), stage = "uploaded")
+
+    try:
+      width, height = getImageSize(baseImage)
+    except Exception as e:
+      raise Exception(f"Unable to read the base image: {e}")
+
+    size = self.targetSize(width, height, tilesAcross, renderedTileSize)
+    if size is None:
+      self.metrics.increment("mosaic_base_image_bytes_total", len(baseImage), stage = "normalized")
+      return baseImage
+
+    with Image.open(io.BytesIO(baseImage)) as img:
+      # JPEGs are decoded at a reduced scale when it is still larger than `size`:
+      img.draft("RGB", size)
+      hasAlpha = "A" in img.getbands() or "transparency" in img.info
+      img = img.convert("RGBA" if hasAlpha else "RGB").resize(size, Image.LANCZOS)
+
+    buffer = io.BytesIO()
+    if hasAlpha:
+      img.save(buffer, "PNG", optimize = True)
+    else:
+      img.save(buffer, "JPEG", quality = self.jpegQuality)
+    normalized = buffer.getvalue()
+
+    if len(normalized) >= len(baseImage):
+      self.metrics.increment("mosaic_base_image_bytes_total", len(baseImage), stage = "normalized")
+      return baseImage
+
+    self.metrics.increment("mosaic_base_image_bytes_total", len(normalized), stage = "normalized")
+    print(f"[BaseImageNormalizer]: {width} x {height} ({len(baseImage)} bytes) -> {size[0]} x {size[1]} ({len(normalized)} bytes)")
+    return normalized
@@ -0,0 +1,82 @@
+import glob
+import hashlib
+import os
+import threading
+
+class BaseImageStore:
+  """In-memory, content-addressed store of the base images of running jobs.
+
+  Services that advertise the `baseImageDigest` capability receive only the
+  SHA-256 digest and a URL instead of the image bytes, and download (and
+  cache) the image from `GET /baseImage/<digest>`.  Images are reference
+  counted: every `publish` must be paired with a `release`.
+
+  A load balancer may send that download to any middleware process, so with
+  a `directory` shared by every process, each image is also written there
+  (as `<digest>.<pid>`, removed when this process releases it) and `get`
+  finds images published by the other processes.
+  """
+
+  def __init__(self, directory = None):
+    self.images = {}
+    self.refCounts = {}
+    self.lock = threading.Lock()
+
+    self.directory = directory
+    if self.directory is not None:
+      os.makedirs(self.directory, exist_ok = True)
+
+  def path(self, digest):
+    return os.path.join(self.directory, f"{digest}.{os.getpid()}")
+
+  def publish(self, image):
+    digest = hashlib.sha256(image).hexdigest()
+    with self.lock:
+      # Written under the lock, so a concurrent `release` cannot remove the new file:
+      if digest not in self.images and self.directory is not None:
+        self.writeShared(digest, image)
+      self.images[digest] = image
+      self.refCounts[digest] = self.refCounts.get(digest, 0) + 1
+    return digest
+
+  def writeShared(self, digest, image):
+    path = self.path(digest)
+    try:
+      temporaryPath = f"{path}.{threading.get_ident()}.tmp"
+      with open(temporaryPath, "wb") as f:
+        f.write(image)
+      os.replace(temporaryPath, path)
+    except OSError as e:
+      # Only this process can serve the image then:
+      print(f"[BaseImageStore]: Unable to write {path}: {e}")
+
+  def release(self, digest):
+    with self.lock:
+      self.refCounts[digest] -= 1
+      if self.refCounts[digest] == 0:
+        del self.refCounts[digest]
+        del self.images[digest]
+        if self.directory is not None:
+          try:
+            os.remove(self.path(digest))
+          except OSError:
+            pass
+
+  def get(self, digest):
+    with self.lock:
+      image = self.images.get(digest)
+
+    if image is not None or self.directory is None:
+      return image
+
+    # Published by another process (only hex digests, so the pattern matches nothing else):
+    if any(c not in "0123456789abcdef" for c in digest):
+      return None
+    for path in glob.glob(os.path.join(self.directory, f"{digest}.*[0-9]")):
+      try:
+        with open(path, "rb") as f:
+          return f.read()
+      except OSError:
+        # Released in the meantime:
+        continue
+    return None
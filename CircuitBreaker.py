@@ -0,0 +1,62 @@
+import threading
+import time
+
+class CircuitBreaker:
+  """Closed/open/half-open circuit state for a single MMG or reducer.
+
+  A closed circuit is healthy and receives work.  `failureThreshold`
+  consecutive connection errors or 5xx responses open the circuit, and an
+  open circuit receives no work.  After `openDuration` seconds the circuit
+  becomes half-open: the next health probe, or the one trial request
+  `allowRequest` lets through (even with health checks turned off), decides
+  whether it closes again or re-opens for another `openDuration`.  A trial
+  that never reports back is replaced after another `openDuration`.
+  """
+
+  CLOSED = "closed"
+  OPEN = "open"
+  HALF_OPEN = "half-open"
+
+  def __init__(self, failureThreshold = 3, openDuration = 60):
+    self.failureThreshold = failureThreshold
+    self.openDuration = openDuration
+
+    self.state = CircuitBreaker.CLOSED
+    self.consecutiveFailures = 0
+    self.openedAt = None
+    self.lock = threading.Lock()
+
+  def isClosed(self):
+    return self.state == CircuitBreaker.CLOSED
+
+  def allowRequest(self):
+    """Returns True if work may be sent: always when closed, once per `openDuration` otherwise."""
+    with self.lock:
+      if self.state != CircuitBreaker.CLOSED and time.time() - self.openedAt >= self.openDuration:
+        self.state = CircuitBreaker.HALF_OPEN
+        self.openedAt = time.time()
+        return True
+      return self.state == CircuitBreaker.CLOSED
+
+  def readyForProbe(self):
+    """Returns True if a health probe should be sent, moving an expired open circuit to half-open."""
+    with self.lock:
+      if self.state == CircuitBreaker.OPEN and time.time() - self.openedAt >= self.openDuration:
+        self.state = CircuitBreaker.HALF_OPEN
+      return self.state != CircuitBreaker.OPEN
+
+  def recordSuccess(self):
+    with self.lock:
+      self.consecutiveFailures = 0
+      self.state = CircuitBreaker.CLOSED
+      self.openedAt = None
+
+  def recordFailure(self):
+    """Records a failure, returning True if this failure opened the circuit."""
+    with self.lock:
+      self.consecutiveFailures += 1
+      if self.state == CircuitBreaker.HALF_OPEN or (self.state == CircuitBreaker.CLOSED and self.consecutiveFailures >= self.failureThreshold):
+        self.state = CircuitBreaker.OPEN
+        self.openedAt = time.time()
+        return True
+      return False
@@ -0,0 +1,38 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+class CountingThreadPool(ThreadPoolExecutor):
+  """A `ThreadPoolExecutor` that counts the tasks waiting for a thread and running.
+
+  `ThreadPoolExecutor` only knows how many threads it has started, which
+  never goes down once the pool has been busy.  Every submitted task is
+  counted in `queued` until a thread picks it up, then in `active` until it
+  returns, so both can be exported as gauges.
+  """
+
+  def __init__(self, *args, **kwargs):
+    super().__init__(*args, **kwargs)
+    self.countLock = threading.Lock()
+    self.queued = 0
+    self.active = 0
+
+  def submit(self, fn, /, *args, **kwargs):
+    with self.countLock:
+      self.queued += 1
+    try:
+      return super().submit(self.runCounted, fn, args, kwargs)
+    except Exception:
+      # Shut down: the task will never run.
+      with self.countLock:
+        self.queued -= 1
+      raise
+
+  def runCounted(self, fn, args, kwargs):
+    with self.countLock:
+      self.queued -= 1
+      self.active += 1
+    try:
+      return fn(*args, **kwargs)
+    finally:
+      with self.countLock:
+        self.active -= 1
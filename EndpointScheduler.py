@@ -0,0 +1,76 @@
+import collections
+import threading
+
+class EndpointScheduler:
+  """Process-wide concurrency limit for each MMG, shared fairly by every job.
+
+  Each endpoint (keyed by the server's id) may have at most `maxPerEndpoint`
+  requests in flight across all jobs, and only one while its error EWMA is
+  above `maxErrorRate`, so a struggling service is not sent a burst of
+  simultaneous uploads when several jobs start at once.  Requests over the
+  limit wait in a queue per endpoint that is served round-robin across jobs:
+  a job that has just been given a slot goes to the back of the line.
+
+  Like `ReducerDispatcher`, nothing blocks: `acquire` calls back once the
+  endpoint has a free slot, and `release` hands the slot to the next job.
+  """
+
+  def __init__(self, servers, maxPerEndpoint = 2, maxErrorRate = 0.2):
+    self.servers = servers
+    self.maxPerEndpoint = maxPerEndpoint
+    self.maxErrorRate = maxErrorRate
+
+    self.inFlight = {}
+    self.queues = {}
+    self.waiting = 0
+    self.lock = threading.Lock()
+
+  def capacity(self, server):
+    if self.servers.getStats(server).errorEWMA > self.maxErrorRate:
+      return 1
+    return self.maxPerEndpoint
+
+  def acquire(self, server, jobId, callback):
+    """Calls `callback()` once `server` has a free slot; the caller must `release` it afterwards."""
+    with self.lock:
+      jobs = self.queues.setdefault(server["id"], collections.OrderedDict())
+      jobs.setdefault(jobId, collections.deque()).append(callback)
+      self.waiting += 1
+      ready = self.takeReady(server)
+
+    self.runCallbacks(ready)
+
+  def takeReady(self, server):
+    """Takes waiting callbacks, one job at a time in turn, while the endpoint has free slots."""
+    id = server["id"]
+    jobs = self.queues.get(id)
+    ready = []
+    while jobs and self.inFlight.get(id, 0) < self.capacity(server):
+      jobId, callbacks = jobs.popitem(last = False)
+      ready.append(callbacks.popleft())
+      if len(callbacks) > 0:
+        jobs[jobId] = callbacks
+
+      self.inFlight[id] = self.inFlight.get(id, 0) + 1
+      self.waiting -= 1
+
+    if jobs is not None and len(jobs) == 0:
+      del self.queues[id]
+    return ready
+
+  def release(self, server):
+    with self.lock:
+      self.inFlight[server["id"]] -= 1
+      if self.inFlight[server["id"]] == 0:
+        del self.inFlight[server["id"]]
+      ready = self.takeReady(server)
+
+    self.runCallbacks(ready)
+
+  def runCallbacks(self, ready):
+    for callback in ready:
+      try:
+        callback()
+      except Exception:
+        import traceback
+        traceback.print_exc()
@@ -0,0 +1,65 @@
+import concurrent.futures
+import threading
+import time
+
+class HealthMonitor:
+  """Background health checks for every registered MMG and reducer.
+
+  Every `interval` seconds, each enabled server whose circuit is closed or
+  ready to be retried gets a cheap `HEAD` request.  Any response below 500
+  means the service is up (a POST-only route answers 405).  Connection
+  errors, timeouts and 5xx responses count as failures.  The results update
+  the server's `CircuitBreaker` in `ServersCollection`, so `/makeMosaic` only
+  picks servers that are currently reachable.
+  """
+
+  def __init__(self, servers, dispatcher, interval = 30, probeTimeout = 3):
+    self.servers = servers
+    self.dispatcher = dispatcher
+    self.interval = interval
+    self.probeTimeout = probeTimeout
+    self.thread = None
+
+  def start(self):
+    if self.interval <= 0 or self.thread is not None:
+      return
+
+    self.thread = threading.Thread(target = self.run, name = "HealthMonitor", daemon = True)
+    self.thread.start()
+
+  def run(self):
+    while True:
+      time.sleep(self.interval)
+      try:
+        self.checkAll()
+      except Exception:
+        import traceback
+        traceback.print_exc()
+
+  def checkAll(self):
+    probes = []
+    for server in self.servers.enabledMMGs() + self.servers.enabledReducers():
+      if not self.servers.getCircuit(server).readyForProbe():
+        continue
+
+      probes.append(self.dispatcher.executor.submit(self.check, server))
+
+    concurrent.futures.wait(probes)
+
+  def check(self, server):
+    circuit = self.servers.getCircuit(server)
+    try:
+      resp = self.dispatcher.head(server["url"], timeout = self.probeTimeout)
+      error = None
+      if resp.status_code >= 500:
+        error = f"Health check failed: HTTP Status {resp.status_code}"
+    except Exception as e:
+      error = f"Health check failed: {e}"
+
+    if error is None:
+      if not circuit.isClosed():
+        print(f"[HealthMonitor]: {server['url']} is healthy again")
+      circuit.recordSuccess()
+    elif circuit.recordFailure():
+      print(f"[HealthMonitor]: {server['url']} is unhealthy: {error}")
+      self.servers.updateValue(server, "error", error)
@@ -0,0 +1,79 @@
+import struct
+from TransferFormats import RAW_RGB_MAGICS
+
+# JPEG start-of-frame markers (every SOFn except DHT, JPG and DAC):
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def getImageSize(imageBuffer):
+  """Returns the (width, height) of a PNG, JPEG, WebP, GIF or raw RGB image by reading only its header.
+
+  No pixel data is decoded.  Other formats fall back to PIL, which also only
+  reads the header when opening an image.
+  """
+  if imageBuffer[:8] == b"\x89PNG\r\n\x1a\n":
+    return struct.unpack(">II", imageBuffer[16:24])
+
+  if imageBuffer[:2] == b"\xff\xd8":
+    return getJpegSize(imageBuffer)
+
+  if imageBuffer[:4] == b"RIFF" and imageBuffer[8:12] == b"WEBP":
+    return getWebpSize(imageBuffer)
+
+  if imageBuffer[:6] in (b"GIF87a", b"GIF89a"):
+    return struct.unpack("<HH", imageBuffer[6:10])
+
+  if imageBuffer[:4] in RAW_RGB_MAGICS:
+    return struct.unpack(">II", imageBuffer[4:12])
+
+  import io
+  from PIL import Image
+  img = Image.open(io.BytesIO(imageBuffer))
+  return img.width, img.height
+
+
+def getJpegSize(imageBuffer):
+  offset = 2
+  while offset < len(imageBuffer):
+    # Skip to the next marker (markers may be padded with extra 0xFF bytes):
+    if imageBuffer[offset] != 0xFF:
+      raise Exception("Invalid JPEG: expected a marker")
+    while offset < len(imageBuffer) and imageBuffer[offset] == 0xFF:
+      offset += 1
+    marker = imageBuffer[offset]
+    offset += 1
+
+    # Standalone markers have no length:
+    if marker == 0x01 or 0xD0 <= marker <= 0xD7:
+      continue
+
+    (length,) = struct.unpack(">H", imageBuffer[offset:offset + 2])
+    if marker in JPEG_SOF_MARKERS:
+      height, width = struct.unpack(">HH", imageBuffer[offset + 3:offset + 7])
+      return width, height
+
+    offset += length
+
+  raise Exception("Invalid JPEG: no start-of-frame marker found")
+
+
+def getWebpSize(imageBuffer):
+  chunk = imageBuffer[12:16]
+
+  # Lossy: 14-bit dimensions after the VP8 frame tag and start code.
+  if chunk == b"VP8 ":
+    width, height = struct.unpack("<HH", imageBuffer[26:30])
+    return width & 0x3FFF, height & 0x3FFF
+
+  # Lossless: 14-bit (dimension - 1) values packed after the signature byte.
+  if chunk == b"VP8L":
+    (bits,) = struct.unpack("<I", imageBuffer[21:25])
+    return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+
+  # Extended: 24-bit (dimension - 1) values.
+  if chunk == b"VP8X":
+    width = int.from_bytes(imageBuffer[24:27], "little") + 1
+    height = int.from_bytes(imageBuffer[27:30], "little") + 1
+    return width, height
+
+  raise Exception(f"Invalid WebP: unknown chunk {chunk}")
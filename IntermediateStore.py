@@ -0,0 +1,98 @@
+import io
+import os
+import shutil
+import tempfile
+import threading
+from Metrics import Metrics
+
+class IntermediateStore:
+  """Per-job store of intermediate mosaics with a memory budget.
+
+  Mosaics are kept in memory while the job's total stays under
+  `memoryBudget` bytes; any mosaic that would go over it is written to a
+  temporary file instead.  `open` returns a `(file, size)` pair that can be
+  streamed into an upload (see `MultipartBody`) without copying the mosaic,
+  and `discard` frees a mosaic once it has been reduced.  `close` removes
+  every spilled file.
+  """
+
+  def __init__(self, memoryBudget = 64000000, directory = None, metrics = None):
+    self.memoryBudget = memoryBudget
+    self.directory = directory
+    self.spillDirectory = None
+
+    self.lock = threading.Lock()
+    self.nextKey = 1
+    self.inMemory = {}
+    self.spilled = {}
+    self.memoryBytes = 0
+    self.closed = False
+
+    if metrics is None:
+      metrics = Metrics()
+    self.metrics = metrics
+    metrics.counter("mosaic_intermediate_spilled_bytes_total", "Bytes of intermediate mosaics written to disk because a job's memory budget was used up")
+
+  def put(self, data):
+    with self.lock:
+      key = self.nextKey
+      self.nextKey += 1
+
+      if self.closed or self.memoryBytes + len(data) <= self.memoryBudget:
+        self.inMemory[key] = data
+        self.memoryBytes += len(data)
+        return key
+
+      if self.spillDirectory is None:
+        self.spillDirectory = tempfile.mkdtemp(prefix = "mosaic-", dir = self.directory)
+      path = os.path.join(self.spillDirectory, str(key))
+
+    with open(path, "wb") as f:
+      f.write(data)
+
+    with self.lock:
+      self.spilled[key] = (path, len(data))
+    self.metrics.increment("mosaic_intermediate_spilled_bytes_total", len(data))
+    return key
+
+  def get(self, key):
+    with self.lock:
+      if key in self.inMemory:
+        return self.inMemory[key]
+      path, size = self.spilled[key]
+
+    with open(path, "rb") as f:
+      return f.read()
+
+  def open(self, key):
+    """Returns `(file, size)` for streaming a mosaic; the caller closes the file."""
+    with self.lock:
+      if key in self.inMemory:
+        data = self.inMemory[key]
+        # BytesIO shares the bytes object's buffer until it is written to:
+        return io.BytesIO(data), len(data)
+      path, size = self.spilled[key]
+
+    return open(path, "rb"), size
+
+  def discard(self, key):
+    with self.lock:
+      if key in self.inMemory:
+        self.memoryBytes -= len(self.inMemory.pop(key))
+        return
+      path, size = self.spilled.pop(key, (None, 0))
+
+    if path is not None:
+      try:
+        os.remove(path)
+      except OSError:
+        pass
+
+  def close(self):
+    with self.lock:
+      self.closed = True
+      spillDirectory = self.spillDirectory
+      self.spilled = {}
+
+    if spillDirectory is not None:
+      shutil.rmtree(spillDirectory, ignore_errors = True)
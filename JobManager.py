@@ -0,0 +1,134 @@
+import collections
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from Metrics import Metrics
+
+class JobManager:
+  """Runs mosaic jobs in the background with bounded admission.
+
+  At most `maxRunningJobs` jobs run at once, each on its own thread; up to
+  `maxQueuedJobs` more wait in a FIFO queue.  A job that runs on several
+  threads (a strip-sharded job, one thread per strip) counts as that many
+  jobs, both when it is admitted and while it runs.  `submit` returns None when the
+  queue is full so the caller can push back on the client (HTTP 429).  The
+  status of the last `maxJobHistory` jobs is kept for `/job/<jobId>`.
+  """
+
+  def __init__(self, maxRunningJobs = 8, maxQueuedJobs = 32, maxJobHistory = 1000, metrics = None):
+    self.maxRunningJobs = maxRunningJobs
+    self.maxQueuedJobs = maxQueuedJobs
+    self.maxJobHistory = maxJobHistory
+
+    self.executor = ThreadPoolExecutor(max_workers = maxRunningJobs, thread_name_prefix = "MosaicJob")
+    self.lock = threading.Lock()
+    self.threadsFreed = threading.Condition(self.lock)
+    self.startOrder = collections.deque()
+    self.jobs = collections.OrderedDict()
+    self.queued = 0
+    self.running = 0
+
+    if metrics is None:
+      metrics = Metrics()
+    self.metrics = metrics
+    metrics.counter("mosaic_jobs_rejected_total", "Mosaic jobs refused because the job queue was full")
+
+  def submit(self, jobId, task, threads = 1):
+    """Queues `task()` as job `jobId`, returning the job's status, or None if the queue is full.
+
+    `threads` is the number of threads `task` runs on (it always gets to run,
+    so it is capped at `maxRunningJobs`).
+    """
+    threads = max(1, min(threads, self.maxRunningJobs))
+    with self.lock:
+      if self.queued + self.running + threads > self.maxRunningJobs + self.maxQueuedJobs:
+        self.metrics.increment("mosaic_jobs_rejected_total")
+        return None
+
+      job = {
+        "jobId": jobId,
+        "status": "queued",
+        "submitted": time.time(),
+        "started": None,
+        "finished": None,
+        "result": None,
+        "error": None,
+        "threads": threads,
+      }
+      self.jobs[jobId] = job
+      self.queued += threads
+      self.trimHistory()
+      status = self.status(job)
+
+    self.executor.submit(self.run, job, task)
+    return status
+
+  def run(self, job, task):
+    with self.lock:
+      # Jobs start in order, each once enough threads are free for it:
+      self.startOrder.append(job)
+      while self.startOrder[0] is not job or self.running + job["threads"] > self.maxRunningJobs:
+        self.threadsFreed.wait()
+      self.startOrder.popleft()
+      self.threadsFreed.notify_all()
+
+      self.queued -= job["threads"]
+      self.running += job["threads"]
+      job["status"] = "running"
+      job["started"] = time.time()
+
+    try:
+      result = task()
+      status, error = "done", None
+    except Exception as e:
+      import traceback
+      traceback.print_exc()
+      result, status, error = None, "failed", str(e)
+
+    with self.lock:
+      self.running -= job["threads"]
+      self.threadsFreed.notify_all()
+      job["status"] = status
+      job["result"] = result
+      job["error"] = error
+      job["finished"] = time.time()
+
+  def trimHistory(self):
+    # Only finished jobs are forgotten; queued and running jobs always have a status:
+    for jobId in list(self.jobs.keys()):
+      if len(self.jobs) <= self.maxJobHistory:
+        break
+      if self.jobs[jobId]["finished"] is not None:
+        del self.jobs[jobId]
+
+  def status(self, job):
+    status = {
+      "jobId": job["jobId"],
+      "status": job["status"],
+      "statusUrl": f"/job/{job['jobId']}",
+    }
+
+    if job["status"] == "queued":
+      position = 0
+      for other in self.jobs.values():
+        if other is job:
+          break
+        if other["status"] == "queued":
+          position += 1
+      status["queuePosition"] = position
+    elif job["status"] == "done":
+      status.update(job["result"])
+    elif job["status"] == "failed":
+      status["error"] = job["error"]
+
+    if job["finished"] is not None:
+      status["seconds"] = round(job["finished"] - job["started"], 3)
+
+    return status
+
+  def get(self, jobId):
+    with self.lock:
+      job = self.jobs.get(jobId)
+      if job is None:
+        return None
+      return self.status(job)
@@ -0,0 +1,93 @@
+import io
+import numpy as np
+from PIL import Image
+from TransferFormats import getTransferFormat, openImage
+
+class LocalReducer:
+  """Built-in reducer for one job, used when no remote reducer is healthy.
+
+  For every tile position, the tile from `mosaic1` or `mosaic2` whose pixels
+  are closer (by sum of squared differences) to the same region of the base
+  image is kept.  The base image is resized to the mosaic size once per job,
+  and the comparison is a handful of vectorized NumPy operations over the
+  whole mosaic, so most of the time is spent decoding and encoding images.
+
+  It is also the reference implementation `/testMosaic` compares reducers to.
+  """
+
+  def __init__(self, baseImage, tilesAcross, renderedTileSize, fileFormat):
+    self.baseImage = baseImage
+    self.tilesAcross = tilesAcross
+    self.renderedTileSize = renderedTileSize
+    self.fileFormat = fileFormat
+    self.base = None
+
+  def decode(self, image):
+    with openImage(image) as img:
+      return np.asarray(img.convert("RGB"), dtype = np.int32)
+
+  def encode(self, pixels, transferFormat = None):
+    img = Image.fromarray(pixels.astype(np.uint8), "RGB")
+    if transferFormat is not None:
+      return getTransferFormat(transferFormat).encode(img)
+
+    buffer = io.BytesIO()
+    if self.fileFormat.upper() == "PNG":
+      img.save(buffer, "PNG", compress_level = 1)
+    else:
+      img.save(buffer, self.fileFormat)
+    return buffer.getvalue()
+
+  def baseFor(self, height, width):
+    """The base image resized to the mosaic's size (computed once)."""
+    if self.base is None or self.base.shape[:2] != (height, width):
+      with Image.open(io.BytesIO(self.baseImage)) as img:
+        resized = img.convert("RGB").resize((width, height), Image.BOX)
+      self.base = np.asarray(resized, dtype = np.int32)
+    return self.base
+
+  def tiles(self, pixels):
+    """Views an (H, W, 3) mosaic as (verticalTiles, tileSize, tilesAcross, tileSize, 3)."""
+    height, width, _ = pixels.shape
+    size = self.renderedTileSize
+    return pixels.reshape(height // size, size, width // size, size, 3)
+
+  def tileDistances(self, pixels, base):
+    difference = self.tiles(pixels) - self.tiles(base)
+    return np.einsum("aibjc,aibjc->ab", difference, difference)
+
+  def chooseTiles(self, pixels1, pixels2):
+    """Returns a (verticalTiles, tilesAcross) mask that is True where `pixels1`'s tile is kept."""
+    if pixels1.shape != pixels2.shape:
+      raise Exception(f"Mosaics have different sizes: {pixels1.shape[1]} x {pixels1.shape[0]} and {pixels2.shape[1]} x {pixels2.shape[0]}")
+
+    base = self.baseFor(pixels1.shape[0], pixels1.shape[1])
+    return self.tileDistances(pixels1, base) <= self.tileDistances(pixels2, base)
+
+  def reduce(self, mosaic1, mosaic2, transferFormat = None):
+    """Reduces two mosaics (in any format), returning the result in `fileFormat` or `transferFormat`."""
+    pixels1 = self.decode(mosaic1)
+    pixels2 = self.decode(mosaic2)
+    keep1 = self.chooseTiles(pixels1, pixels2)
+
+    result = np.where(keep1[:, None, :, None, None], self.tiles(pixels1), self.tiles(pixels2))
+    return self.encode(result.reshape(pixels1.shape), transferFormat)
+
+  def compare(self, mosaic1, mosaic2, reduced):
+    """Checks a reducer's output against this reducer.
+
+    Returns the fraction of tiles that are an unchanged tile of either input,
+    and the fraction that are the same tile this reducer would have chosen.
+    """
+    pixels1 = self.decode(mosaic1)
+    pixels2 = self.decode(mosaic2)
+    pixelsReduced = self.decode(reduced)
+    keep1 = self.chooseTiles(pixels1, pixels2)
+
+    tilesReduced = self.tiles(pixelsReduced)
+    from1 = (tilesReduced == self.tiles(pixels1)).all(axis = (1, 3, 4))
+    from2 = (tilesReduced == self.tiles(pixels2)).all(axis = (1, 3, 4))
+
+    fromInputs = (from1 | from2).mean()
+    agreement = np.where(keep1, from1, from2).mean()
+    return float(fromInputs), float(agreement)
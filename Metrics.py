@@ -0,0 +1,97 @@
+import threading
+
+class Metrics:
+  """In-process counters, histograms and gauges, rendered in the Prometheus text format.
+
+  Metrics are registered once with `counter`, `histogram` or `gauge` and then
+  updated with `increment` and `observe`, passing labels as keyword
+  arguments.  Registering a name again is a no-op, so short-lived objects
+  (like a job's `MosaicWorker`) can register what they use.  A gauge is a
+  function that is read when the metrics are rendered, so queue depths and
+  pool sizes cost nothing between scrapes.
+  """
+
+  LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.help = {}
+    self.types = {}
+    self.counters = {}
+    self.histograms = {}
+    self.buckets = {}
+    self.gauges = {}
+
+  def counter(self, name, help):
+    self.register(name, help, "counter", self.counters, {})
+
+  def histogram(self, name, help, buckets = LATENCY_BUCKETS):
+    self.buckets.setdefault(name, buckets)
+    self.register(name, help, "histogram", self.histograms, {})
+
+  def gauge(self, name, help, read):
+    self.register(name, help, "gauge", self.gauges, read)
+
+  def register(self, name, help, type, metrics, value):
+    with self.lock:
+      if name in self.types:
+        return
+      self.help[name] = help
+      self.types[name] = type
+      metrics[name] = value
+
+  def increment(self, name, amount = 1, **labels):
+    key = tuple(sorted(labels.items()))
+    with self.lock:
+      series = self.counters[name]
+      series[key] = series.get(key, 0) + amount
+
+  def observe(self, name, value, **labels):
+    key = tuple(sorted(labels.items()))
+    with self.lock:
+      series = self.histograms[name]
+      if key not in series:
+        series[key] = {"buckets": [0] * len(self.buckets[name]), "sum": 0, "count": 0}
+
+      histogram = series[key]
+      for i, bound in enumerate(self.buckets[name]):
+        if value <= bound:
+          histogram["buckets"][i] += 1
+      histogram["sum"] += value
+      histogram["count"] += 1
+
+  def formatLabels(self, labels):
+    if len(labels) == 0:
+      return ""
+
+    def escape(value):
+      return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+    return "{" + ",".join(f"{key}=\"{escape(value)}\"" for key, value in labels) + "}"
+
+  def render(self):
+    # Gauges may take other components' locks, so they are read before this one:
+    gaugeValues = {name: read() for name, read in list(self.gauges.items())}
+
+    lines = []
+    with self.lock:
+      for name in self.types:
+        lines.append(f"# HELP {name} {self.help[name]}")
+        lines.append(f"# TYPE {name} {self.types[name]}")
+
+        if name in self.counters:
+          for labels, value in self.counters[name].items():
+            lines.append(f"{name}{self.formatLabels(labels)} {value}")
+
+        elif name in self.histograms:
+          for labels, histogram in self.histograms[name].items():
+            for bound, count in zip(self.buckets[name], histogram["buckets"]):
+              lines.append(f"{name}_bucket{self.formatLabels(labels + (('le', bound),))} {count}")
+            lines.append(f"{name}_bucket{self.formatLabels(labels + (('le', '+Inf'),))} {histogram['count']}")
+            lines.append(f"{name}_sum{self.formatLabels(labels)} {histogram['sum']}")
+            lines.append(f"{name}_count{self.formatLabels(labels)} {histogram['count']}")
+
+        else:
+          lines.append(f"{name} {gaugeValues[name]}")
+
+    return "\n".join(lines) + "\n"
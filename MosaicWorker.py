@@ -1,25 +1,55 @@
-import requests
+import collections
+import hashlib
 import random
-import concurrent
-import queue
+import secrets
+import threading
+import time
+from ReductionScheduler import BalancedReductionScheduler
+from ImageHeader import getImageSize
+from Metrics import Metrics
+from IntermediateStore import IntermediateStore
+from EndpointScheduler import EndpointScheduler
+from TimeoutPolicy import TimeoutPolicy
+from TransferFormats import containerOf, fileFormatContainer, getTransferFormat, supportedTransferFormats, transcode
 
 class MosaicWorker:
-  def __init__(self, baseImage, tilesAcross, renderedTileSize, fileFormat, socketio, servers, threadPool, socketio_filter = ""):
+  def __init__(self, baseImage, tilesAcross, renderedTileSize, fileFormat, previewStream, servers, threadPool, dispatcher, reducerDispatcher, socketio_filter = "", socketRoom = None, reductionScheduler = None, hedgePercentile = None, mmgCutoff = None, baseImageDigest = None, baseImageUrl = None, maxConcurrentMMGs = None, maxConcurrentReductions = None, metrics = None, resultCache = None, localReducer = None, intermediateStore = None, endpointScheduler = None, timeoutPolicy = None, deadline = None, transferFormats = None, publishFinal = True):
     self.baseImage = baseImage
     self.tilesAcross = tilesAcross
     self.renderedTileSize = renderedTileSize
     self.fileFormat = fileFormat
-    self.socketio = socketio
+
+    # The base image never changes, so the mosaic size every result must have is computed once:
+    try:
+      self.baseWidth, self.baseHeight = getImageSize(baseImage)
+    except Exception as e:
+      raise Exception(f"Unable to read the base image: {e}")
+
+    d = self.baseWidth / self.tilesAcross
+    verticalTiles = int(self.baseHeight / d)
+    self.requiredWidth = int(self.tilesAcross * self.renderedTileSize)
+    self.requiredHeight = int(verticalTiles * self.renderedTileSize)
+    self.jobId = secrets.token_hex(8)
+    self.previewStream = previewStream
+    self.socketRoom = socketRoom
     self.servers = servers
     self.socketio_filter = socketio_filter
+    self.previewStream.startJob(self.socketRoom)
+
+    # When the base image is published in a `BaseImageStore`, services with the
+    # `baseImageDigest` capability are sent only its digest and URL:
+    self.baseImageDigest = baseImageDigest
+    self.baseImageUrl = baseImageUrl
     
     self.mmgsAvailable = []
     self.reducersAvailable = []
     self.reductionJobs = []
-    self.reducerBlockingQueue = queue.Queue()
 
-    self.mmgTasks = []
-    self.reducerTasks = []
+    # Mosaics waiting to be reduced are kept in `intermediateStore` (referenced by
+    # each reduction job's "mosaicKey"), which spills them to disk past its budget:
+    if intermediateStore is None:
+      intermediateStore = IntermediateStore(metrics = metrics)
+    self.intermediateStore = intermediateStore
 
     self.mmgCompleted = 0
     self.reducerCompleted = 0
@@ -27,7 +57,108 @@ class MosaicWorker:
     self.expectedMosaics = -1   # Always (2*MG - 1) mosaics w/ reductions; start with -1 and always add 2.
     self.disableReduce = False
 
+    # Reduction scheduling: `reductionJobs` holds mosaics waiting to be reduced and the
+    # scheduler decides which two are reduced next.  Tracking outstanding MMGs and
+    # in-flight reductions lets the scheduler know when no more mosaics can arrive.
+    if reductionScheduler is None:
+      reductionScheduler = BalancedReductionScheduler()
+    self.reductionScheduler = reductionScheduler
+    self.schedulerLock = threading.Lock()
+    self.mmgOutstanding = 0
+    self.reductionsInFlight = 0
+    self.treeDepth = 0
+
+    # Reductions are driven by callbacks instead of waiting threads; `jobFinished`
+    # is set once no more mosaics can arrive (or the job has failed with `jobError`).
+    self.jobFinished = threading.Event()
+    self.jobError = None
+
+    # Straggler handling (per job): a reduction running past the `hedgePercentile` latency
+    # percentile is duplicated to a second reducer, and MMGs that have not responded
+    # within `mmgCutoff` seconds are no longer waited on.  `mmgPending` holds the ids
+    # of MMGs whose result is still wanted.
+    if hedgePercentile is not None and not 0 <= hedgePercentile <= 100:
+      raise Exception(f"The hedge percentile must be between 0 and 100 (not {hedgePercentile}).")
+    self.hedgePercentile = hedgePercentile
+    self.mmgCutoff = mmgCutoff
+    self.mmgPending = set()
+    self.mosaicsBeingReduced = {}
+    self.hedgesSent = 0
+    self.hedgesWon = 0
+    self.mmgStragglersCut = 0
+
+    # Per-job concurrency caps (None is unlimited), so one large job cannot take
+    # every thread in the shared `threadPool`.  MMGs beyond the cap wait in
+    # `mmgQueue` and are started as earlier ones finish.
+    self.maxConcurrentMMGs = maxConcurrentMMGs
+    self.maxConcurrentReductions = maxConcurrentReductions
+    self.mmgQueue = collections.deque()
+    self.mmgsRunning = 0
+    self.mmgsFinished = threading.Event()
+
+    # Requests time out based on each service's observed latency.  Once the
+    # optional `deadline` (seconds after the job was submitted) has passed, no
+    # new work is started (`isStopped`) and the most-reduced mosaic is returned.
+    # The deadline is on the monotonic clock `Event.wait` timeouts use:
+    if timeoutPolicy is None:
+      timeoutPolicy = TimeoutPolicy(servers)
+    self.timeoutPolicy = timeoutPolicy
+    self.deadline = None
+    if deadline is not None:
+      self.deadline = time.monotonic() + deadline
+    self.isStopped = False
+
+    # Intermediate mosaics are requested in the first of `transferFormats` (most
+    # preferred first) that every reducer of the job accepts, from services with
+    # its `transferFormat:NAME` capability.  Only mosaics a service cannot read,
+    # and the final result, are converted to the user's `fileFormat`:
+    self.transferFormats = transferFormats or []
+    self.fileContainer = fileFormatContainer(fileFormat)
+
+    # Every MMG request also waits for a slot at its endpoint, which is shared
+    # fairly with the other jobs calling the same MMG:
+    if endpointScheduler is None:
+      endpointScheduler = EndpointScheduler(servers)
+    self.endpointScheduler = endpointScheduler
+
+    # When none of the job's reducers is healthy, reductions fall back to the
+    # built-in `localReducer` (if given) instead of failing the job:
+    self.localReducer = localReducer
+    self.allowLocalReduction = localReducer is not None
+    self.localReductions = 0
+
+    # Mosaics byte-identical to one waiting to be reduced or being reduced (e.g.
+    # from cloned MMGs) are merged into it instead of being reduced with it,
+    # which would only produce the same mosaic again.  `mosaicsByDigest` maps
+    # SHA-256 digests to reduction jobs:
+    self.mosaicsByDigest = {}
+    self.duplicatesMerged = 0
+
+    # MMG results are looked up in (and added to) `resultCache` when it is set:
+    self.resultCache = resultCache
+    self.mmgCacheHits = 0
+
+    # The final mosaic is saved and published unless `publishFinal` is False (a
+    # strip of a `StripShardedJob`); either way, it is kept in `finalMosaicImage`:
+    self.publishFinal = publishFinal
+    self.finalMosaic = None
+    self.finalMosaicImage = None
+
     self.threadPool = threadPool
+    self.dispatcher = dispatcher
+    self.reducerDispatcher = reducerDispatcher
+
+    if metrics is None:
+      metrics = Metrics()
+    self.metrics = metrics
+    metrics.histogram("mosaic_service_request_seconds", "Latency of MMG and reducer responses, by service")
+    metrics.counter("mosaic_service_requests_total", "MMG and reducer requests, by service and outcome")
+    metrics.histogram("mosaic_job_phase_seconds", "Duration of each phase of a mosaic job (mmg, reduce, save)")
+    metrics.counter("mosaic_transcodes_total", "Mosaics converted from a transfer format, by reason (reducer, final)")
+    metrics.counter("mosaic_duplicate_mosaics_total", "Rendered mosaics merged into an identical pending mosaic instead of being reduced")
+    metrics.counter("mosaic_hedges_sent_total", "Duplicate reducer requests sent for reductions running past the hedge percentile")
+    metrics.counter("mosaic_hedges_won_total", "Hedged reductions whose duplicate request answered first")
+    metrics.counter("mosaic_mmg_stragglers_cut_total", "MMGs no longer waited on after the MMG cutoff or the deadline")
 
   def addMMG(self, mmg):
     self.mmgsAvailable.append(mmg)
@@ -36,37 +167,15 @@ class MosaicWorker:
   def addReducer(self, reducer):
     self.reducersAvailable.append(reducer)
 
-  def getImageSize(self, imageBuffer):
-    import struct
-    import io
-    from PIL import Image
-
-    ## Check if PNG, just read from IHDR:
-    if imageBuffer[0] == 137 and imageBuffer[1] == 80:
-      width, height = struct.unpack('>ii', imageBuffer[16:24])
-
-    ## Otherwise, use PIL:
-    else:
-      img = Image.open(io.BytesIO(imageBuffer))
-      width = img.width 
-      height = img.height
-
-    return width, height
-
-
-  def validateMosaicImageSize(self, server, baseImage, mosaicImage):
+  def validateMosaicImageSize(self, server, mosaicImage):
     try:
-      baseWidth, baseHeight = self.getImageSize(baseImage)
-      mosaicWidth, mosaicHeight = self.getImageSize(mosaicImage)
+      mosaicWidth, mosaicHeight = getImageSize(mosaicImage)
     except Exception as e:
       self.servers.updateValue(server, "error", f"Image Error: {e}")
       return False
 
-    d = baseWidth / self.tilesAcross
-    verticalTiles = int(baseHeight / d)
- 
-    requiredWidth = int(self.tilesAcross * self.renderedTileSize)
-    requiredHeight = int(verticalTiles * self.renderedTileSize)
+    requiredWidth = self.requiredWidth
+    requiredHeight = self.requiredHeight
 
     if mosaicWidth != requiredWidth or mosaicHeight != requiredHeight:
       self.servers.updateValue(server, "error", f"Invalid mosaic image size: required ({requiredWidth} x {requiredHeight}), but mosaic was ({mosaicWidth}, {mosaicHeight})")
@@ -75,179 +184,834 @@ class MosaicWorker:
     return True
 
 
-  def saveImage(self, info):
+  def saveImage(self, info, mosaicImage = None):
     import time
     import os
 
+    if mosaicImage is None:
+      mosaicImage = self.finalImage(info)
+
     fileName = os.path.join("mosaics", f"{int(time.time() * 1000)}_{info['tiles']}_{info['mosaics']}.{self.fileFormat.lower()}")
     with open(fileName, "wb") as f:
-      f.write(info["mosaicImage"])
+      f.write(mosaicImage)
+
+  def finalImage(self, info):
+    """A stored mosaic, converted to the user's `fileFormat` if it is in a transfer format."""
+    mosaicImage = self.intermediateStore.get(info["mosaicKey"])
+    if info.get("container") in (None, self.fileContainer):
+      return mosaicImage
+
+    self.metrics.increment("mosaic_transcodes_total", reason = "final")
+    return transcode(mosaicImage, self.fileFormat)
+
+  def mergeDuplicate(self, digest, description, tiles, mosaics):
+    """Merges a mosaic into an identical one that is not reduced yet, returning False if there is none."""
+    with self.schedulerLock:
+      if self.disableReduce:
+        # Test jobs report every mosaic on its own:
+        return False
+
+      existing = self.mosaicsByDigest.get(digest)
+      if existing is None or existing.get("isReduced"):
+        return False
+      isPending = any(job is existing for job in self.reductionJobs)
+      if not isPending and self.mosaicsBeingReduced.get(existing["id"]) is not existing:
+        return False
+
+      # The merged mosaic stands for both, so one fewer mosaic and one fewer reduction are expected:
+      existing["tiles"] += tiles
+      existing["mosaics"] += mosaics
+      self.expectedMosaics -= 2
+      self.duplicatesMerged += 1
+      mosaicID = existing["id"]
+
+    self.metrics.increment("mosaic_duplicate_mosaics_total")
+    print(f"[MosaicWorker]: --> {description} is identical to #{mosaicID}; merged")
+    return True
+
+  def reductionTotals(self, mosaics):
+    """The tiles and MMG results in a finished reduction of `mosaics`.
 
-  def processRenderedMosaic(self, mosaicImage, description, tiles, mosaics):
+    Called with `schedulerLock` held.  The mosaics are marked as reduced, so
+    no further duplicates are merged into them (and left uncounted).
+    """
+    for mosaic in mosaics:
+      mosaic["isReduced"] = True
+    return sum(mosaic["tiles"] for mosaic in mosaics), sum(mosaic["mosaics"] for mosaic in mosaics)
+
+  def processRenderedMosaic(self, mosaicImage, description, tiles, mosaics, depth = 0, sources = None):
     """Stores a rendered mosaic, queueing up reduction or further reduction if possible."""
-    print(f"[MosaicWorker]: --> Storing mosaic result as #{self.mosaicNextID}")
+    digest = hashlib.sha256(mosaicImage).hexdigest()
+    if self.mergeDuplicate(digest, description, tiles, mosaics):
+      return
+
+    mosaicKey = self.intermediateStore.put(mosaicImage)
+
+    with self.schedulerLock:
+      mosaicID = self.mosaicNextID
+      self.mosaicNextID = self.mosaicNextID + 1
+
+      reductionJob = {
+        "mosaicKey": mosaicKey,
+        "id": mosaicID,
+        "tiles": tiles,
+        "mosaics": mosaics,
+        "description": description,
+        "depth": depth,
+        "sources": sources,
+        "container": containerOf(mosaicImage),
+      }
+      self.reductionJobs.append(reductionJob)
+      self.mosaicsByDigest[digest] = reductionJob
+      self.treeDepth = max(self.treeDepth, depth)
+
+    print(f"[MosaicWorker]: --> Storing mosaic result as #{mosaicID}")
 
 
     mosaicInfo = {
-      "image": mosaicImage,
-      "id": self.mosaicNextID,
+      "id": mosaicID,
       "description": description,
       "tiles": tiles,
       "mosaics": mosaics,
+      "depth": depth,
     }
-    self.socketio.emit("mosaic" + self.socketio_filter, mosaicInfo)
+    self.previewStream.publishMosaic(self.socketRoom, "mosaic" + self.socketio_filter, mosaicInfo, mosaicImage)
 
     import random
     if random.randint(1, 100) == 100:
-      self.saveImage(mosaicInfo)
-
-
-    self.reductionJobs.append({
-      "mosaicImage": mosaicImage,
-      "id": self.mosaicNextID,
-      "tiles": tiles,
-      "mosaics": mosaics,
-      "description": description,
-    })
+      self.saveImage(reductionJob)
 
-    self.socketio.emit("progress update" + self.socketio_filter, {
-      "current": self.mosaicNextID,
+    self.previewStream.publishProgress(self.socketRoom, "progress update" + self.socketio_filter, {
+      "current": mosaicID,
       "total": self.expectedMosaics,
     })
-    self.mosaicNextID = self.mosaicNextID + 1
 
-    if len(self.reductionJobs) >= 2 and not self.disableReduce:
-      mosaic1 = self.reductionJobs.pop()
-      mosaic2 = self.reductionJobs.pop()
+    self.scheduleReductions()
+
+
+  def scheduleReductions(self):
+    """Starts every reduction the scheduler is willing to start right now."""
+    pairs = []
+    with self.schedulerLock:
+      if not self.disableReduce and self.jobError is None and not self.isStopped:
+        draining = self.mmgOutstanding == 0 and self.reductionsInFlight == 0
+        while True:
+          if self.maxConcurrentReductions is not None and self.reductionsInFlight >= self.maxConcurrentReductions:
+            break
+
+          pair = self.reductionScheduler.selectPair(self.reductionJobs, draining)
+          if pair is None:
+            break
+
+          self.reductionsInFlight += 1
+          draining = False
+          pairs.append(pair)
+          for mosaic in pair:
+            self.mosaicsBeingReduced[mosaic["id"]] = mosaic
+
+      if self.mmgOutstanding == 0 and self.reductionsInFlight == 0:
+        self.jobFinished.set()
+
+    for mosaic1, mosaic2 in pairs:
+      self.dispatchReduction(mosaic1, mosaic2)
+
+
+  def failJob(self, error):
+    print(f"[MosaicWorker]: Job failed: {error}")
+    with self.schedulerLock:
+      if self.jobError is None:
+        self.jobError = error
+    # `renderMosaic` may still be waiting for the MMGs:
+    self.mmgsFinished.set()
+    self.jobFinished.set()
+
+
+  def failReduction(self, error):
+    """Fails the job because a reduction could not be started (or finished) at all."""
+    import traceback
+    traceback.print_exc()
+    with self.schedulerLock:
+      self.reductionsInFlight -= 1
+    self.failJob(error)
+
+
+  def discardMosaics(self, *mosaics):
+    """Frees mosaics that have been reduced (and so are no longer needed)."""
+    for mosaic in mosaics:
+      with self.schedulerLock:
+        self.mosaicsBeingReduced.pop(mosaic["id"], None)
+      self.intermediateStore.discard(mosaic["mosaicKey"])
+
 
-      reducerTask = self.threadPool.submit(self.awaitReducer, mosaic1, mosaic2)
-      self.reducerTasks.append(reducerTask)
-     
+  def finishReduction(self):
+    with self.schedulerLock:
+      self.reductionsInFlight -= 1
+    self.scheduleReductions()
 
-  def sendRequest2(self, url, files):
-    resp = requests.post(
-      f'{url}?tilesAcross={self.tilesAcross}&renderedTileSize={self.renderedTileSize}&fileFormat={self.fileFormat}',
+
+  def requestParams(self, transferFormat = None):
+    params = {
+      "tilesAcross": self.tilesAcross,
+      "renderedTileSize": self.renderedTileSize,
+      "fileFormat": self.fileFormat,
+    }
+    if transferFormat is not None:
+      params["transferFormat"] = transferFormat
+    return params
+
+
+  def sendRequest2(self, url, files, data = None, timeout = None, transferFormat = None):
+    resp = self.dispatcher.post(
+      url,
+      params = self.requestParams(transferFormat),
       files = files,
-      timeout = 15,
+      data = data,
+      timeout = timeout,
     )
     return resp
 
 
-  def awaitReducer(self, mosaic1, mosaic2):
+  def remainingTime(self):
+    """Seconds left before the job's deadline, or None without a deadline."""
+    if self.deadline is None:
+      return None
+    return max(0, self.deadline - time.monotonic())
+
+
+  def requestTimeout(self, server):
+    """The server's adaptive timeout, cut short by the job's deadline (nothing arriving after it is used)."""
+    timeout = self.timeoutPolicy.timeout(server)
+    remaining = self.remainingTime()
+    if remaining is not None:
+      timeout = max(0.1, min(timeout, remaining))
+    return timeout
+
+
+  def baseImageFields(self, server, fileName, files):
+    """Adds the base image to a request as `fileName`, or by reference if `server` supports it.
+
+    Returns the `(files, data)` to send.
+    """
+    if self.baseImageDigest is not None and self.servers.hasCapability(server, "baseImageDigest"):
+      return files, {"baseImageDigest": self.baseImageDigest, "baseImageUrl": self.baseImageUrl}
+
+    files[fileName] = self.baseImage
+    return files, None
+
+
+  def acceptedTransferFormats(self, server):
+    return [name for name in self.servers.capabilityValues(server, "transferFormat") if name in supportedTransferFormats()]
+
+
+  def preferredTransferFormat(self):
+    """The first of `transferFormats` every reducer of the job accepts, or None to use `fileFormat`."""
+    # Without reducers, no service would read an intermediate mosaic in a transfer format:
     if len(self.reducersAvailable) == 0:
-      raise Exception("No reducers are available on this server.")
+      return None
+
+    for name in self.transferFormats:
+      if name not in supportedTransferFormats():
+        continue
+      if all(name in self.acceptedTransferFormats(reducer) for reducer in self.reducersAvailable):
+        return name
+    return None
+
+
+  def outputTransferFormat(self, server):
+    """The transfer format to request `server`'s mosaic in, or None for `fileFormat`."""
+    name = self.preferredTransferFormat()
+    if name is not None and name in self.acceptedTransferFormats(server):
+      return name
+    return None
+
+
+  def mosaicFile(self, server, mosaic):
+    """A stored mosaic to send to `server`, converted to `fileFormat` if the server cannot read it."""
+    container = mosaic.get("container")
+    if container in (None, self.fileContainer):
+      return self.intermediateStore.open(mosaic["mosaicKey"])
+
+    if any(getTransferFormat(name).container == container for name in self.acceptedTransferFormats(server)):
+      return self.intermediateStore.open(mosaic["mosaicKey"])
 
-    print(f'[MosaicWorker]: Sending reduce request for #{mosaic1["id"]} and #{mosaic2["id"]}')
+    self.metrics.increment("mosaic_transcodes_total", reason = "reducer")
+    return transcode(self.intermediateStore.get(mosaic["mosaicKey"]), self.fileFormat)
 
-    reducer = self.reducerBlockingQueue.get()    
-    url = reducer["url"]
-    print(f'[MosaicWorker]:   url: {url}, queue: {self.reducerBlockingQueue.qsize()}')
 
+  def removeReducer(self, reducer):
+    # Remove bad reducer so this job stops sending work to it:
+    if reducer in self.reducersAvailable:
+      self.reducersAvailable.remove(reducer)
+      self.reducerDispatcher.refresh()
 
-    req = None
+
+  def reducerBatchSize(self, reducer):
+    """How many mosaics `reducer` merges per request: K with the `reduceBatch:K` capability, otherwise 2."""
+    batchSize = self.servers.capabilityValue(reducer, "reduceBatch")
+    try:
+      return max(2, int(batchSize))
+    except (TypeError, ValueError):
+      return 2
+
+
+  def describeMosaics(self, mosaics):
+    ids = [f'#{mosaic["id"]}' for mosaic in mosaics]
+    return ", ".join(ids[:-1]) + " and " + ids[-1]
+
+
+  def startReducerCall(self, reducer, mosaics):
+    """Sends a reduction to an acquired reducer without waiting for the response."""
+    print(f'[MosaicWorker]:   url: {reducer["url"]}, waiting: {self.reducerDispatcher.waiting}')
+    files = {}
+    try:
+      for i, mosaic in enumerate(mosaics):
+        files[f"mosaic{i + 1}"] = self.mosaicFile(reducer, mosaic)
+      files, data = self.baseImageFields(reducer, "baseImage", files)
+      future = self.dispatcher.submit(
+        reducer["url"],
+        params = self.requestParams(self.outputTransferFormat(reducer)),
+        files = files,
+        data = data,
+        timeout = self.requestTimeout(reducer),
+      )
+    except Exception:
+      # The request body closes the opened mosaics once it is sent; until then, they are ours to close:
+      for value in files.values():
+        if isinstance(value, tuple):
+          value[0].close()
+      raise
+
+    return {
+      "reducer": reducer,
+      "startTime": time.time(),
+      "future": future,
+    }
+
+
+  def finishReducerCall(self, call):
+    """Releases the reducer of a completed call and returns its mosaic (None on failure)."""
     try:
-      req = self.sendRequest2(url, files = {"baseImage": self.baseImage, "mosaic1": mosaic1["mosaicImage"], "mosaic2": mosaic2["mosaicImage"]})
+      return self.checkReducerCall(call)
+    finally:
+      # Only once the outcome is recorded (and a failed reducer removed), so the
+      # reductions waiting for it never pick a reducer that just failed:
+      self.reducerDispatcher.release(call["reducer"])
+
+
+  def checkReducerCall(self, call):
+    reducer = call["reducer"]
+    stats = self.servers.getStats(reducer)
+
+    try:
+      req = call["future"].result()
     except Exception as e:
+      self.recordServiceResult(reducer, "connection_error")
+      stats.recordFailure()
+      self.servers.getCircuit(reducer).recordFailure()
       self.servers.updateValue(reducer, "error", f"ConnectionError: {e}")
-      self.servers.updateValue(reducer, "disabled", True)
-      # Remove bad reducer and retry:
-      if reducer in self.reducersAvailable:
-        self.reducersAvailable.remove(reducer)
-        
-      return self.awaitReducer(mosaic1, mosaic2)
-    
+      self.removeReducer(reducer)
+      return None
+
+    latency = time.time() - call["startTime"]
+
+    if req.status_code != 200:
+      self.recordServiceResult(reducer, "http_error", latency)
+
     if req.status_code >= 500:
+      stats.recordFailure()
+      self.servers.getCircuit(reducer).recordFailure()
       self.servers.updateValue(reducer, "error", f"HTTP Status {req.status_code}")
-      self.servers.updateValue(reducer, "disabled", True)
-      # Remove bad reducer and retry:
-      if reducer in self.reducersAvailable:
-        self.reducersAvailable.remove(reducer)
-      return self.awaitReducer(mosaic1, mosaic2)
-        
+      self.removeReducer(reducer)
+      return None
+
     if req.status_code != 200:
+      self.servers.getCircuit(reducer).recordSuccess()
+      stats.recordFailure()
       self.servers.updateValue(reducer, "error", f"HTTP Status {req.status_code}")
-      # Remove bad reducer and retry:
-      if reducer in self.reducersAvailable:
-        self.reducersAvailable.remove(reducer)
-      return self.awaitReducer(mosaic1, mosaic2)
+      self.removeReducer(reducer)
+      return None
 
+    # Like a 5xx, an unusable mosaic counts against the circuit, so a reducer that keeps
+    # sending them stops receiving work until a health probe finds it working again:
     mosaicImage = req.content
-    if not self.validateMosaicImageSize(reducer, self.baseImage, mosaicImage):
-      self.servers.updateValue(reducer, "disabled", True)
-      # Remove bad reducer and retry:
-      if reducer in self.reducersAvailable:
-        self.reducersAvailable.remove(reducer)
-      return self.awaitReducer(mosaic1, mosaic2)
-
-    self.reducerBlockingQueue.put(reducer)
-    print(f'[MosaicWorker]:   completed, queue: {self.reducerBlockingQueue.qsize()}')
-
-    self.processRenderedMosaic(
-      mosaicImage,
-      f'Reduction of #{mosaic1["id"]} and #{mosaic2["id"]} by {reducer["author"]}',
-      mosaic1["tiles"] + mosaic2["tiles"],
-      mosaic1["mosaics"] + mosaic2["mosaics"],
+    if not self.validateMosaicImageSize(reducer, mosaicImage):
+      self.recordServiceResult(reducer, "invalid_image", latency)
+      stats.recordFailure()
+      self.servers.getCircuit(reducer).recordFailure()
+      self.removeReducer(reducer)
+      return None
+
+    self.servers.getCircuit(reducer).recordSuccess()
+    self.recordServiceResult(reducer, "ok", latency)
+    stats.recordSuccess(latency)
+    print(f'[MosaicWorker]:   completed by {reducer["url"]} in {latency:.3f}s')
+    return mosaicImage
+
+
+  def dispatchReduction(self, mosaic1, mosaic2):
+    """Sends a reduction as soon as one of the job's reducers is free."""
+    if len(self.reducersAvailable) == 0:
+      self.reduceLocally(mosaic1, mosaic2)
+      return
+
+    print(f'[MosaicWorker]: Sending reduce request for {self.describeMosaics([mosaic1, mosaic2])}')
+    self.reducerDispatcher.requestReducer(
+      self.reducersAvailable,
+      lambda reducer: self.startReduction(reducer, mosaic1, mosaic2),
+      jobId = self.jobId,
     )
 
-    self.reducerCompleted = self.reducerCompleted + 1
-    if self.socketio_filter == "":
-      self.servers.updateCount(reducer)
+
+  def reduceLocally(self, mosaic1, mosaic2):
+    if self.isStopped:
+      return
+
+    if not self.allowLocalReduction:
+      self.failJob(Exception("No reducers are available on this server."))
+      return
+
+    self.threadPool.submit(self.runLocalReduction, mosaic1, mosaic2)
+
+
+  def runLocalReduction(self, mosaic1, mosaic2):
+    try:
+      print(f'[MosaicWorker]: No healthy reducers; reducing #{mosaic1["id"]} and #{mosaic2["id"]} locally')
+      mosaicImage = self.localReducer.reduce(
+        self.intermediateStore.get(mosaic1["mosaicKey"]),
+        self.intermediateStore.get(mosaic2["mosaicKey"]),
+        transferFormat = self.preferredTransferFormat(),
+      )
+
+      with self.schedulerLock:
+        tiles, mosaics = self.reductionTotals([mosaic1, mosaic2])
+
+      self.processRenderedMosaic(
+        mosaicImage,
+        f'Reduction of #{mosaic1["id"]} and #{mosaic2["id"]} by the middleware',
+        tiles,
+        mosaics,
+        max(mosaic1["depth"], mosaic2["depth"]) + 1,
+        (mosaic1["id"], mosaic2["id"]),
+      )
+      self.discardMosaics(mosaic1, mosaic2)
+
+      with self.schedulerLock:
+        self.localReductions += 1
+      self.finishReduction()
+
+    except Exception as e:
+      import traceback
+      traceback.print_exc()
+      self.failJob(e)
+
+
+  def takeBatchMosaics(self, count):
+    """Takes up to `count` more pending mosaics, chosen by the reduction scheduler, to reduce in the same batch."""
+    with self.schedulerLock:
+      if count <= 0 or self.disableReduce or self.isStopped:
+        return []
+
+      extras = self.reductionScheduler.selectExtras(self.reductionJobs, count)
+
+      for mosaic in extras:
+        self.mosaicsBeingReduced[mosaic["id"]] = mosaic
+      # A batch of K mosaics produces one mosaic instead of K - 1:
+      self.expectedMosaics -= len(extras)
+      return extras
+
+
+  def returnBatchMosaics(self, extras):
+    """Puts the mosaics added to a failed batch back with the pending mosaics."""
+    with self.schedulerLock:
+      for mosaic in extras:
+        self.mosaicsBeingReduced.pop(mosaic["id"], None)
+        self.reductionJobs.append(mosaic)
+      self.expectedMosaics += len(extras)
+
+
+  def startReduction(self, reducer, mosaic1, mosaic2):
+    with self.schedulerLock:
+      isStopped = self.isStopped or self.jobError is not None
+    if isStopped:
+      # Past the deadline (or the job failed); the reducer was reserved while the job was still running:
+      if reducer is not None:
+        self.reducerDispatcher.release(reducer)
+      return
+
+    if reducer is None:
+      try:
+        self.reduceLocally(mosaic1, mosaic2)
+      except Exception as e:
+        self.failReduction(e)
+      return
+
+    try:
+      # Reducers with the `reduceBatch` capability also merge other pending mosaics in the same request:
+      mosaics = [mosaic1, mosaic2] + self.takeBatchMosaics(self.reducerBatchSize(reducer) - 2)
+      call = self.startReducerCall(reducer, mosaics)
+    except Exception as e:
+      # Nothing was sent, so nothing else will release the reducer:
+      self.reducerDispatcher.release(reducer)
+      self.failReduction(e)
+      return
+
+    # One attempt is every call sent for these mosaics (the first call and, maybe, a hedge):
+    attempt = {
+      "mosaics": mosaics,
+      "calls": [call],
+      "done": False,
+      "hedgeTimer": None,
+    }
+
+    if self.hedgePercentile is not None:
+      delay = self.reducerDispatcher.hedgeDelay(reducer, self.reducersAvailable, self.hedgePercentile)
+      if delay is not None:
+        attempt["hedgeTimer"] = threading.Timer(delay, self.hedgeReduction, args = (attempt, delay))
+        attempt["hedgeTimer"].daemon = True
+        attempt["hedgeTimer"].start()
+
+    self.watchReducerCall(attempt, call)
+
+
+  def watchReducerCall(self, attempt, call):
+    # Not called with `schedulerLock` held: an already-finished call runs its callback right away.
+    call["future"].add_done_callback(lambda future: self.reducerCallDone(attempt, call))
+
+
+  def hedgeReduction(self, attempt, delay):
+    """Sends a duplicate of a reduction that has run past the hedge percentile to a second reducer."""
+    # Only the reducer is claimed under the lock; building the request may transcode the mosaics:
+    with self.schedulerLock:
+      if attempt["done"] or self.isStopped:
+        return
+
+      mosaics = attempt["mosaics"]
+      candidates = [reducer for reducer in self.reducersAvailable if self.reducerBatchSize(reducer) >= len(mosaics)]
+      hedgeReducer = self.reducerDispatcher.tryAcquire(candidates, exclude = attempt["calls"][0]["reducer"])
+      if hedgeReducer is None:
+        return
+
+    print(f'[MosaicWorker]:   hedging {self.describeMosaics(mosaics)} after {delay:.3f}s')
+    try:
+      hedge = self.startReducerCall(hedgeReducer, mosaics)
+    except Exception as e:
+      # The first call is still running (or has just finished and its mosaics are gone); only the hedge is given up:
+      print(f"[MosaicWorker]: Unable to send a hedge: {e}")
+      self.reducerDispatcher.release(hedgeReducer)
+      return
+    hedge["isHedge"] = True
+
+    # Even if the first call has finished in the meantime, the hedge is watched so its reducer is released:
+    with self.schedulerLock:
+      attempt["calls"].append(hedge)
+      self.hedgesSent += 1
+    self.metrics.increment("mosaic_hedges_sent_total")
+
+    self.watchReducerCall(attempt, hedge)
+
+
+  def reducerCallDone(self, attempt, call):
+    try:
+      mosaicImage = self.finishReducerCall(call)
+
+      with self.schedulerLock:
+        attempt["calls"].remove(call)
+        if attempt["done"]:
+          # A slower duplicate; its reducer has been released and measured:
+          return
+
+        if self.isStopped:
+          # Arrived after the deadline; the job has already returned:
+          attempt["done"] = True
+          if attempt["hedgeTimer"] is not None:
+            attempt["hedgeTimer"].cancel()
+          return
+
+        if mosaicImage is None and len(attempt["calls"]) > 0:
+          # Another call for this pair is still running:
+          return
+
+        attempt["done"] = True
+        if attempt["hedgeTimer"] is not None:
+          attempt["hedgeTimer"].cancel()
+        if mosaicImage is not None and call.get("isHedge"):
+          self.hedgesWon += 1
+          self.metrics.increment("mosaic_hedges_won_total")
+        if mosaicImage is not None:
+          tiles, mosaicCount = self.reductionTotals(attempt["mosaics"])
+
+      mosaics = attempt["mosaics"]
+      if mosaicImage is None:
+        # Retry the original pair with another reducer; the rest of a batch is paired up again:
+        self.returnBatchMosaics(mosaics[2:])
+        self.dispatchReduction(mosaics[0], mosaics[1])
+        if len(mosaics) > 2:
+          self.scheduleReductions()
+        return
+
+      reducer = call["reducer"]
+      self.processRenderedMosaic(
+        mosaicImage,
+        f'Reduction of {self.describeMosaics(mosaics)} by {reducer["author"]}',
+        tiles,
+        mosaicCount,
+        max(mosaic["depth"] for mosaic in mosaics) + 1,
+        tuple(mosaic["id"] for mosaic in mosaics),
+      )
+      self.discardMosaics(*mosaics)
+
+      with self.schedulerLock:
+        self.reducerCompleted = self.reducerCompleted + 1
+      if self.socketio_filter == "":
+        self.servers.updateCount(reducer)
+
+      self.finishReduction()
+
+    except Exception as e:
+      import traceback
+      traceback.print_exc()
+      self.failJob(e)
 
 
-  def awaitMMG(self, mmg):
+  def startMMGs(self):
+    self.mmgOutstanding = len(self.mmgsAvailable)
+    for mmg in self.mmgsAvailable:
+      self.mmgPending.add(mmg["id"])
+      self.mmgQueue.append(mmg)
+
+    if self.mmgOutstanding == 0:
+      self.mmgsFinished.set()
+    self.startQueuedMMGs()
+
+
+  def startQueuedMMGs(self):
+    """Starts queued MMGs while fewer than `maxConcurrentMMGs` are running."""
+    while True:
+      with self.schedulerLock:
+        if len(self.mmgQueue) == 0 or self.isStopped:
+          return
+        if self.maxConcurrentMMGs is not None and self.mmgsRunning >= self.maxConcurrentMMGs:
+          return
+        mmg = self.mmgQueue.popleft()
+
+        # Stragglers cut off before being sent are not sent at all:
+        if mmg["id"] not in self.mmgPending:
+          continue
+        self.mmgsRunning += 1
+
+      self.threadPool.submit(self.runMMG, mmg)
+
+
+  def runMMG(self, mmg):
+    """Uses a cached result if there is one, and otherwise waits for a slot at the MMG's endpoint."""
+    # The mosaic is requested (and cached) in this format, even if the job's reducers change meanwhile:
+    transferFormat = self.outputTransferFormat(mmg)
+    cacheKey = None
+    mosaicImage = None
+    if self.resultCache is not None and self.baseImageDigest is not None:
+      cacheKey = self.resultCache.key(mmg, self.baseImageDigest, self.tilesAcross, self.renderedTileSize, self.fileFormat, transferFormat)
+      mosaicImage = self.resultCache.get(cacheKey)
+
+    if mosaicImage is not None:
+      self.completeMMG(mmg, mosaicImage, isCached = True)
+      return
+
+    self.endpointScheduler.acquire(mmg, self.jobId, lambda: self.threadPool.submit(self.callMMG, mmg, cacheKey, transferFormat))
+
+
+  def callMMG(self, mmg, cacheKey, transferFormat):
+    mosaicImage = None
+    try:
+      with self.schedulerLock:
+        isPending = mmg["id"] in self.mmgPending
+
+      if isPending:
+        mosaicImage = self.awaitMMG(mmg, transferFormat)
+        if mosaicImage is not None and cacheKey is not None:
+          self.resultCache.put(cacheKey, mosaicImage)
+    except Exception:
+      # Counted as a failed MMG (or, if the result arrived, a result that was not cached):
+      import traceback
+      traceback.print_exc()
+    finally:
+      self.endpointScheduler.release(mmg)
+      self.completeMMG(mmg, mosaicImage)
+
+
+  def completeMMG(self, mmg, mosaicImage, isCached = False):
+    """Finishes an MMG on a pool thread, where an exception would otherwise go unnoticed."""
+    try:
+      self.finishMMG(mmg, mosaicImage, isCached)
+    except Exception as e:
+      import traceback
+      traceback.print_exc()
+      self.failJob(e)
+    finally:
+      self.endMMG()
+
+
+  def endMMG(self):
+    with self.schedulerLock:
+      self.mmgsRunning -= 1
+    self.startQueuedMMGs()
+
+
+  def finishMMG(self, mmg, mosaicImage, isCached = False):
+    """Stores an MMG's result, unless the MMG was already given up on as a straggler."""
+    with self.schedulerLock:
+      isStraggler = mmg["id"] not in self.mmgPending
+      self.mmgPending.discard(mmg["id"])
+      if not isStraggler and mosaicImage is None:
+        self.expectedMosaics -= 2
+
+    if isStraggler:
+      print(f"[MosaicWorker]: Discarding late result from straggler MMG \"{mmg['name']}\"")
+      return
+
+    if mosaicImage is not None:
+      description = f"\"{mmg['name']}\" by {mmg['author']}"
+      if isCached:
+        description += " (cached)"
+      self.processRenderedMosaic(mosaicImage, description, mmg["tiles"], 1)
+
+      with self.schedulerLock:
+        self.mmgCompleted = self.mmgCompleted + 1
+        if isCached:
+          self.mmgCacheHits += 1
+
+      # A cached result was not rendered by the MMG for this job:
+      if self.socketio_filter == "" and not isCached:
+        self.servers.updateCount(mmg)
+
+    with self.schedulerLock:
+      self.mmgOutstanding -= 1
+      if self.mmgOutstanding == 0:
+        self.mmgsFinished.set()
+    self.scheduleReductions()
+
+
+  def cutStragglerMMGs(self, isPastDeadline = False):
+    """Stops waiting on every MMG that has not responded yet.
+
+    At the job's deadline, the job is stopped first: the mosaics already
+    rendered are not paired up for reductions that could not be used.
+    """
+    with self.schedulerLock:
+      if isPastDeadline:
+        self.isStopped = True
+      stragglers = len(self.mmgPending)
+      self.mmgPending.clear()
+      self.mmgOutstanding -= stragglers
+      self.expectedMosaics -= 2 * stragglers
+      self.mmgStragglersCut += stragglers
+      if self.mmgOutstanding == 0:
+        self.mmgsFinished.set()
+
+    if stragglers > 0:
+      print(f"[MosaicWorker]: Cut off {stragglers} straggler MMGs")
+      self.metrics.increment("mosaic_mmg_stragglers_cut_total", stragglers)
+      if not isPastDeadline:
+        self.scheduleReductions()
+
+
+  def recordServiceResult(self, server, outcome, latency = None):
+    self.metrics.increment("mosaic_service_requests_total", type = server["type"], url = server["url"], outcome = outcome)
+    if latency is not None:
+      self.metrics.observe("mosaic_service_request_seconds", latency, type = server["type"], url = server["url"])
+
+
+  def awaitMMG(self, mmg, transferFormat = None):
+    """Requests a mosaic from an MMG (in `transferFormat`, or `fileFormat`), returning the mosaic or None on failure."""
     url = mmg["url"]
     name = mmg["name"]
     author = mmg["author"]
     print(f"[MosaicWorker]: Sending MMG request to \"{name}\" by {author} at {url}")
+    stats = self.servers.getStats(mmg)
 
+    startTime = time.time()
     try:
-      req = self.sendRequest2(url, files={"image": self.baseImage})
+      files, data = self.baseImageFields(mmg, "image", {})
+      req = self.sendRequest2(url, files = files, data = data, timeout = self.requestTimeout(mmg), transferFormat = transferFormat)
     except Exception as e:
+      self.recordServiceResult(mmg, "connection_error")
+      stats.recordFailure()
+      self.servers.getCircuit(mmg).recordFailure()
       self.servers.updateValue(mmg, "error", f"ConnectionError: {e}")
-      self.servers.updateValue(mmg, "disabled", True)
-      self.expectedMosaics -= 2
-      return
+      return None
+
+    latency = time.time() - startTime
 
     if req.status_code >= 500:
-      self.servers.updateValue(mmg, "disabled", True)
+      self.servers.getCircuit(mmg).recordFailure()
+    else:
+      self.servers.getCircuit(mmg).recordSuccess()
 
     if req.status_code != 200:
+      self.recordServiceResult(mmg, "http_error", latency)
+      stats.recordFailure()
       self.servers.updateValue(mmg, "error", f"HTTP Status {req.status_code}")
-      self.expectedMosaics -= 2
-      return
+      return None
     
 
     mosaicImage = req.content
-    if not self.validateMosaicImageSize(mmg, self.baseImage, mosaicImage):
-      self.expectedMosaics -= 2
-      return
+    if not self.validateMosaicImageSize(mmg, mosaicImage):
+      self.recordServiceResult(mmg, "invalid_image", latency)
+      stats.recordFailure()
+      return None
+
+    self.recordServiceResult(mmg, "ok", latency)
+    stats.recordSuccess(latency)
+    return mosaicImage
+
 
-    self.processRenderedMosaic(mosaicImage, f"\"{name}\" by {author}", mmg["tiles"], 1)
-    self.mmgCompleted = self.mmgCompleted + 1
-    if self.socketio_filter == "":
-      self.servers.updateCount(mmg)
+  def recordPhase(self, phase, phaseStart):
+    """Records how long a phase of the job took, returning the start time of the next phase."""
+    now = time.time()
+    self.metrics.observe("mosaic_job_phase_seconds", now - phaseStart, phase = phase)
+    return now
 
 
   def createMosaic(self):
-    if len(self.mmgsAvailable) == 0:
-      raise Exception("No MMGs are available on this server.")
+    try:
+      return self.renderMosaic()
+    finally:
+      self.close()
 
-    for reducer in self.reducersAvailable:
-      self.reducerBlockingQueue.put(reducer)
-    
-    random.shuffle(self.mmgsAvailable)
-    for mmg in self.mmgsAvailable:
-       mmgFuture = self.threadPool.submit(self.awaitMMG, mmg)
-       self.mmgTasks.append(mmgFuture)
+  def close(self):
+    """Frees the job's intermediate mosaics (including any spilled to disk)."""
+    self.intermediateStore.close()
 
-    concurrent.futures.wait(self.mmgTasks)
+  def renderMosaic(self):
+    if len(self.mmgsAvailable) == 0:
+      raise Exception("No MMGs are available on this server.")
 
-    if len(self.reducersAvailable) == 0:
+    if len(self.reducersAvailable) == 0 and not self.allowLocalReduction:
       raise Exception("No reducers are available on this server.")
 
-    concurrent.futures.wait(self.reducerTasks)
-    while self.mosaicNextID <= self.expectedMosaics:
-      concurrent.futures.wait(self.reducerTasks)
+    random.shuffle(self.mmgsAvailable)
+    phaseStart = time.time()
+    self.startMMGs()
+
+    mmgWait = self.mmgCutoff
+    isDeadlineWait = False
+    remaining = self.remainingTime()
+    if remaining is not None and (mmgWait is None or remaining <= mmgWait):
+      mmgWait = remaining
+      isDeadlineWait = True
+
+    # Decided by how the wait ended, not by reading the clock again:
+    mmgsFinished = self.mmgsFinished.wait(timeout = mmgWait)
+    self.cutStragglerMMGs(isPastDeadline = isDeadlineWait and not mmgsFinished)
+    phaseStart = self.recordPhase("mmg", phaseStart)
+
+    # Reductions run from callbacks; this thread only waits for the job to finish:
+    self.jobFinished.wait(timeout = self.remainingTime())
+    phaseStart = self.recordPhase("reduce", phaseStart)
+    if self.jobError is not None:
+      raise self.jobError
+
+    if not self.jobFinished.is_set():
+      return self.finishAtDeadline(phaseStart)
 
     # After all MMGs and reducers, there should be one mosaic that remains to be reduced that cannot
     # be reduced with anything else.  This is the final result:
@@ -258,24 +1022,67 @@ class MosaicWorker:
     #   return self.allRenderedMosaics
 
     if len(self.reductionJobs) == 1:
-      self.saveImage(self.reductionJobs[0])
-      return []
+      print(f"[MosaicWorker]: Reduction tree depth: {self.treeDepth} ({self.mmgCompleted} MMG results, {self.mmgCacheHits} from the cache)")
+      print(f"[MosaicWorker]: Hedges won: {self.hedgesWon} of {self.hedgesSent}; straggler MMGs cut off: {self.mmgStragglersCut}; local reductions: {self.localReductions}; duplicates merged: {self.duplicatesMerged}")
+      self.finalMosaic = self.reductionJobs[0]
+      self.finalMosaicImage = self.finalImage(self.finalMosaic)
+      if self.publishFinal:
+        self.saveImage(self.finalMosaic, self.finalMosaicImage)
+        self.previewStream.publishFinal(self.socketRoom, "mosaic final" + self.socketio_filter, self.jobId, self.finalMosaicImage, self.fileFormat)
+      self.recordPhase("save", phaseStart)
+      return {"jobId": self.jobId, "url": f"/mosaic/{self.jobId}", **self.stragglerStats()}
 
     # Otherwise, we have some sort of an error:
     raise Exception("No mosaics were available after all threads completed all of the work.  (Did every MMG fail?)")
 
+  def finishAtDeadline(self, phaseStart):
+    """Stops the job at its deadline and returns the most-reduced mosaic it has.
+
+    Mosaics that are being reduced still count: their reductions are not
+    waited for, but the mosaics themselves are kept until the job ends.
+    """
+    with self.schedulerLock:
+      self.isStopped = True
+      candidates = self.reductionJobs + list(self.mosaicsBeingReduced.values())
+      if len(candidates) == 0:
+        best = None
+      else:
+        best = max(candidates, key = lambda mosaic: (mosaic["mosaics"], mosaic["tiles"]))
+        mosaicImage = self.intermediateStore.get(best["mosaicKey"])
+
+    if best is None:
+      raise Exception("No mosaics were available before the deadline.")
+
+    if best.get("container") not in (None, self.fileContainer):
+      self.metrics.increment("mosaic_transcodes_total", reason = "final")
+      mosaicImage = transcode(mosaicImage, self.fileFormat)
+
+    print(f"[MosaicWorker]: Deadline reached; returning #{best['id']} ({best['mosaics']} of {self.mmgCompleted} MMG results)")
+    self.finalMosaic = best
+    self.finalMosaicImage = mosaicImage
+    if self.publishFinal:
+      self.saveImage(best, mosaicImage)
+      self.previewStream.publishFinal(self.socketRoom, "mosaic final" + self.socketio_filter, self.jobId, mosaicImage, self.fileFormat)
+    self.recordPhase("save", phaseStart)
+    return {"jobId": self.jobId, "url": f"/mosaic/{self.jobId}", "partial": True, "mosaics": best["mosaics"], **self.stragglerStats()}
+
+  def stragglerStats(self):
+    """How often straggler handling stepped in during this job, for the job's result."""
+    with self.schedulerLock:
+      return {
+        "hedgesSent": self.hedgesSent,
+        "hedgesWon": self.hedgesWon,
+        "mmgStragglersCut": self.mmgStragglersCut,
+      }
+
   def testMosaic(self):
     if len(self.mmgsAvailable) == 0:
       raise Exception("No MMGs are available for this author.")
 
     self.disableReduce = True
-    for mmg in self.mmgsAvailable:
-       mmgFuture = self.threadPool.submit(self.awaitMMG, mmg)
-       self.mmgTasks.append(mmgFuture)
+    self.startMMGs()
 
-    concurrent.futures.wait(self.mmgTasks)
-    # for t in concurrent.futures.as_completed(self.mmgTasks):
-    #   print(t)
+    self.mmgsFinished.wait()
 
     return []
 
@@ -283,20 +1090,46 @@ class MosaicWorker:
     if len(self.reducersAvailable) == 0:
       raise Exception("No reducers are available for this author.")
 
-    for reducer in self.reducersAvailable:
-      self.reducerBlockingQueue.put(reducer)
+    m1 = { "id": "A", "mosaicKey": self.intermediateStore.put(mosaic1), "tiles": -1, "mosaics": -1, "depth": 0 }
+    m2 = { "id": "B", "mosaicKey": self.intermediateStore.put(mosaic2), "tiles": -1, "mosaics": -1, "depth": 0 }
+    m3 = { "id": "C", "mosaicKey": self.intermediateStore.put(mosaic3), "tiles": -1, "mosaics": -1, "depth": 0 }
+    m4 = { "id": "D", "mosaicKey": self.intermediateStore.put(mosaic4), "tiles": -1, "mosaics": -1, "depth": 0 }
 
-    m1 = { "id": "A", "mosaicImage": mosaic1, "tiles": -1, "mosaics": -1 }
-    m2 = { "id": "B", "mosaicImage": mosaic2, "tiles": -1, "mosaics": -1 }
-    m3 = { "id": "C", "mosaicImage": mosaic3, "tiles": -1, "mosaics": -1 }
-    m4 = { "id": "D", "mosaicImage": mosaic4, "tiles": -1, "mosaics": -1 }
+    # The two results are not reduced any further, and never by the middleware itself:
+    self.disableReduce = True
+    self.allowLocalReduction = False
+    with self.schedulerLock:
+      self.reductionsInFlight += 2
+      self.jobFinished.clear()
 
-    reducerFuture = self.threadPool.submit(self.awaitReducer, m1, m2)
-    self.reducerTasks.append(reducerFuture)
+    self.dispatchReduction(m1, m2)
+    self.dispatchReduction(m3, m4)
 
-    reducerFuture = self.threadPool.submit(self.awaitReducer, m3, m4)
-    self.reducerTasks.append(reducerFuture)
+    self.jobFinished.wait()
+    if self.jobError is not None:
+      raise self.jobError
 
-    concurrent.futures.wait(self.reducerTasks)
+    if self.localReducer is None:
+      return []
 
-    return []
\ No newline at end of file
+    # Compare each result with the built-in reducer's choice of tiles:
+    inputs = {"A": mosaic1, "B": mosaic2, "C": mosaic3, "D": mosaic4}
+    report = []
+    for reduction in self.reductionJobs:
+      if reduction["sources"] is None:
+        continue
+
+      id1, id2 = reduction["sources"]
+      try:
+        fromInputs, agreement = self.localReducer.compare(inputs[id1], inputs[id2], self.intermediateStore.get(reduction["mosaicKey"]))
+      except Exception as e:
+        report.append({"description": reduction["description"], "error": str(e)})
+        continue
+
+      report.append({
+        "description": reduction["description"],
+        "tilesFromInputs": round(fromInputs, 4),
+        "agreementWithReference": round(agreement, 4),
+      })
+
+    return report
\ No newline at end of file
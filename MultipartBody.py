@@ -0,0 +1,79 @@
+import io
+import secrets
+
+class MultipartBody:
+  """A `multipart/form-data` request body that is read lazily from its parts.
+
+  `requests` builds a multipart body by copying every file into one large
+  `bytes` object.  This body instead reads each part when it is sent, so
+  mosaics (including ones spilled to disk) are streamed into the upload.
+  File values may be `bytes` or a `(file, size)` pair; form values are
+  strings.  The total length is known up front, so the request is sent with
+  a `Content-Length` header rather than chunked.
+  """
+
+  def __init__(self, files = None, data = None):
+    self.boundary = secrets.token_hex(16)
+    self.contentType = f"multipart/form-data; boundary={self.boundary}"
+    self.segments = []
+    self.files = []
+
+    for name, value in (data or {}).items():
+      self.addBytes(f"--{self.boundary}\r\nContent-Disposition: form-data; name=\"{name}\"\r\n\r\n".encode("utf-8"))
+      self.addBytes(str(value).encode("utf-8"))
+      self.addBytes(b"\r\n")
+
+    for name, value in (files or {}).items():
+      self.addBytes(f"--{self.boundary}\r\nContent-Disposition: form-data; name=\"{name}\"; filename=\"{name}\"\r\n\r\n".encode("utf-8"))
+      if isinstance(value, tuple):
+        file, size = value
+        self.files.append(file)
+        self.segments.append((file, size))
+      else:
+        self.addBytes(value)
+      self.addBytes(b"\r\n")
+
+    self.addBytes(f"--{self.boundary}--\r\n".encode("utf-8"))
+    self.length = sum(size for file, size in self.segments)
+    self.current = 0
+    self.remaining = self.segments[0][1]
+
+  def addBytes(self, value):
+    self.segments.append((io.BytesIO(value), len(value)))
+
+  def __len__(self):
+    return self.length
+
+  def read(self, size = -1):
+    if size is None or size < 0:
+      size = self.length
+
+    chunks = []
+    while size > 0 and self.current < len(self.segments):
+      if self.remaining == 0:
+        self.current += 1
+        if self.current < len(self.segments):
+          self.remaining = self.segments[self.current][1]
+        continue
+
+      file, _ = self.segments[self.current]
+      chunk = file.read(min(size, self.remaining))
+      if len(chunk) == 0:
+        raise Exception("Multipart body part ended early")
+
+      chunks.append(chunk)
+      size -= len(chunk)
+      self.remaining -= len(chunk)
+
+    return b"".join(chunks)
+
+  def __iter__(self):
+    while True:
+      chunk = self.read(65536)
+      if len(chunk) == 0:
+        return
+      yield chunk
+
+  def close(self):
+    for file in self.files:
+      file.close()
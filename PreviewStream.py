@@ -0,0 +1,144 @@
+import collections
+import io
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from Metrics import Metrics
+
+class PreviewStream:
+  """Bandwidth-bounded Socket.IO previews of a job's progress.
+
+  Intermediate mosaics are sent as small JPEG thumbnails, built on the
+  stream's own threads instead of the job's, and only to the Socket.IO room
+  (the socket id) of the client that submitted the job.  Each client may
+  receive at most `clientByteBudget` bytes of thumbnails per job, and at most
+  `maxPendingThumbnails` are queued per client; further previews are dropped.
+  Progress updates arriving within `coalesceInterval` seconds of each other
+  are merged into one event.  The most recent full-size final mosaics (up to
+  `finalImageBytes` bytes of them) are kept so they can be downloaded on
+  demand.
+  """
+
+  def __init__(self, socketio, thumbnailSize = 200, coalesceInterval = 0.25, clientByteBudget = 2000000, maxPendingThumbnails = 8, finalImageBytes = 200000000, metrics = None):
+    self.socketio = socketio
+    self.thumbnailSize = thumbnailSize
+    self.coalesceInterval = coalesceInterval
+    self.clientByteBudget = clientByteBudget
+    self.maxPendingThumbnails = maxPendingThumbnails
+    self.finalImageBytes = finalImageBytes
+
+    self.executor = ThreadPoolExecutor(max_workers = 2)
+    self.lock = threading.Lock()
+    self.bytesSent = {}
+    self.pendingThumbnails = {}
+    self.pendingProgress = {}
+    self.finalImages = collections.OrderedDict()
+    self.finalBytes = 0
+    self.thumbnailsDropped = 0
+
+    if metrics is None:
+      metrics = Metrics()
+    self.metrics = metrics
+    metrics.counter("mosaic_socketio_events_total", "Socket.IO events emitted, by kind (thumbnail, progress, final)")
+    metrics.counter("mosaic_socketio_bytes_total", "Bytes of images emitted over Socket.IO, by kind")
+    metrics.counter("mosaic_thumbnails_dropped_total", "Thumbnails not sent because a client's budget or queue was full")
+
+  def startJob(self, room):
+    """Resets a client's byte budget at the start of a new job."""
+    if room is None:
+      return
+
+    with self.lock:
+      self.bytesSent[room] = 0
+
+  def forget(self, room):
+    with self.lock:
+      self.bytesSent.pop(room, None)
+      self.pendingThumbnails.pop(room, None)
+
+  def publishMosaic(self, room, event, mosaicInfo, image):
+    if room is None:
+      return
+
+    with self.lock:
+      pending = self.pendingThumbnails.get(room, 0)
+      if pending >= self.maxPendingThumbnails or self.bytesSent.get(room, 0) >= self.clientByteBudget:
+        self.thumbnailsDropped += 1
+        self.metrics.increment("mosaic_thumbnails_dropped_total")
+        return
+      self.pendingThumbnails[room] = pending + 1
+
+    self.executor.submit(self.sendThumbnail, room, event, mosaicInfo, image)
+
+  def sendThumbnail(self, room, event, mosaicInfo, image):
+    try:
+      thumbnail = self.makeThumbnail(image)
+    except Exception as e:
+      print(f"[PreviewStream]: Unable to create thumbnail: {e}")
+      thumbnail = None
+
+    with self.lock:
+      self.pendingThumbnails[room] = self.pendingThumbnails.get(room, 1) - 1
+      if thumbnail is None or self.bytesSent.get(room, 0) + len(thumbnail) > self.clientByteBudget:
+        self.thumbnailsDropped += 1
+        self.metrics.increment("mosaic_thumbnails_dropped_total")
+        return
+      self.bytesSent[room] = self.bytesSent.get(room, 0) + len(thumbnail)
+
+    self.metrics.increment("mosaic_socketio_events_total", kind = "thumbnail")
+    self.metrics.increment("mosaic_socketio_bytes_total", len(thumbnail), kind = "thumbnail")
+    self.socketio.emit(event, {**mosaicInfo, "image": thumbnail, "mimeType": "image/jpeg"}, to = room)
+
+  def makeThumbnail(self, image):
+    from TransferFormats import openImage
+
+    img = openImage(image)
+    img.draft("RGB", (self.thumbnailSize, self.thumbnailSize))
+    img.thumbnail((self.thumbnailSize, self.thumbnailSize))
+    if img.mode not in ("RGB", "L"):
+      img = img.convert("RGB")
+
+    buffer = io.BytesIO()
+    img.save(buffer, "JPEG", quality = 75)
+    return buffer.getvalue()
+
+  def publishProgress(self, room, event, progress):
+    if room is None:
+      return
+
+    key = (room, event)
+    with self.lock:
+      isScheduled = key in self.pendingProgress
+      self.pendingProgress[key] = progress
+
+    if not isScheduled:
+      timer = threading.Timer(self.coalesceInterval, self.flushProgress, args = (key,))
+      timer.daemon = True
+      timer.start()
+
+  def flushProgress(self, key):
+    with self.lock:
+      progress = self.pendingProgress.pop(key)
+
+    room, event = key
+    self.metrics.increment("mosaic_socketio_events_total", kind = "progress")
+    self.socketio.emit(event, progress, to = room)
+
+  def publishFinal(self, room, event, jobId, image, fileFormat):
+    """Keeps the full-size final mosaic for download and tells the client where to find it."""
+    with self.lock:
+      if jobId in self.finalImages:
+        self.finalBytes -= len(self.finalImages.pop(jobId)[0])
+      self.finalImages[jobId] = (image, fileFormat)
+      self.finalBytes += len(image)
+      # The newest mosaic is always kept, even if it alone is over the budget:
+      while self.finalBytes > self.finalImageBytes and len(self.finalImages) > 1:
+        oldImage, _ = self.finalImages.popitem(last = False)[1]
+        self.finalBytes -= len(oldImage)
+
+    if room is not None:
+      self.metrics.increment("mosaic_socketio_events_total", kind = "final")
+      self.socketio.emit(event, {"jobId": jobId, "url": f"/mosaic/{jobId}"}, to = room)
+
+  def getFinal(self, jobId):
+    with self.lock:
+      return self.finalImages.get(jobId)
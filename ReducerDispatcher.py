@@ -0,0 +1,165 @@
+import collections
+import threading
+from ServerStats import latencyPercentile
+
+class ReducerDispatcher:
+  """Process-wide, latency-aware assignment of reduction requests to reducers.
+
+  Reducers are ranked by their expected completion time: the latency EWMA
+  from `ServersCollection`, scaled up by the error EWMA and by the requests
+  already in flight to that reducer.  Reducers that have not answered yet are
+  tried first so every reducer gets measured.
+
+  A reducer may only have one request in flight until it has `minSamples`
+  successful responses.  After that, reducers with a latency EWMA under
+  `fastLatency` seconds may take proportionally more concurrent requests, up
+  to `maxConcurrency`.
+
+  Reducers are handed out without blocking: `requestReducer` calls back as
+  soon as a reducer has capacity, so no thread waits for a free reducer.
+  Waiting requests are queued per job and served round-robin across jobs,
+  so a job with many pending reductions cannot hold up the others.
+  """
+
+  def __init__(self, servers, maxConcurrency = 4, fastLatency = 2.0, minSamples = 3, maxErrorRate = 0.2):
+    self.servers = servers
+    self.maxConcurrency = maxConcurrency
+    self.fastLatency = fastLatency
+    self.minSamples = minSamples
+    self.maxErrorRate = maxErrorRate
+
+    self.inFlight = {}
+    self.waiters = collections.OrderedDict()
+    self.waiting = 0
+    self.lock = threading.Lock()
+
+  def capacity(self, reducer):
+    stats = self.servers.getStats(reducer)
+    if stats.successes < self.minSamples or stats.errorEWMA > self.maxErrorRate:
+      return 1
+
+    concurrency = int(self.fastLatency / max(stats.latencyEWMA, 0.001))
+    return max(1, min(self.maxConcurrency, concurrency))
+
+  def score(self, reducer):
+    stats = self.servers.getStats(reducer)
+    if stats.latencyEWMA is None:
+      return 0
+
+    inFlight = self.inFlight.get(reducer["id"], 0)
+    return stats.latencyEWMA * (1 + inFlight) * (1 + 10 * stats.errorEWMA)
+
+  def selectReducer(self, candidates):
+    best = None
+    bestScore = None
+    for reducer in candidates:
+      if self.inFlight.get(reducer["id"], 0) >= self.capacity(reducer):
+        continue
+
+      score = self.score(reducer)
+      if best is None or score < bestScore:
+        best = reducer
+        bestScore = score
+
+    return best
+
+  def reserve(self, reducer):
+    self.inFlight[reducer["id"]] = self.inFlight.get(reducer["id"], 0) + 1
+    return reducer
+
+  def healthy(self, candidates):
+    return [reducer for reducer in candidates if self.servers.isHealthy(reducer)]
+
+  def requestReducer(self, candidates, callback, jobId = None):
+    """Reserves one of the healthy `candidates` and calls `callback(reducer)`.
+
+    If every candidate is busy, the request waits (behind the job's earlier
+    requests, and taking turns with other jobs) until a reducer is released.
+    `callback(None)` is called if no candidate is, or remains, healthy.
+    """
+    with self.lock:
+      self.waiters.setdefault(jobId, collections.deque()).append((candidates, callback))
+      self.waiting += 1
+      assigned = self.assignWaiters()
+
+    self.runCallbacks(assigned)
+
+  def assignWaiters(self):
+    """Reserves reducers for waiting requests, returning the `(callback, reducer)` pairs to run.
+
+    Each pass gives every waiting job at most one reducer, in turn; a job that
+    is given one goes to the back of the line.  A job whose next request has
+    no free candidate keeps its place.
+    """
+    assigned = []
+    isAssigning = True
+    while isAssigning:
+      isAssigning = False
+      for jobId in list(self.waiters):
+        requests = self.waiters[jobId]
+        candidates, callback = requests[0]
+        healthy = self.healthy(candidates)
+        if len(healthy) == 0:
+          reducer = None
+        else:
+          reducer = self.selectReducer(healthy)
+          if reducer is None:
+            continue
+          self.reserve(reducer)
+
+        requests.popleft()
+        del self.waiters[jobId]
+        if len(requests) > 0:
+          self.waiters[jobId] = requests
+
+        self.waiting -= 1
+        assigned.append((callback, reducer))
+        isAssigning = True
+
+    return assigned
+
+  def refresh(self):
+    """Re-checks waiting requests, e.g. after a job stops using one of its reducers."""
+    with self.lock:
+      assigned = self.assignWaiters()
+
+    self.runCallbacks(assigned)
+
+  def runCallbacks(self, assigned):
+    for callback, reducer in assigned:
+      try:
+        callback(reducer)
+      except Exception:
+        import traceback
+        traceback.print_exc()
+
+  def tryAcquire(self, candidates, exclude = None):
+    """Reserves the best reducer with free capacity without waiting, or returns None."""
+    with self.lock:
+      candidates = [reducer for reducer in self.healthy(candidates) if reducer is not exclude]
+      reducer = self.selectReducer(candidates)
+      if reducer is None:
+        return None
+      return self.reserve(reducer)
+
+  def hedgeDelay(self, reducer, candidates, percentile):
+    """Seconds to wait on `reducer` before sending a duplicate request elsewhere.
+
+    Uses the reducer's own latency percentile once it has been measured, and
+    the percentile over every candidate reducer's recent latencies otherwise.
+    """
+    stats = self.servers.getStats(reducer)
+    if stats.successes >= self.minSamples:
+      return stats.percentile(percentile)
+
+    samples = []
+    for candidate in candidates:
+      samples.extend(self.servers.getStats(candidate).snapshot())
+    return latencyPercentile(samples, percentile)
+
+  def release(self, reducer):
+    with self.lock:
+      self.inFlight[reducer["id"]] -= 1
+      assigned = self.assignWaiters()
+
+    self.runCallbacks(assigned)
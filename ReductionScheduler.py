@@ -0,0 +1,89 @@
+class ReductionScheduler:
+  """Decides which two pending mosaics a `MosaicWorker` should reduce next.
+
+  `selectPair` is given the worker's list of pending reduction jobs and must
+  either remove and return two of them, or return `None` to wait for more
+  mosaics to arrive.  `draining` is True once no further mosaics can arrive
+  (every MMG has answered and no reduction is in flight); a scheduler must
+  always return a pair when draining and two or more jobs are pending.
+  """
+
+  def selectPair(self, pending, draining):
+    raise NotImplementedError()
+
+  def selectExtras(self, pending, count):
+    """Removes and returns up to `count` more mosaics to merge in the same (batched) reduction."""
+    raise NotImplementedError()
+
+
+class LifoReductionScheduler(ReductionScheduler):
+  """Original behavior: reduce the two most recent mosaics as soon as they exist."""
+
+  def selectPair(self, pending, draining):
+    if len(pending) < 2:
+      return None
+
+    return pending.pop(), pending.pop()
+
+  def selectExtras(self, pending, count):
+    extras = pending[max(0, len(pending) - count):] if count > 0 else []
+    del pending[len(pending) - len(extras):]
+    return extras
+
+
+class BalancedReductionScheduler(ReductionScheduler):
+  """Builds a balanced reduction tree by only pairing mosaics of similar size.
+
+  Pending mosaics are ordered by how many MMG results they already contain
+  (`mosaics`, then `tiles`).  The two smallest are paired when they are within
+  `maxRatio` of each other, so single MMG results are merged with each other
+  and large accumulated mosaics wait for a partner of comparable size.  This
+  keeps independent subtrees reducing in parallel and the tree depth close to
+  log2(MMG count).  Once the job is draining, the two smallest are paired
+  regardless of size.
+  """
+
+  def __init__(self, maxRatio = 2):
+    self.maxRatio = maxRatio
+
+  def size(self, job):
+    return max(job["mosaics"], 1)
+
+  def isSimilar(self, job1, job2):
+    small, large = sorted([self.size(job1), self.size(job2)])
+    return large <= small * self.maxRatio
+
+  def selectPair(self, pending, draining):
+    if len(pending) < 2:
+      return None
+
+    pending.sort(key = lambda job: (job["mosaics"], job["tiles"]))
+
+    for i in range(len(pending) - 1):
+      if self.isSimilar(pending[i], pending[i + 1]):
+        job2 = pending.pop(i + 1)
+        job1 = pending.pop(i)
+        return job1, job2
+
+    if draining:
+      job1 = pending.pop(0)
+      job2 = pending.pop(0)
+      return job1, job2
+
+    return None
+
+  def selectExtras(self, pending, count):
+    # The smallest mosaics, so a batch stays about as balanced as a pair:
+    pending.sort(key = lambda job: (job["mosaics"], job["tiles"]))
+    extras = pending[:count]
+    del pending[:count]
+    return extras
+
+
+def createReductionScheduler(name):
+  if name == "lifo":
+    return LifoReductionScheduler()
+  elif name == "balanced":
+    return BalancedReductionScheduler()
+  else:
+    raise Exception(f"Unknown reduction scheduler: {name}")
@@ -0,0 +1,182 @@
+import json
+import os
+import queue
+import secrets
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+class RegistryFeed:
+  """Relays registry changes between middleware processes.
+
+  Every `ServersCollection` publishes its own changes (registrations, field
+  updates like `disabled` or `verification`, and the after-deadline flag) as
+  small JSON-serializable dicts, and applies every other process's changes
+  in the order they were published.  Each change carries the `origin` of the
+  process that published it, so a process never re-applies its own changes.
+  Changes are written by the feed's own thread, off the request path.
+  """
+
+  def __init__(self):
+    self.origin = secrets.token_hex(8)
+    self.callback = None
+    self.outbox = queue.Queue()
+
+    self.publisher = threading.Thread(target = self.runPublisher, name = f"{type(self).__name__}.publish", daemon = True)
+    self.publisher.start()
+
+  def publish(self, change):
+    self.outbox.put(change)
+
+  def runPublisher(self):
+    while True:
+      change = self.outbox.get()
+      while True:
+        try:
+          self.write(change)
+          break
+        except Exception as e:
+          print(f"[RegistryFeed]: Unable to publish a {change['op']} change, will retry: {e}")
+          time.sleep(1)
+
+  def subscribe(self, callback):
+    """Delivers every other process's changes to `callback`, on the feed's own thread."""
+    self.callback = callback
+    thread = threading.Thread(target = self.run, name = f"{type(self).__name__}.subscribe", daemon = True)
+    thread.start()
+
+  def deliver(self, origin, change):
+    if origin == self.origin:
+      return
+
+    try:
+      self.callback(change)
+    except Exception as e:
+      print(f"[RegistryFeed]: Unable to apply a {change.get('op')} change: {e}")
+
+  def write(self, change):
+    raise NotImplementedError()
+
+  def run(self):
+    raise NotImplementedError()
+
+
+class SQLiteRegistryFeed(RegistryFeed):
+  """Change feed in a SQLite file shared by the processes on one host.
+
+  The whole log is replayed when a process subscribes, so a process started
+  later (or without MongoDB) still sees every registration.  A registration
+  supersedes every earlier change for the same server, and only the newest
+  change of each field of a server (and of the after-deadline flag) is kept,
+  so the log stays about as small as the registry itself.
+  """
+
+  def __init__(self, path, pollInterval = 0.25):
+    self.path = path
+    self.pollInterval = pollInterval
+    self.lastSeq = 0
+
+    directory = os.path.dirname(path)
+    if directory != "":
+      os.makedirs(directory, exist_ok = True)
+
+    self.writeConnection = self.openDatabase()
+    with self.writeConnection:
+      self.writeConnection.execute("CREATE TABLE IF NOT EXISTS changes (seq INTEGER PRIMARY KEY AUTOINCREMENT, origin TEXT NOT NULL, key TEXT NOT NULL, change TEXT NOT NULL)")
+      self.writeConnection.execute("CREATE INDEX IF NOT EXISTS changes_key ON changes (key)")
+
+    super().__init__()
+
+  def openDatabase(self):
+    connection = sqlite3.connect(self.path, timeout = 30, check_same_thread = False)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    return connection
+
+  def changeKey(self, change):
+    """Changes with the same key supersede each other; a server's field updates are keyed `type:id/field`."""
+    if change["op"] == "register":
+      return f"{change['server']['type']}:{change['server']['id']}"
+    elif change["op"] == "set":
+      return f"{change['type']}:{change['id']}/{change['key']}"
+    else:
+      return change["op"]
+
+  def write(self, change):
+    key = self.changeKey(change)
+    with self.writeConnection:
+      cursor = self.writeConnection.execute("INSERT INTO changes (origin, key, change) VALUES (?, ?, ?)", (self.origin, key, json.dumps(change)))
+      self.writeConnection.execute("DELETE FROM changes WHERE key = ? AND seq < ?", (key, cursor.lastrowid))
+      if change["op"] == "register":
+        # ...and so does every earlier field update of the server (keys from `type:id/` up to, not including, `type:id0`):
+        self.writeConnection.execute("DELETE FROM changes WHERE key >= ? AND key < ? AND seq < ?", (key + "/", key + "0", cursor.lastrowid))
+
+  def poll(self, connection):
+    rows = connection.execute("SELECT seq, origin, change FROM changes WHERE seq > ? ORDER BY seq", (self.lastSeq,)).fetchall()
+    for seq, origin, change in rows:
+      self.lastSeq = seq
+      self.deliver(origin, json.loads(change))
+
+  def subscribe(self, callback):
+    # Catch up before returning, so the registry is complete before any request is served:
+    self.callback = callback
+    self.poll(self.openDatabase())
+    super().subscribe(callback)
+
+  def run(self):
+    connection = self.openDatabase()
+    while True:
+      time.sleep(self.pollInterval)
+      try:
+        self.poll(connection)
+      except sqlite3.Error as e:
+        print(f"[RegistryFeed]: Unable to read {self.path}: {e}")
+
+
+class MongoRegistryFeed(RegistryFeed):
+  """Change feed in a MongoDB collection, read with a change stream.
+
+  Change streams require MongoDB to run as a replica set (a single-node
+  replica set is enough).  Processes load the registry itself from MongoDB
+  at startup; the stream is opened when the feed is created, before that
+  load, so no change made in between is missed.  Changes expire from the
+  collection after `retention` seconds.
+  """
+
+  def __init__(self, collection, retention = 86400):
+    self.collection = collection
+    collection.create_index("createdAt", expireAfterSeconds = retention)
+
+    self.pipeline = [{"$match": {"operationType": "insert"}}]
+    self.stream = collection.watch(self.pipeline)
+
+    super().__init__()
+
+  def write(self, change):
+    self.collection.insert_one({"origin": self.origin, "change": change, "createdAt": datetime.utcnow()})
+
+  def run(self):
+    while True:
+      try:
+        for event in self.stream:
+          document = event["fullDocument"]
+          self.deliver(document["origin"], document["change"])
+      except Exception as e:
+        print(f"[RegistryFeed]: Change stream interrupted, resuming: {e}")
+        time.sleep(1)
+        try:
+          self.stream = self.collection.watch(self.pipeline, resume_after = self.stream.resume_token)
+        except Exception as e:
+          print(f"[RegistryFeed]: Unable to resume the change stream: {e}")
+
+
+def createRegistryFeed(url):
+  """Creates a feed from `sqlite:///path/to/file` or a `mongodb://` connection string."""
+  if url.startswith("sqlite:///"):
+    return SQLiteRegistryFeed(url[len("sqlite:///"):])
+  elif url.startswith(("mongodb://", "mongodb+srv://")):
+    import pymongo
+    return MongoRegistryFeed(pymongo.MongoClient(url)["1989"]["registryChanges"])
+  else:
+    raise Exception(f"Unknown registry feed: {url}")
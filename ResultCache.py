@@ -0,0 +1,160 @@
+import collections
+import hashlib
+import os
+import shutil
+import threading
+from Metrics import Metrics
+
+class ResultCache:
+  """Two-tier cache of MMG results.
+
+  An MMG's mosaic depends only on the base image, the render parameters and
+  the MMG itself, so results are keyed by the base image's SHA-256 digest,
+  `tilesAcross`, `renderedTileSize`, `fileFormat`, the transfer format the
+  mosaic was requested in (if any) and the MMG's id.  Recent
+  results are kept in memory (an LRU of at most `maxMemoryBytes`) and every
+  result is also written under `directory`, one sub-directory per MMG, up to
+  `maxDiskBytes`.  `invalidate` drops every result of an MMG, and is called
+  when the MMG re-registers.
+  """
+
+  def __init__(self, directory = os.path.join("mosaics", "cache"), maxMemoryBytes = 256000000, maxDiskBytes = 2000000000, metrics = None):
+    self.directory = directory
+    self.maxMemoryBytes = maxMemoryBytes
+    self.maxDiskBytes = maxDiskBytes
+
+    self.lock = threading.Lock()
+    self.memory = collections.OrderedDict()
+    self.memoryBytes = 0
+    self.disk = collections.OrderedDict()
+    self.diskBytes = 0
+
+    if metrics is None:
+      metrics = Metrics()
+    self.metrics = metrics
+    metrics.counter("mosaic_result_cache_requests_total", "MMG result cache lookups, by result (memory, disk, miss)")
+    metrics.gauge("mosaic_result_cache_memory_bytes", "Bytes of MMG results cached in memory", lambda: self.memoryBytes)
+    metrics.gauge("mosaic_result_cache_disk_bytes", "Bytes of MMG results cached on disk", lambda: self.diskBytes)
+
+    if self.maxDiskBytes > 0:
+      os.makedirs(self.directory, exist_ok = True)
+      self.loadDiskIndex()
+
+  def key(self, mmg, baseImageDigest, tilesAcross, renderedTileSize, fileFormat, transferFormat = None):
+    """Returns the cache key of an MMG's result, as `(mmgId, hash)`."""
+    parameters = f"{baseImageDigest}:{tilesAcross}:{renderedTileSize}:{fileFormat}"
+    if transferFormat is not None:
+      # Results in `fileFormat` keep the keys they had before transfer formats existed:
+      parameters += f":{transferFormat}"
+    return (mmg["id"], hashlib.sha256(parameters.encode("utf-8")).hexdigest())
+
+  def path(self, key):
+    mmgId, hash = key
+    return os.path.join(self.directory, mmgId, hash)
+
+  def loadDiskIndex(self):
+    """Indexes the results already on disk, oldest first, so they are evicted first."""
+    entries = []
+    for mmgId in os.listdir(self.directory):
+      mmgDirectory = os.path.join(self.directory, mmgId)
+      if not os.path.isdir(mmgDirectory):
+        continue
+
+      for hash in os.listdir(mmgDirectory):
+        if hash.endswith(".tmp"):
+          # Left behind by an interrupted write:
+          os.remove(os.path.join(mmgDirectory, hash))
+          continue
+
+        stat = os.stat(os.path.join(mmgDirectory, hash))
+        entries.append((stat.st_mtime, (mmgId, hash), stat.st_size))
+
+    for mtime, key, size in sorted(entries):
+      self.disk[key] = size
+      self.diskBytes += size
+
+  def get(self, key):
+    with self.lock:
+      if key in self.memory:
+        self.memory.move_to_end(key)
+        self.metrics.increment("mosaic_result_cache_requests_total", result = "memory")
+        return self.memory[key]
+
+      isOnDisk = key in self.disk
+      if isOnDisk:
+        self.disk.move_to_end(key)
+
+    if isOnDisk:
+      try:
+        with open(self.path(key), "rb") as f:
+          result = f.read()
+      except OSError:
+        result = None
+
+      if result is not None:
+        self.metrics.increment("mosaic_result_cache_requests_total", result = "disk")
+        self.putInMemory(key, result)
+        return result
+
+    self.metrics.increment("mosaic_result_cache_requests_total", result = "miss")
+    return None
+
+  def put(self, key, result):
+    self.putInMemory(key, result)
+    self.putOnDisk(key, result)
+
+  def putInMemory(self, key, result):
+    if len(result) > self.maxMemoryBytes:
+      return
+
+    with self.lock:
+      if key in self.memory:
+        self.memoryBytes -= len(self.memory.pop(key))
+      self.memory[key] = result
+      self.memoryBytes += len(result)
+
+      while self.memoryBytes > self.maxMemoryBytes:
+        evictedKey, evicted = self.memory.popitem(last = False)
+        self.memoryBytes -= len(evicted)
+
+  def putOnDisk(self, key, result):
+    if len(result) > self.maxDiskBytes:
+      return
+
+    path = self.path(key)
+    try:
+      os.makedirs(os.path.dirname(path), exist_ok = True)
+      # Unique per process and thread, since several middleware processes may share the directory:
+      temporaryPath = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+      with open(temporaryPath, "wb") as f:
+        f.write(result)
+      os.replace(temporaryPath, path)
+    except OSError as e:
+      print(f"[ResultCache]: Unable to write {path}: {e}")
+      return
+
+    evicted = []
+    with self.lock:
+      self.diskBytes += len(result) - self.disk.pop(key, 0)
+      self.disk[key] = len(result)
+
+      while self.diskBytes > self.maxDiskBytes:
+        evictedKey, size = self.disk.popitem(last = False)
+        self.diskBytes -= size
+        evicted.append(evictedKey)
+
+    for evictedKey in evicted:
+      try:
+        os.remove(self.path(evictedKey))
+      except OSError:
+        pass
+
+  def invalidate(self, mmgId):
+    """Drops every cached result of an MMG (e.g. when it re-registers)."""
+    with self.lock:
+      for key in [key for key in self.memory if key[0] == mmgId]:
+        self.memoryBytes -= len(self.memory.pop(key))
+      for key in [key for key in self.disk if key[0] == mmgId]:
+        self.diskBytes -= self.disk.pop(key)
+
+    shutil.rmtree(os.path.join(self.directory, mmgId), ignore_errors = True)
@@ -0,0 +1,67 @@
+import os
+import sqlite3
+import threading
+import time
+import socketio
+
+class SQLiteMessageQueue(socketio.PubSubManager):
+  """Socket.IO message queue in a SQLite file, for processes on one host.
+
+  A stand-in for Redis, Kafka or AMQP (which `SocketIO(message_queue = ...)`
+  supports directly) that needs no other service: every process appends its
+  emits to one table and polls it for the other processes' emits every
+  `pollInterval` seconds, so an event emitted by the process running a job
+  reaches the client wherever its socket is connected.  Messages older than
+  `retention` seconds are deleted.
+  """
+
+  name = "sqlite"
+
+  def __init__(self, path, channel = "socketio", pollInterval = 0.05, retention = 60, write_only = False, logger = None):
+    super().__init__(channel = channel, write_only = write_only, logger = logger)
+    self.path = path
+    self.pollInterval = pollInterval
+    self.retention = retention
+
+    directory = os.path.dirname(path)
+    if directory != "":
+      os.makedirs(directory, exist_ok = True)
+
+    self.lock = threading.Lock()
+    self.writeConnection = self.openDatabase()
+    with self.writeConnection:
+      self.writeConnection.execute("CREATE TABLE IF NOT EXISTS messages (seq INTEGER PRIMARY KEY AUTOINCREMENT, channel TEXT NOT NULL, createdAt REAL NOT NULL, payload TEXT NOT NULL)")
+      self.writeConnection.execute("CREATE INDEX IF NOT EXISTS messages_createdAt ON messages (createdAt)")
+
+  def openDatabase(self):
+    connection = sqlite3.connect(self.path, timeout = 30, check_same_thread = False)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    return connection
+
+  def _publish(self, data):
+    with self.lock, self.writeConnection:
+      self.writeConnection.execute("INSERT INTO messages (channel, createdAt, payload) VALUES (?, ?, ?)", (self.channel, time.time(), self.json.dumps(data)))
+
+  def _listen(self):
+    connection = self.openDatabase()
+    lastSeq = connection.execute("SELECT COALESCE(MAX(seq), 0) FROM messages").fetchone()[0]
+    lastPruned = time.time()
+
+    while True:
+      try:
+        rows = connection.execute("SELECT seq, payload FROM messages WHERE seq > ? AND channel = ? ORDER BY seq", (lastSeq, self.channel)).fetchall()
+      except sqlite3.Error as e:
+        print(f"[SQLiteMessageQueue]: Unable to read {self.path}: {e}")
+        rows = []
+
+      for seq, payload in rows:
+        lastSeq = seq
+        yield payload
+
+      if time.time() - lastPruned > self.retention:
+        lastPruned = time.time()
+        with self.lock, self.writeConnection:
+          self.writeConnection.execute("DELETE FROM messages WHERE createdAt < ?", (lastPruned - self.retention,))
+
+      self.server.sleep(self.pollInterval)
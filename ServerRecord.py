@@ -0,0 +1,38 @@
+class ServerRecord:
+  """Compact record of a registered MMG or reducer.
+
+  Records behave like the dicts they replace (`record["url"]`,
+  `"disabled" in record`, `record.get(...)`) so templates and Mongo code
+  keep working, but only the listed fields can be stored.  `stats` and
+  `circuit` hold live, process-local state and are never persisted.
+  """
+
+  FIELDS = ("id", "type", "name", "url", "author", "tiles", "count", "late", "capabilities", "verification", "disabled", "error")
+  __slots__ = FIELDS + ("stats", "circuit")
+
+  def __init__(self, **fields):
+    for key in fields:
+      setattr(self, key, fields[key])
+
+  @classmethod
+  def fromDict(cls, document):
+    """Creates a record from a stored document, ignoring fields (like Mongo's `_id`) that are not record fields."""
+    return cls(**{key: document[key] for key in ServerRecord.FIELDS if key in document})
+
+  def toDict(self):
+    return {key: getattr(self, key) for key in ServerRecord.FIELDS if hasattr(self, key)}
+
+  def __getitem__(self, key):
+    try:
+      return getattr(self, key)
+    except AttributeError:
+      raise KeyError(key)
+
+  def __setitem__(self, key, value):
+    setattr(self, key, value)
+
+  def __contains__(self, key):
+    return key in ServerRecord.FIELDS and hasattr(self, key)
+
+  def get(self, key, default = None):
+    return getattr(self, key, default)
@@ -0,0 +1,53 @@
+import collections
+import threading
+
+def latencyPercentile(samples, p):
+  """Returns the `p`th percentile (0-100) of `samples`, or None if there are none."""
+  if len(samples) == 0:
+    return None
+
+  samples = sorted(samples)
+  index = min(len(samples) - 1, int(len(samples) * p / 100))
+  return samples[index]
+
+
+class ServerStats:
+  """Observed latency and error rate of a single MMG or reducer.
+
+  `latencyEWMA` and `errorEWMA` are exponentially weighted moving averages
+  (`alpha` is the weight of the newest observation).  The most recent
+  latencies are also kept so percentiles can be computed.
+  """
+
+  def __init__(self, alpha = 0.2, sampleCount = 100):
+    self.alpha = alpha
+    self.latencyEWMA = None
+    self.errorEWMA = 0.0
+    self.successes = 0
+    self.failures = 0
+    self.samples = collections.deque(maxlen = sampleCount)
+    self.lock = threading.Lock()
+
+  def recordSuccess(self, latency):
+    with self.lock:
+      if self.latencyEWMA is None:
+        self.latencyEWMA = latency
+      else:
+        self.latencyEWMA = self.alpha * latency + (1 - self.alpha) * self.latencyEWMA
+      self.errorEWMA = (1 - self.alpha) * self.errorEWMA
+      self.successes += 1
+      self.samples.append(latency)
+
+  def recordFailure(self):
+    with self.lock:
+      self.errorEWMA = self.alpha + (1 - self.alpha) * self.errorEWMA
+      self.failures += 1
+
+  def snapshot(self):
+    """Returns a copy of the recent latencies, safe to use while others are recorded."""
+    with self.lock:
+      return list(self.samples)
+
+  def percentile(self, p):
+    """Returns the `p`th percentile (0-100) of recent latencies, or None without samples."""
+    return latencyPercentile(self.snapshot(), p)
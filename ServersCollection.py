@@ -1,15 +1,26 @@
-
-
 import secrets
+import threading
 import pymongo
 from datetime import datetime
+from ServerStats import ServerStats
+from CircuitBreaker import CircuitBreaker
+from ServerRecord import ServerRecord
+from WriteBehindQueue import WriteBehindQueue
 
 class ServersCollection:
-  def __init__(self, usingMongo):
+  def __init__(self, usingMongo, registryFeed = None, resultCache = None):
     self.isAfterDeadline = False
     self.usingMongo = usingMongo
+    self.resultCache = resultCache
     self.mmgs = {}
     self.reducers = {}
+    self.lock = threading.RLock()
+
+    # Secondary indexes, each mapping to {id: record} in registration order:
+    self.byUrl = {"mmg": {}, "reducer": {}}
+    self.byAuthor = {"mmg": {}, "reducer": {}}
+    self.enabled = {"mmg": {}, "reducer": {}}
+    self.verifiedReducers = {}
 
     if self.usingMongo:
       self.mongodb = pymongo.MongoClient()
@@ -17,123 +28,296 @@ class ServersCollection:
       self.collection_reducers = self.mongodb["1989"]["reducers"]
 
       for mmg in self.collection_mmgs.find({}):
-        self.mmgs[mmg["id"]] = mmg
+        self.addToRegistry(ServerRecord.fromDict(mmg))
 
       for reducer in self.collection_reducers.find({}):
-        self.reducers[reducer["id"]] = reducer
+        self.addToRegistry(ServerRecord.fromDict(reducer))
+
+      # Registrations, counters and status changes are written in batches off the request path:
+      self.writeQueue = WriteBehindQueue({"mmg": self.collection_mmgs, "reducer": self.collection_reducers})
+
+    # With several middleware processes, each one publishes its registry changes
+    # to `registryFeed` and applies the changes published by the others:
+    self.registryFeed = registryFeed
+    if self.registryFeed is not None:
+      self.registryFeed.subscribe(self.applyChange)
 
   def toggleAfterDeadline(self):
     self.isAfterDeadline = not self.isAfterDeadline
+    self.publishChange({"op": "afterDeadline", "value": self.isAfterDeadline})
     return self.isAfterDeadline
-  
-  def clearErrors(self):
-    for id in self.mmgs:
-      server = self.mmgs[id]
-      self.updateValue(server, "disabled", False)
-      self.updateValue(server, "error", "")
 
-    for id in self.reducers:
-      server = self.reducers[id]
+  def clearErrors(self):
+    for server in self.allServers():
       self.updateValue(server, "disabled", False)
       self.updateValue(server, "error", "")
+      server.circuit = CircuitBreaker()
 
     return "Errors reset"
 
 
-  def addMMG(self, name, url, author, tiles):
+  def registry(self, type):
+    if type == "mmg":
+      return self.mmgs
+    else:
+      return self.reducers
+
+  def addToRegistry(self, server):
+    """Adds (or replaces, by id) a record in the registry and every index."""
+    with self.lock:
+      registry = self.registry(server["type"])
+      if server["id"] in registry:
+        self.unindex(registry[server["id"]])
+
+      registry[server["id"]] = server
+      self.index(server)
+
+  def index(self, server):
+    type = server["type"]
+    id = server["id"]
+
+    self.byUrl[type][server["url"]] = server
+    self.byAuthor[type].setdefault(server["author"], {})[id] = server
+
+    if not server.get("disabled"):
+      self.enabled[type][id] = server
+
+    if type == "reducer" and server.get("verification") == "GOOD":
+      self.verifiedReducers[id] = server
+
+  def unindex(self, server):
+    type = server["type"]
+    id = server["id"]
+
+    if self.byUrl[type].get(server["url"]) is server:
+      del self.byUrl[type][server["url"]]
+
+    authorServers = self.byAuthor[type].get(server["author"], {})
+    authorServers.pop(id, None)
+    if len(authorServers) == 0:
+      self.byAuthor[type].pop(server["author"], None)
+
+    self.enabled[type].pop(id, None)
+    self.verifiedReducers.pop(id, None)
+
+  def isRegistered(self, server):
+    return self.registry(server["type"]).get(server["id"]) is server
+
+
+  def allServers(self):
+    with self.lock:
+      return list(self.mmgs.values()) + list(self.reducers.values())
+
+  def enabledMMGs(self):
+    with self.lock:
+      return list(self.enabled["mmg"].values())
+
+  def enabledReducers(self):
+    with self.lock:
+      return list(self.enabled["reducer"].values())
+
+  def enabledVerifiedReducers(self):
+    with self.lock:
+      return [reducer for reducer in self.verifiedReducers.values() if not reducer.get("disabled")]
+
+  def mmgsForAuthor(self, author):
+    with self.lock:
+      return list(self.byAuthor["mmg"].get(author, {}).values())
+
+  def reducersForAuthor(self, author):
+    with self.lock:
+      return list(self.byAuthor["reducer"].get(author, {}).values())
+
+  def serversByAuthor(self):
+    """Returns {author: [servers]}, with each author's MMGs before their reducers."""
+    with self.lock:
+      servers_by_author = {}
+      for type in ["mmg", "reducer"]:
+        for author in self.byAuthor[type]:
+          servers_by_author.setdefault(author, []).extend(self.byAuthor[type][author].values())
+      return servers_by_author
+
+
+  def addMMG(self, name, url, author, tiles, capabilities = None):
+    if capabilities is None:
+      capabilities = []
     id = secrets.token_hex(20)
     count = 0
-    isUpdate = False
     late = False
     if self.isAfterDeadline:
       now = datetime.now()
       late = now.strftime("%H:%M:%S")
-    
+
     # Check for existing MMG with same URL:
-    for existingId in self.mmgs:
-      if self.mmgs[existingId]["url"] == url:
-        id = existingId
-        count = self.mmgs[existingId]["count"]
-        late = self.mmgs[existingId]["late"]
-        isUpdate = True
-        break
-
-    mmg = {
-      "id": id,
-      "type": "mmg",
-      "name": name,
-      "url": url,
-      "author": author,
-      "tiles": tiles,
-      "count": count,
-      "late": late,
-    }
-
-    self.mmgs[id] = mmg
+    existing = self.byUrl["mmg"].get(url)
+    if existing is not None:
+      id = existing["id"]
+      count = existing["count"]
+      late = existing["late"]
+
+    mmg = ServerRecord(
+      id = id,
+      type = "mmg",
+      name = name,
+      url = url,
+      author = author,
+      tiles = tiles,
+      count = count,
+      late = late,
+      capabilities = capabilities,
+    )
+    if existing is not None and hasattr(existing, "stats"):
+      mmg.stats = existing.stats
+
+    self.addToRegistry(mmg)
     if self.usingMongo:
-      if isUpdate:
-        self.collection_mmgs.replace_one({"id": id}, mmg)
-      else:
-        self.collection_mmgs.insert_one(mmg)
-    
+      self.writeQueue.replace("mmg", id, mmg.toDict())
+    self.publishChange({"op": "register", "server": mmg.toDict()})
+
     print(f"✔️ Added MMG {name}: {url} by {author}")
     return mmg
 
 
-  def addReducer(self, url, author):
+  def addReducer(self, url, author, capabilities = None):
+    if capabilities is None:
+      capabilities = []
     id = secrets.token_hex(20)
     count = 0
-    isUpdate = False
     verification = None
     late = False
     if self.isAfterDeadline:
       now = datetime.now()
       late = now.strftime("%H:%M:%S")
 
-    for existingId in self.reducers:
-      if self.reducers[existingId]["url"] == url:
-        id = existingId
-        count = self.reducers[existingId]["count"]
-        isUpdate = True
-        verification = self.reducers[existingId]["verification"]
-        late = self.reducers[existingId]["late"]
-        break
-
-    reducer = self.reducers[id] = {
-      "id": id,
-      "type": "reducer",
-      "url": url,
-      "author": author,
-      "count": count,
-      "verification": verification,
-      "late": late,
-    }
+    existing = self.byUrl["reducer"].get(url)
+    if existing is not None:
+      id = existing["id"]
+      count = existing["count"]
+      verification = existing["verification"]
+      late = existing["late"]
+
+    reducer = ServerRecord(
+      id = id,
+      type = "reducer",
+      url = url,
+      author = author,
+      count = count,
+      verification = verification,
+      late = late,
+      capabilities = capabilities,
+    )
+    if existing is not None and hasattr(existing, "stats"):
+      reducer.stats = existing.stats
 
+    self.addToRegistry(reducer)
     if self.usingMongo:
-      if isUpdate:
-        self.collection_reducers.replace_one({"id": id}, reducer)
-      else:
-        self.collection_reducers.insert_one(reducer)
+      self.writeQueue.replace("reducer", id, reducer.toDict())
+    self.publishChange({"op": "register", "server": reducer.toDict()})
 
     print(f"✔️ Added reducer: {url} by {author}")
-    return self.reducers[id]
+    return reducer
+
+
+  def publishChange(self, change):
+    if self.registryFeed is not None:
+      self.registryFeed.publish(change)
+
+
+  def applyChange(self, change):
+    """Applies a registry change published by another middleware process."""
+    if change["op"] == "register":
+      server = ServerRecord.fromDict(change["server"])
+      with self.lock:
+        # Same as a local re-registration: live statistics are kept, the circuit is reset.
+        existing = self.registry(server["type"]).get(server["id"])
+        if existing is not None and hasattr(existing, "stats"):
+          server.stats = existing.stats
+        self.addToRegistry(server)
+
+      # A re-registered MMG may render differently now (a first registration has nothing cached):
+      if existing is not None and server["type"] == "mmg" and self.resultCache is not None:
+        self.resultCache.invalidate(server["id"])
+
+    elif change["op"] == "set":
+      server = self.registry(change["type"]).get(change["id"])
+      if server is not None:
+        self.setValue(server, change["key"], change["value"])
+
+    elif change["op"] == "afterDeadline":
+      self.isAfterDeadline = change["value"]
 
 
   def saveUpdate(self, server, key):
     if not self.usingMongo:
       return
 
-    updateQuery = {"$set": { key: server[key] }}
-    if server["type"] == "mmg":
-      self.collection_mmgs.update_one({"id": server["id"]}, updateQuery)
-    else:
-      self.collection_reducers.update_one({"id": server["id"]}, updateQuery)
+    self.writeQueue.set(server["type"], server["id"], key, server[key])
+
+
+  def getStats(self, server):
+    """Returns the live latency/error statistics for a server (not persisted; kept on re-registration)."""
+    if not hasattr(server, "stats"):
+      with self.lock:
+        if not hasattr(server, "stats"):
+          server.stats = ServerStats()
+    return server.stats
+
+
+  def getCircuit(self, server):
+    """Returns the health circuit breaker for a server (not persisted; reset on re-registration)."""
+    if not hasattr(server, "circuit"):
+      with self.lock:
+        if not hasattr(server, "circuit"):
+          server.circuit = CircuitBreaker()
+    return server.circuit
+
+
+  def hasCapability(self, server, capability):
+    return "capabilities" in server and capability in server["capabilities"]
+
+  def capabilityValues(self, server, capability):
+    """Returns every `value` of the `capability:value` capabilities the server advertises."""
+    if "capabilities" not in server:
+      return []
+
+    prefix = f"{capability}:"
+    return [advertised[len(prefix):] for advertised in server["capabilities"] if advertised.startswith(prefix)]
+
+  def capabilityValue(self, server, capability):
+    """Returns `value` for a `capability:value` capability, or None if it is not advertised."""
+    values = self.capabilityValues(server, capability)
+    if len(values) == 0:
+      return None
+    return values[0]
+
+
+  def isHealthy(self, server):
+    if "disabled" in server and server["disabled"]:
+      return False
+
+    # An open circuit lets a trial request through once `openDuration` has passed:
+    return self.getCircuit(server).allowRequest()
 
 
   def updateCount(self, server):
     server["count"] += 1
-    self.saveUpdate(server, "count")
+    if self.usingMongo:
+      self.writeQueue.increment(server["type"], server["id"], "count")
 
   def updateValue(self, server, key, value):
-    server[key] = value
+    if key in server and server[key] == value:
+      return
+
+    self.setValue(server, key, value)
     self.saveUpdate(server, key)
+    self.publishChange({"op": "set", "type": server["type"], "id": server["id"], "key": key, "value": value})
+
+  def setValue(self, server, key, value):
+    """Sets a field without saving or publishing it, keeping the indexes up to date."""
+    with self.lock:
+      isIndexed = self.isRegistered(server) and key in ("disabled", "verification")
+      if isIndexed:
+        self.unindex(server)
+      server[key] = value
+      if isIndexed:
+        self.index(server)
@@ -0,0 +1,74 @@
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from CountingThreadPool import CountingThreadPool
+from Metrics import Metrics
+from MultipartBody import MultipartBody
+
+class ServiceDispatcher:
+  """Shared, pooled HTTP client used for every MMG and reducer call.
+
+  A single `requests.Session` keeps keep-alive connections open per host, so
+  repeated calls to the same service reuse a TCP connection instead of paying
+  for a new handshake on every request.  The number of requests in flight
+  across the whole process is capped by `maxInFlight`.
+
+  `post` blocks the calling thread; `submit` runs the same call on the
+  dispatcher's own I/O threads and returns a `concurrent.futures.Future`.
+  Files are streamed from a `MultipartBody`, so they are never copied into
+  one large request buffer.
+  """
+
+  def __init__(self, maxInFlight = 256, maxPerHost = 16, maxHosts = 1024, timeout = 15, metrics = None):
+    self.maxInFlight = maxInFlight
+    self.maxPerHost = maxPerHost
+    self.timeout = timeout
+
+    self.inFlightSemaphore = threading.BoundedSemaphore(maxInFlight)
+    self.inFlight = 0
+    self.lock = threading.Lock()
+
+    # `pool_connections` is the number of per-host pools kept alive and
+    # `pool_maxsize` is the number of keep-alive connections kept per host.
+    adapter = HTTPAdapter(pool_connections = maxHosts, pool_maxsize = maxPerHost)
+    self.session = requests.Session()
+    self.session.mount("http://", adapter)
+    self.session.mount("https://", adapter)
+
+    self.executor = CountingThreadPool(max_workers = maxInFlight)
+
+    if metrics is None:
+      metrics = Metrics()
+    self.metrics = metrics
+    metrics.counter("mosaic_service_request_bytes_total", "Bytes of files and form data sent to MMGs and reducers")
+    metrics.counter("mosaic_service_response_bytes_total", "Bytes of responses received from MMGs and reducers")
+    metrics.gauge("mosaic_dispatcher_in_flight", "MMG and reducer requests in flight", lambda: self.inFlight)
+    metrics.gauge("mosaic_dispatcher_queued", "MMG and reducer calls waiting for a dispatcher thread", lambda: self.executor.queued)
+
+  def post(self, url, params = None, files = None, data = None, timeout = None):
+    if timeout is None:
+      timeout = self.timeout
+
+    with self.inFlightSemaphore:
+      with self.lock:
+        self.inFlight += 1
+      body = MultipartBody(files = files, data = data)
+      try:
+        self.metrics.increment("mosaic_service_request_bytes_total", len(body), url = url)
+        resp = self.session.post(url, params = params, data = body, headers = {"Content-Type": body.contentType}, timeout = timeout)
+        self.metrics.increment("mosaic_service_response_bytes_total", len(resp.content), url = url)
+        return resp
+      finally:
+        body.close()
+        with self.lock:
+          self.inFlight -= 1
+
+  def head(self, url, timeout = None):
+    if timeout is None:
+      timeout = self.timeout
+
+    with self.inFlightSemaphore:
+      return self.session.head(url, timeout = timeout)
+
+  def submit(self, url, params = None, files = None, data = None, timeout = None):
+    return self.executor.submit(self.post, url, params = params, files = files, data = data, timeout = timeout)
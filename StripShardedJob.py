@@ -0,0 +1,135 @@
+import io
+import math
+import os
+import secrets
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+from Metrics import Metrics
+from TransferFormats import encodeImage, openImage
+
+def splitBaseImage(baseImage, tilesAcross, strips):
+  """Cuts a base image into at most `strips` horizontal strips on tile-row boundaries.
+
+  Each strip is as wide as the base image and has the same tile size, so an
+  MMG (using the same math as `MosaicWorker.validateMosaicImageSize`) finds
+  exactly the strip's tile rows in it.  Returns the strips as encoded images,
+  top to bottom.
+  """
+  with Image.open(io.BytesIO(baseImage)) as img:
+    hasAlpha = "A" in img.getbands() or "transparency" in img.info
+    img = img.convert("RGBA" if hasAlpha else "RGB")
+
+  d = img.width / tilesAcross
+  verticalTiles = int(img.height / d)
+  strips = max(1, min(strips, verticalTiles))
+
+  # Tile rows are split as evenly as possible; each strip covers its rows'
+  # pixels, rounded outwards, so it never has fewer rows (and, with tiles at
+  # least 2 pixels tall, never more) than it should:
+  rowBoundaries = [round(i * verticalTiles / strips) for i in range(strips + 1)]
+  images = []
+  for top, bottom in zip(rowBoundaries, rowBoundaries[1:]):
+    y0 = math.floor(top * d)
+    y1 = min(img.height, math.ceil(bottom * d))
+    if int((y1 - y0) / d) != bottom - top:
+      raise Exception(f"The base image's tiles are too small ({d:.2f} pixels) to be split into strips.")
+
+    buffer = io.BytesIO()
+    strip = img.crop((0, y0, img.width, y1))
+    if hasAlpha:
+      strip.save(buffer, "PNG")
+    else:
+      strip.save(buffer, "JPEG", quality = 95)
+    images.append(buffer.getvalue())
+
+  return images
+
+
+class StripShardedJob:
+  """Renders the mosaic of a very large base image as independent horizontal strips.
+
+  Every strip is a job of its own (a `MosaicWorker` with the strip as its
+  base image, created with `publishFinal = False`), so its MMG requests are
+  a fraction of the size of the whole image's, are scheduled and timed out
+  like any other request, and its mosaics are reduced among themselves.  The
+  strips run in parallel, each on a thread of its own (so the job must be
+  submitted to `JobManager` with one thread per strip), and their final mosaics are stitched together, top
+  to bottom, into the job's result.  Previews are only sent as progress
+  updates: one per finished strip.
+  """
+
+  def __init__(self, workers, fileFormat, previewStream, socketRoom = None, metrics = None):
+    self.workers = workers
+    self.fileFormat = fileFormat
+    self.previewStream = previewStream
+    self.socketRoom = socketRoom
+    self.jobId = secrets.token_hex(8)
+    self.stripsFinished = 0
+    self.lock = threading.Lock()
+
+    if metrics is None:
+      metrics = Metrics()
+    self.metrics = metrics
+    metrics.histogram("mosaic_strip_seconds", "Duration of each strip of a strip-sharded job")
+
+    self.previewStream.startJob(self.socketRoom)
+
+  def createMosaic(self):
+    # The job's own thread renders the first strip, so a job of N strips runs on
+    # exactly the N threads it was submitted to `JobManager` with:
+    with ThreadPoolExecutor(max_workers = max(1, len(self.workers) - 1), thread_name_prefix = "MosaicStrip") as executor:
+      futures = [None] + [executor.submit(self.renderStrip, worker) for worker in self.workers[1:]]
+      results = []
+      for i, future in enumerate(futures):
+        try:
+          results.append(self.renderStrip(self.workers[0]) if future is None else future.result())
+        except Exception as e:
+          raise Exception(f"Strip {i + 1} of {len(self.workers)} failed: {e}")
+
+    mosaicImage = self.stitch()
+    tiles = sum(worker.finalMosaic["tiles"] for worker in self.workers)
+    mosaics = min(worker.finalMosaic["mosaics"] for worker in self.workers)
+    self.saveImage(mosaicImage, tiles, mosaics)
+    self.previewStream.publishFinal(self.socketRoom, "mosaic final", self.jobId, mosaicImage, self.fileFormat)
+
+    result = {"jobId": self.jobId, "url": f"/mosaic/{self.jobId}", "strips": len(self.workers)}
+    for name in ("hedgesSent", "hedgesWon", "mmgStragglersCut"):
+      result[name] = sum(stripResult[name] for stripResult in results)
+    if any(stripResult.get("partial") for stripResult in results):
+      result["partial"] = True
+      result["mosaics"] = mosaics
+    return result
+
+  def renderStrip(self, worker):
+    startTime = time.time()
+    result = worker.createMosaic()
+    self.metrics.observe("mosaic_strip_seconds", time.time() - startTime)
+
+    with self.lock:
+      self.stripsFinished += 1
+      stripsFinished = self.stripsFinished
+
+    self.previewStream.publishProgress(self.socketRoom, "progress update", {
+      "current": stripsFinished,
+      "total": len(self.workers),
+    })
+    return result
+
+  def stitch(self):
+    """Stacks the strips' final mosaics (all the same width) into one image."""
+    strips = [openImage(worker.finalMosaicImage) for worker in self.workers]
+    mosaic = Image.new("RGB", (strips[0].width, sum(strip.height for strip in strips)))
+
+    y = 0
+    for strip in strips:
+      mosaic.paste(strip.convert("RGB"), (0, y))
+      y += strip.height
+    print(f"[StripShardedJob]: Stitched {len(strips)} strips into a {mosaic.width} x {mosaic.height} mosaic")
+    return encodeImage(mosaic, self.fileFormat)
+
+  def saveImage(self, mosaicImage, tiles, mosaics):
+    fileName = os.path.join("mosaics", f"{int(time.time() * 1000)}_{tiles}_{mosaics}.{self.fileFormat.lower()}")
+    with open(fileName, "wb") as f:
+      f.write(mosaicImage)
@@ -0,0 +1,26 @@
+class TimeoutPolicy:
+  """Per-endpoint request timeouts from each service's observed latencies.
+
+  Once a service has `minSamples` successful responses, its requests time
+  out after `multiplier` times its `percentile` latency, kept within
+  `minTimeout` and `maxTimeout` seconds.  Services that have not been
+  measured yet, or whose error EWMA is above `maxErrorRate` (possibly
+  because the timeout itself is too tight), get `maxTimeout`.
+  """
+
+  def __init__(self, servers, percentile = 99, multiplier = 3, minTimeout = 2, maxTimeout = 15, minSamples = 5, maxErrorRate = 0.2):
+    self.servers = servers
+    self.percentile = percentile
+    self.multiplier = multiplier
+    self.minTimeout = minTimeout
+    self.maxTimeout = maxTimeout
+    self.minSamples = minSamples
+    self.maxErrorRate = maxErrorRate
+
+  def timeout(self, server):
+    stats = self.servers.getStats(server)
+    if stats.successes < self.minSamples or stats.errorEWMA > self.maxErrorRate:
+      return self.maxTimeout
+
+    latency = stats.percentile(self.percentile)
+    return min(self.maxTimeout, max(self.minTimeout, self.multiplier * latency))
@@ -0,0 +1,164 @@
+import io
+import struct
+import zlib
+from PIL import Image, features
+
+# Raw RGB mosaics start with one of these (then a big-endian width and height):
+RAW_RGB_ZLIB_MAGIC = b"RGBZ"
+RAW_RGB_ZSTD_MAGIC = b"RGBS"
+RAW_RGB_MAGICS = (RAW_RGB_ZLIB_MAGIC, RAW_RGB_ZSTD_MAGIC)
+
+
+class TransferFormat:
+  """An encoding for intermediate mosaics, which only the middleware and services ever see.
+
+  `container` is what `containerOf` reports for an image in this format, so
+  a mosaic can be matched to the formats a service accepts by its bytes
+  alone (e.g. `png-fast` is an ordinary PNG that any service can read).
+  """
+
+  name = None
+  container = None
+
+  def encode(self, img):
+    raise NotImplementedError()
+
+
+class PngTransferFormat(TransferFormat):
+  """PNG at the fastest compression level."""
+
+  name = "png-fast"
+  container = "png"
+
+  def encode(self, img):
+    buffer = io.BytesIO()
+    img.save(buffer, "PNG", compress_level = 1)
+    return buffer.getvalue()
+
+
+class WebpTransferFormat(TransferFormat):
+  """Lossless WebP with the fastest (least effort) settings."""
+
+  name = "webp-lossless"
+  container = "webp"
+
+  def encode(self, img):
+    buffer = io.BytesIO()
+    img.save(buffer, "WEBP", lossless = True, quality = 0, method = 0)
+    return buffer.getvalue()
+
+
+class RawTransferFormat(TransferFormat):
+  """Raw 8-bit RGB pixels, row by row, compressed as a whole.
+
+  The image is `magic`, its width and height (big-endian 32-bit integers),
+  then the compressed pixels; there is nothing to parse besides the header,
+  so decoding costs little more than decompression.
+  """
+
+  def __init__(self, name, magic, compress, decompress):
+    self.name = name
+    self.container = name
+    self.magic = magic
+    self.compress = compress
+    self.decompress = decompress
+
+  def encode(self, img):
+    if img.mode != "RGB":
+      img = img.convert("RGB")
+    return self.magic + struct.pack(">II", img.width, img.height) + self.compress(img.tobytes())
+
+  def decode(self, data):
+    width, height = struct.unpack(">II", data[4:12])
+    return Image.frombytes("RGB", (width, height), self.decompress(data[12:]))
+
+
+def createTransferFormats():
+  """Every transfer format this process can encode and decode, by name."""
+  formats = [
+    PngTransferFormat(),
+    RawTransferFormat("rgb-zlib", RAW_RGB_ZLIB_MAGIC, lambda raw: zlib.compress(raw, 1), zlib.decompress),
+  ]
+
+  if features.check("webp"):
+    formats.append(WebpTransferFormat())
+
+  # zstd is optional; without the `zstandard` package, `rgb-zstd` is not offered:
+  try:
+    import zstandard
+    formats.append(RawTransferFormat(
+      "rgb-zstd",
+      RAW_RGB_ZSTD_MAGIC,
+      lambda raw: zstandard.ZstdCompressor(level = 1).compress(raw),
+      lambda data: zstandard.ZstdDecompressor().decompress(data),
+    ))
+  except ImportError:
+    pass
+
+  return {transferFormat.name: transferFormat for transferFormat in formats}
+
+
+transferFormats = createTransferFormats()
+
+
+def supportedTransferFormats():
+  """Names of the transfer formats this process can encode and decode."""
+  return list(transferFormats)
+
+
+def getTransferFormat(name):
+  if name not in transferFormats:
+    raise Exception(f"Unknown transfer format: {name}")
+  return transferFormats[name]
+
+
+def containerOf(image):
+  """The kind of image in `image` (`png`, `jpeg`, `webp`, `gif`, or a raw format's name), or None."""
+  if image[:8] == b"\x89PNG\r\n\x1a\n":
+    return "png"
+  if image[:2] == b"\xff\xd8":
+    return "jpeg"
+  if image[:4] == b"RIFF" and image[8:12] == b"WEBP":
+    return "webp"
+  if image[:6] in (b"GIF87a", b"GIF89a"):
+    return "gif"
+  for transferFormat in transferFormats.values():
+    if isinstance(transferFormat, RawTransferFormat) and image[:4] == transferFormat.magic:
+      return transferFormat.name
+  return None
+
+
+def fileFormatContainer(fileFormat):
+  """The container of images in the user's `fileFormat` (e.g. `JPG` is `jpeg`)."""
+  fileFormat = fileFormat.lower()
+  if fileFormat == "jpg":
+    return "jpeg"
+  return fileFormat
+
+
+def openImage(image):
+  """Opens a mosaic in any transfer format, or any format PIL reads, as a PIL image."""
+  transferFormat = transferFormats.get(containerOf(image))
+  if isinstance(transferFormat, RawTransferFormat):
+    return transferFormat.decode(image)
+  return Image.open(io.BytesIO(image))
+
+
+def encodeImage(img, fileFormat):
+  buffer = io.BytesIO()
+  if fileFormatContainer(fileFormat) == "jpeg":
+    if img.mode not in ("RGB", "L"):
+      img = img.convert("RGB")
+    img.save(buffer, "JPEG")
+  else:
+    img.save(buffer, fileFormat)
+  return buffer.getvalue()
+
+
+def transcode(image, fileFormat):
+  """Re-encodes a mosaic in the user's `fileFormat`, unless it already is in it."""
+  if containerOf(image) == fileFormatContainer(fileFormat):
+    return image
+
+  with openImage(image) as img:
+    return encodeImage(img, fileFormat)
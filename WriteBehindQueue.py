@@ -0,0 +1,151 @@
+import atexit
+import threading
+import pymongo
+
+class WriteBehindQueue:
+  """Batches MongoDB writes for server records off the request path.
+
+  Counter increments are merged into one `$inc` per document and field
+  updates into one `$set` (the newest value wins).  A full-document
+  replacement (used at registration) supersedes every pending update for
+  that document.  Pending writes are sent with one `bulk_write` per
+  collection every `flushInterval` seconds, as soon as `maxPending`
+  documents have pending writes, and at interpreter shutdown.
+
+  Writes are ordered, so when one of them fails, every write before it has
+  been applied and only it and the writes after it are retried (an `$inc`
+  is never applied twice).
+  """
+
+  def __init__(self, collections, flushInterval = 1.0, maxPending = 500):
+    self.collections = collections
+    self.flushInterval = flushInterval
+    self.maxPending = maxPending
+
+    self.pending = {}
+    self.lock = threading.Lock()
+    self.flushLock = threading.Lock()
+    self.wakeup = threading.Event()
+    self.writesQueued = 0
+    self.writesFlushed = 0
+
+    self.thread = threading.Thread(target = self.run, name = "WriteBehindQueue", daemon = True)
+    self.thread.start()
+    atexit.register(self.flush)
+
+  def entry(self, type, id):
+    key = (type, id)
+    if key not in self.pending:
+      self.pending[key] = {"replace": None, "$set": {}, "$inc": {}}
+      if len(self.pending) >= self.maxPending:
+        self.wakeup.set()
+    return self.pending[key]
+
+  def replace(self, type, id, document):
+    with self.lock:
+      entry = self.entry(type, id)
+      entry["replace"] = document
+      entry["$set"] = {}
+      entry["$inc"] = {}
+      self.writesQueued += 1
+
+  def set(self, type, id, key, value):
+    with self.lock:
+      entry = self.entry(type, id)
+      entry["$set"][key] = value
+      entry["$inc"].pop(key, None)
+      self.writesQueued += 1
+
+  def increment(self, type, id, key, amount = 1):
+    with self.lock:
+      entry = self.entry(type, id)
+      if key in entry["$set"]:
+        entry["$set"][key] += amount
+      else:
+        entry["$inc"][key] = entry["$inc"].get(key, 0) + amount
+      self.writesQueued += 1
+
+  def run(self):
+    while True:
+      self.wakeup.wait(self.flushInterval)
+      self.wakeup.clear()
+      try:
+        self.flush()
+      except Exception:
+        import traceback
+        traceback.print_exc()
+
+  def flush(self):
+    with self.flushLock:
+      with self.lock:
+        batch = self.pending
+        self.pending = {}
+
+      if len(batch) == 0:
+        return
+
+      # Each operation is kept with the document and the part of its entry it writes:
+      operations = {}
+      for (type, id), entry in batch.items():
+        ops = operations.setdefault(type, [])
+        if entry["replace"] is not None:
+          ops.append(((type, id), "replace", pymongo.ReplaceOne({"id": id}, entry["replace"], upsert = True)))
+
+        update = {}
+        if len(entry["$set"]) > 0:
+          update["$set"] = entry["$set"]
+        if len(entry["$inc"]) > 0:
+          update["$inc"] = entry["$inc"]
+        if len(update) > 0:
+          ops.append(((type, id), "update", pymongo.UpdateOne({"id": id}, update)))
+
+      for type, ops in operations.items():
+        try:
+          self.collections[type].bulk_write([op for key, part, op in ops], ordered = True)
+          self.writesFlushed += len(ops)
+        except pymongo.errors.BulkWriteError as e:
+          # Ordered: every operation before the first error was applied, and none after it:
+          failedIndex = e.details["writeErrors"][0]["index"]
+          self.writesFlushed += failedIndex
+          print(f"[WriteBehindQueue]: Unable to write {len(ops) - failedIndex} of {len(ops)} {type} updates, will retry: {e.details['writeErrors'][0].get('errmsg')}")
+          self.requeue(self.unappliedEntries(batch, ops[failedIndex:]))
+        except Exception as e:
+          # Nothing is known to have been applied:
+          print(f"[WriteBehindQueue]: Unable to write {len(ops)} {type} updates, will retry: {e}")
+          self.requeue({key: entry for key, entry in batch.items() if key[0] == type})
+
+  def unappliedEntries(self, batch, ops):
+    """The parts of `batch`'s entries written by `ops`, as a batch to requeue."""
+    entries = {}
+    for key, part, op in ops:
+      entry = entries.setdefault(key, {"replace": None, "$set": {}, "$inc": {}})
+      if part == "replace":
+        entry["replace"] = batch[key]["replace"]
+      else:
+        entry["$set"] = dict(batch[key]["$set"])
+        entry["$inc"] = dict(batch[key]["$inc"])
+    return entries
+
+  def requeue(self, batch):
+    """Puts failed writes back in front of any writes queued since they were taken."""
+    with self.lock:
+      for key, failed in batch.items():
+        newer = self.pending.get(key)
+        if newer is None:
+          self.pending[key] = failed
+        elif newer["replace"] is None:
+          # Newer increments apply on top of failed values; newer values replace them:
+          values = dict(failed["$set"])
+          increments = dict(failed["$inc"])
+          for field, amount in newer["$inc"].items():
+            if field in values:
+              values[field] += amount
+            else:
+              increments[field] = increments.get(field, 0) + amount
+          for field, value in newer["$set"].items():
+            values[field] = value
+            increments.pop(field, None)
+
+          newer["replace"] = failed["replace"]
+          newer["$set"] = values
+          newer["$inc"] = increments
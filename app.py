@@ -3,28 +3,184 @@ from dotenv import load_dotenv
 from ServersCollection import ServersCollection
 load_dotenv()
 
-from flask import Flask, jsonify, make_response, render_template, request
+from flask import Flask, abort, g, jsonify, make_response, render_template, request, send_file
 from flask_socketio import SocketIO
 from MosaicWorker import MosaicWorker
+from ServiceDispatcher import ServiceDispatcher
+from ReductionScheduler import createReductionScheduler
+from ReducerDispatcher import ReducerDispatcher
+from EndpointScheduler import EndpointScheduler
+from TimeoutPolicy import TimeoutPolicy
+from HealthMonitor import HealthMonitor
+from BaseImageStore import BaseImageStore
+from PreviewStream import PreviewStream
+from JobManager import JobManager
+from Metrics import Metrics
+from ResultCache import ResultCache
+from LocalReducer import LocalReducer
+from IntermediateStore import IntermediateStore
+from BaseImageNormalizer import BaseImageNormalizer
+from RegistryFeed import createRegistryFeed
+from SQLiteMessageQueue import SQLiteMessageQueue
+from StripShardedJob import StripShardedJob, splitBaseImage
 import os 
+import io
+import time
 from urllib.parse import quote_plus
 
 app = Flask(__name__)
 app.jinja_env.filters['quote_plus'] = lambda u: quote_plus(u)
 
-socketio = SocketIO(app)
+# When several middleware processes serve the same clients, Socket.IO events are
+# relayed between them through a message queue: `sqlite:///path` for processes
+# on one host, or any URL Flask-SocketIO supports (e.g. `redis://...`):
+socketioMessageQueue = os.getenv("SOCKETIO_MESSAGE_QUEUE", "")
+if socketioMessageQueue.startswith("sqlite:///"):
+    socketio = SocketIO(app, client_manager = SQLiteMessageQueue(socketioMessageQueue[len("sqlite:///"):]))
+elif socketioMessageQueue != "":
+    socketio = SocketIO(app, message_queue = socketioMessageQueue)
+else:
+    socketio = SocketIO(app)
+
+# Counters, latency histograms and gauges for GET /metrics (Prometheus text format):
+metrics = Metrics()
+
+# Thumbnails and progress for the client that submitted each job, and the most
+# recent final mosaics (up to FINAL_IMAGE_BYTES of them) for `/mosaic/<jobId>`:
+previewStream = PreviewStream(
+    socketio,
+    clientByteBudget = int(os.getenv("PREVIEW_BYTE_BUDGET", "2000000")),
+    finalImageBytes = int(os.getenv("FINAL_IMAGE_BYTES", "200000000")),
+    metrics = metrics,
+)
+
+@socketio.on("disconnect")
+def socketio_disconnect():
+    previewStream.forget(request.sid)
+
+# MMG results of repeated base images and render parameters are reused:
+resultCache = ResultCache(
+    maxMemoryBytes = int(os.getenv("RESULT_CACHE_MEMORY_BYTES", "256000000")),
+    maxDiskBytes = int(os.getenv("RESULT_CACHE_DISK_BYTES", "2000000000")),
+    metrics = metrics,
+)
 
 useDB = False
 if os.getenv("ADMIN_PASSCODE"):
     useDB = True
 
-servers = ServersCollection(useDB)
+# ...and registry changes through a change feed (`sqlite:///path` or `mongodb://...`):
+registryFeed = None
+if os.getenv("REGISTRY_FEED"):
+    registryFeed = createRegistryFeed(os.getenv("REGISTRY_FEED"))
+
+servers = ServersCollection(useDB, registryFeed = registryFeed, resultCache = resultCache)
 
 os.makedirs("mosaics", exist_ok=True)
 
 
-from concurrent.futures import ThreadPoolExecutor
-threadPool = ThreadPoolExecutor(max_workers=30)
+# All MMG and reducer calls share one pooled, keep-alive HTTP client.  Each
+# in-flight call still occupies a thread, so the thread pool is sized to match
+# the dispatcher's in-flight limit.
+maxInFlight = int(os.getenv("MAX_INFLIGHT_REQUESTS", "256"))
+dispatcher = ServiceDispatcher(
+    maxInFlight = maxInFlight,
+    maxPerHost = int(os.getenv("MAX_CONNECTIONS_PER_HOST", "16")),
+    metrics = metrics,
+)
+
+# Reducers are shared by every job and picked by observed latency and error rate:
+reducerDispatcher = ReducerDispatcher(
+    servers,
+    maxConcurrency = int(os.getenv("MAX_REQUESTS_PER_REDUCER", "4")),
+)
+
+# Each MMG gets at most this many concurrent requests across all jobs, shared
+# round-robin between the jobs waiting for it:
+endpointScheduler = EndpointScheduler(
+    servers,
+    maxPerEndpoint = int(os.getenv("MAX_REQUESTS_PER_MMG", "2")),
+)
+
+# MMG and reducer requests time out after a multiple of each service's own
+# recent latency, between these bounds:
+timeoutPolicy = TimeoutPolicy(
+    servers,
+    minTimeout = float(os.getenv("MIN_REQUEST_TIMEOUT", "2")),
+    maxTimeout = float(os.getenv("MAX_REQUEST_TIMEOUT", "15")),
+)
+
+# Background health checks keep each server's circuit breaker up to date:
+healthMonitor = HealthMonitor(
+    servers,
+    dispatcher,
+    interval = float(os.getenv("HEALTH_CHECK_INTERVAL", "30")),
+)
+healthMonitor.start()
+
+# Base images of running jobs, served by digest to services that support it.  With
+# several processes, they are also written to a directory every process can read:
+baseImageStore = BaseImageStore(directory = os.getenv("BASE_IMAGE_DIRECTORY") or None)
+
+# How pending mosaics are paired for reduction ("balanced" or the original "lifo"):
+reductionScheduler = createReductionScheduler(os.getenv("REDUCTION_SCHEDULER", "balanced"))
+
+from CountingThreadPool import CountingThreadPool
+threadPool = CountingThreadPool(max_workers=maxInFlight)
+
+# /makeMosaic jobs run in the background; when every running slot and queue
+# slot is taken, new jobs are refused with HTTP 429.  Each job may only have
+# a limited number of MMG and reducer calls in flight at once:
+jobManager = JobManager(
+    maxRunningJobs = int(os.getenv("MAX_RUNNING_JOBS", "8")),
+    maxQueuedJobs = int(os.getenv("MAX_QUEUED_JOBS", "32")),
+    metrics = metrics,
+)
+maxMMGsPerJob = int(os.getenv("MAX_MMGS_PER_JOB", "32"))
+maxReductionsPerJob = int(os.getenv("MAX_REDUCTIONS_PER_JOB", "16"))
+
+# Each job keeps at most this many bytes of intermediate mosaics in memory and
+# spills the rest to temporary files:
+intermediateMemoryBudget = int(os.getenv("INTERMEDIATE_MEMORY_BUDGET", "64000000"))
+
+# Uploaded base images larger than any mosaic made from them can show are
+# shrunk once, before they are sent to every MMG and reducer:
+baseImageNormalizer = None
+if os.getenv("NORMALIZE_BASE_IMAGE", "true").lower() in ("1", "true", "yes"):
+    baseImageNormalizer = BaseImageNormalizer(
+        jpegQuality = int(os.getenv("BASE_IMAGE_JPEG_QUALITY", "90")),
+        metrics = metrics,
+    )
+
+# `/makeMosaic` requests may split the base image into at most this many strips:
+maxStrips = int(os.getenv("MAX_STRIPS", "16"))
+
+# Intermediate mosaics are requested in the first of these transfer formats that
+# every reducer of a job accepts (see `TransferFormats.py`; empty to always use
+# the user's `fileFormat`):
+transferFormats = [name.strip() for name in os.getenv("TRANSFER_FORMATS", "webp-lossless,png-fast").split(",") if name.strip() != ""]
+
+# Jobs fall back to the built-in reducer when none of their reducers is healthy:
+useLocalReducer = os.getenv("LOCAL_REDUCER_FALLBACK", "true").lower() in ("1", "true", "yes")
+
+metrics.gauge("mosaic_thread_pool_active", "Tasks running in the shared MMG thread pool", lambda: threadPool.active)
+metrics.gauge("mosaic_thread_pool_queued", "Tasks waiting for a thread in the shared MMG thread pool", lambda: threadPool.queued)
+metrics.gauge("mosaic_mmg_requests_waiting", "MMG requests waiting for a free slot at their MMG", lambda: endpointScheduler.waiting)
+metrics.gauge("mosaic_reductions_waiting", "Reductions waiting for a reducer with free capacity", lambda: reducerDispatcher.waiting)
+metrics.gauge("mosaic_jobs_running", "Mosaic jobs running", lambda: jobManager.running)
+metrics.gauge("mosaic_jobs_queued", "Mosaic jobs waiting to run", lambda: jobManager.queued)
+metrics.histogram("mosaic_http_request_seconds", "Latency of the middleware's own routes")
+
+
+@app.before_request
+def startRequestTimer():
+    g.requestStart = time.time()
+
+@app.after_request
+def recordRequestLatency(response):
+    if "requestStart" in g and request.url_rule is not None:
+        metrics.observe("mosaic_http_request_seconds", time.time() - g.requestStart, route = request.url_rule.rule, method = request.method, status = response.status_code)
+    return response
 
 @app.route("/", methods=["GET"])
 def GET_index():
@@ -40,6 +196,12 @@ def GET_index():
     return render_template("index.html", data={"disableInterface": disableInterface})
 
 
+def requestCapabilities():
+    """Optional protocol extensions a service supports, as a comma-separated `capabilities` form field"""
+    capabilities = request.form.get("capabilities", "")
+    return [c.strip() for c in capabilities.split(",") if c.strip() != ""]
+
+
 @app.route("/addMMG", methods=["PUT"])
 def PUT_addMMG():
     """Add a mosaic microservice generator"""
@@ -57,8 +219,12 @@ def PUT_addMMG():
         url = request.form["url"],
         author = request.form["author"],
         tiles = int(request.form["tileImageCount"]),
+        capabilities = requestCapabilities(),
     )
 
+    # A re-registered MMG may render differently now:
+    resultCache.invalidate(result["id"])
+
     return jsonify(result["id"]), 200
 
 
@@ -76,6 +242,7 @@ def PUT_registerReducer():
     result = servers.addReducer(
         url = request.form["url"],
         author = request.form["author"],
+        capabilities = requestCapabilities(),
     )
 
     return jsonify(result["id"]), 200
@@ -88,54 +255,137 @@ async def POST_makeMosaic():
     if os.getenv("ADMIN_PASSCODE") and ("admin" not in request.cookies or request.cookies.get("admin") != os.getenv("ADMIN_PASSCODE")):
         return jsonify({"error": "This server is currently in admin-only mode. You are unable to add an image."}), 400
 
+    baseImageDigests = []
+    isQueued = False
     try:
         input_file = request.files["image"]
         baseImage = input_file.read()
 
-        worker = MosaicWorker(
-            baseImage = baseImage,
-            tilesAcross = int(request.form["tilesAcross"]),
-            renderedTileSize = int(request.form["renderedTileSize"]),
-            fileFormat = request.form["fileFormat"],
-            servers = servers,
-            socketio = socketio,
-            threadPool = threadPool,
-        )
+        # Optional straggler handling:
+        hedgePercentile = None
+        if request.form.get("hedgePercentile", "") != "":
+            hedgePercentile = float(request.form["hedgePercentile"])
+
+        mmgCutoff = None
+        if request.form.get("mmgCutoff", "") != "":
+            mmgCutoff = float(request.form["mmgCutoff"])
+
+        deadline = None
+        if request.form.get("deadline", "") != "":
+            deadline = float(request.form["deadline"])
+
+        tilesAcross = int(request.form["tilesAcross"])
+        renderedTileSize = int(request.form["renderedTileSize"])
+        fileFormat = request.form["fileFormat"]
 
+        if baseImageNormalizer is not None:
+            baseImage = baseImageNormalizer.normalize(baseImage, tilesAcross, renderedTileSize)
 
         # MMGs and Filtering
         filterQuery = request.form["filter"]
         if filterQuery == "":
             filterQuery = False
 
-        for id in servers.mmgs:
-            mmg = servers.mmgs[id]
+        mmgs = []
+        for mmg in servers.enabledMMGs():
             if filterQuery and filterQuery not in mmg["name"]:
                 continue
 
-            if "disabled" in mmg and mmg["disabled"]:
+            if not servers.isHealthy(mmg):
                 continue
 
-            worker.addMMG( mmg )
-        
+            mmgs.append(mmg)
+
 
         # Reducers and Verification
-        verifiedOnly = False
         if "verified" in request.form:
-            verifiedOnly = True
-
-        for id in servers.reducers:
-            reducer = servers.reducers[id]
-            if verifiedOnly and reducer["verification"] != "GOOD":
-                continue
-
-            if "disabled" in reducer and reducer["disabled"]:
-                continue
-
-            worker.addReducer( reducer )
-
-        result = worker.createMosaic()
-        return jsonify(result)
+            reducers = servers.enabledVerifiedReducers()
+        else:
+            reducers = servers.enabledReducers()
+
+        reducers = [reducer for reducer in reducers if servers.isHealthy(reducer)]
+
+        # Fail fast instead of queueing a job that cannot run:
+        if len(mmgs) == 0:
+            raise Exception("No MMGs are available on this server.")
+        if len(reducers) == 0 and not useLocalReducer:
+            raise Exception("No reducers are available on this server.")
+
+        def createWorker(baseImage, socketRoom, publishFinal = True, strips = 1):
+            baseImageDigest = baseImageStore.publish(baseImage)
+            baseImageDigests.append(baseImageDigest)
+
+            localReducer = None
+            if useLocalReducer:
+                localReducer = LocalReducer(baseImage, tilesAcross, renderedTileSize, fileFormat)
+
+            worker = MosaicWorker(
+                baseImage = baseImage,
+                tilesAcross = tilesAcross,
+                renderedTileSize = renderedTileSize,
+                fileFormat = fileFormat,
+                servers = servers,
+                previewStream = previewStream,
+                socketRoom = socketRoom,
+                threadPool = threadPool,
+                dispatcher = dispatcher,
+                reducerDispatcher = reducerDispatcher,
+                reductionScheduler = reductionScheduler,
+                hedgePercentile = hedgePercentile,
+                mmgCutoff = mmgCutoff,
+                baseImageDigest = baseImageDigest,
+                baseImageUrl = baseImageUrl(baseImageDigest),
+                # The strips of a strip-sharded job share the job's caps:
+                maxConcurrentMMGs = max(1, maxMMGsPerJob // strips),
+                maxConcurrentReductions = max(1, maxReductionsPerJob // strips),
+                metrics = metrics,
+                resultCache = resultCache,
+                localReducer = localReducer,
+                intermediateStore = IntermediateStore(
+                    memoryBudget = intermediateMemoryBudget,
+                    metrics = metrics,
+                ),
+                endpointScheduler = endpointScheduler,
+                timeoutPolicy = timeoutPolicy,
+                deadline = deadline,
+                transferFormats = transferFormats,
+                publishFinal = publishFinal,
+            )
+
+            for mmg in mmgs:
+                worker.addMMG( mmg )
+            for reducer in reducers:
+                worker.addReducer( reducer )
+            return worker
+
+        # Optional strip sharding: each strip of the base image is a job of its own,
+        # and the strips' mosaics are stitched together at the end:
+        strips = 1
+        if request.form.get("strips", "") != "":
+            strips = min(int(request.form["strips"]), maxStrips)
+
+        if strips > 1:
+            stripImages = splitBaseImage(baseImage, tilesAcross, strips)
+            stripWorkers = [createWorker(strip, None, publishFinal = False, strips = len(stripImages)) for strip in stripImages]
+            worker = StripShardedJob(stripWorkers, fileFormat, previewStream, socketRoom = request.form.get("socketId"), metrics = metrics)
+            jobThreads = len(stripWorkers)
+        else:
+            worker = createWorker(baseImage, request.form.get("socketId"))
+            jobThreads = 1
+
+        def runJob(worker = worker, baseImageDigests = baseImageDigests):
+            try:
+                return worker.createMosaic()
+            finally:
+                for baseImageDigest in baseImageDigests:
+                    baseImageStore.release(baseImageDigest)
+
+        status = jobManager.submit(worker.jobId, runJob, threads = jobThreads)
+        if status is None:
+            return jsonify({"error": "Too many mosaics are being generated right now.  Please try again in a moment."}), 429
+
+        isQueued = True
+        return jsonify(status), 202
 
     except KeyError as e:
         print(e)
@@ -147,25 +397,65 @@ async def POST_makeMosaic():
 
         return jsonify({"error": str(e)}), 400
 
+    finally:
+        # A queued job releases its base images itself when it finishes:
+        if not isQueued:
+            for baseImageDigest in baseImageDigests:
+                baseImageStore.release(baseImageDigest)
+
+
+@app.route("/job/<jobId>", methods=["GET"])
+def GET_job(jobId):
+    """Status of a /makeMosaic job (and its result once it is done)"""
+    status = jobManager.get(jobId)
+    if status is None:
+        return jsonify({"error": "Job not found."}), 404
+
+    return jsonify(status)
+
+
+def baseImageUrl(digest):
+    publicUrl = os.getenv("PUBLIC_URL", request.host_url)
+    return f"{publicUrl.rstrip('/')}/baseImage/{digest}"
+
+
+@app.route("/baseImage/<digest>", methods=["GET"])
+def GET_baseImage(digest):
+    """Serves the base image of a running job by its SHA-256 digest"""
+    image = baseImageStore.get(digest)
+    if image is None:
+        abort(404)
+
+    resp = make_response(image)
+    resp.headers["Content-Type"] = "application/octet-stream"
+    resp.headers["Cache-Control"] = "public, max-age=86400, immutable"
+    resp.headers["ETag"] = digest
+    return resp
+
+
+@app.route("/mosaic/<jobId>", methods=["GET"])
+def GET_mosaic(jobId):
+    """Full-size final mosaic of a finished job"""
+    final = previewStream.getFinal(jobId)
+    if final is None:
+        abort(404)
+
+    image, fileFormat = final
+    return send_file(io.BytesIO(image), mimetype = f"image/{fileFormat.lower()}")
+
+
+@app.route("/metrics", methods=["GET"])
+def GET_metrics():
+    """Middleware metrics in the Prometheus text format"""
+    resp = make_response(metrics.render())
+    resp.headers["Content-Type"] = "text/plain; version=0.0.4; charset=utf-8"
+    return resp
+
 
 @app.route("/serverList", methods=["GET"])
 def GET_serverList():
     """Route to get connected servers"""
-    servers_by_author = {}
-    for key in servers.mmgs:
-        mmg = servers.mmgs[key]
-        author = mmg["author"]
-        if author not in servers_by_author:
-            servers_by_author[author] = []
-        servers_by_author[author].append(mmg)
-      
-    for key in servers.reducers:
-        reducer = servers.reducers[key]
-        author = reducer["author"]
-        if author not in servers_by_author:
-            servers_by_author[author] = []
-        servers_by_author[author].append(reducer)
-
+    servers_by_author = servers.serversByAuthor()
     return render_template("servers.html", data=servers_by_author)
 
 
@@ -189,12 +479,10 @@ def verify(how):
         return jsonify({"error": "This server is currently in admin-only mode. You are unable to add an image."}), 400
 
     author = request.args.get("author")
-    for key in servers.reducers:
-        reducer = servers.reducers[key]
-        if author == reducer["author"]:
-            servers.updateValue(reducer, "verification", how)
-            return jsonify({"verification": how})
-            
+    for reducer in servers.reducersForAuthor(author):
+        servers.updateValue(reducer, "verification", how)
+        return jsonify({"verification": how})
+
     return jsonify({"error": "author not found"})
 
 @app.route("/verify_GOOD", methods=["GET"])
@@ -232,6 +520,7 @@ def POST_adminEnable():
 rainbowTest = None
 with open("testFiles/rainbow.png", "rb") as f:
     rainbowTest = f.read()
+rainbowTestDigest = baseImageStore.publish(rainbowTest)
 
 imgA = None
 with open("testFiles/A.png", "rb") as f:
@@ -262,35 +551,43 @@ async def GET_testMosaic():
         tilesAcross = 50,
         renderedTileSize = 10,
         fileFormat = "PNG",
-        socketio = socketio,
+        previewStream = previewStream,
+        socketRoom = request.args.get("socketId"),
         servers = servers,
         threadPool = threadPool,
+        dispatcher = dispatcher,
+        reducerDispatcher = reducerDispatcher,
         socketio_filter = f" {author}",
+        baseImageDigest = rainbowTestDigest,
+        baseImageUrl = baseImageUrl(rainbowTestDigest),
+        metrics = metrics,
+        localReducer = LocalReducer(rainbowTest, 50, 10, "PNG"),
+        endpointScheduler = endpointScheduler,
+        timeoutPolicy = timeoutPolicy,
+        transferFormats = transferFormats,
     )
 
-    for id in servers.mmgs:
-        mmg = servers.mmgs[id]
+    for mmg in servers.mmgsForAuthor(author):
         if "disabled" in mmg and mmg["disabled"]:
             continue
 
-        if mmg["author"] == author:
-            worker.addMMG( mmg )    
+        worker.addMMG( mmg )    
 
-    for id in servers.reducers:
-        reducer = servers.reducers[id]
+    for reducer in servers.reducersForAuthor(author):
         if "disabled" in reducer and reducer["disabled"]:
             continue
 
-        if reducer["author"] == author:
-            worker.addReducer( reducer )        
+        worker.addReducer( reducer )        
 
     try:
         worker.testMosaic()
-        worker.testReduction(imgA, imgB, imgC, imgD)
+        report = worker.testReduction(imgA, imgB, imgC, imgD)
 
-        return jsonify([])
+        return jsonify(report)
     except Exception as e:
         import traceback
         traceback.print_exc()
         return jsonify({"error": str(e)}), 400
+    finally:
+        worker.close()
 
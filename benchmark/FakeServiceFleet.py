@@ -0,0 +1,191 @@
+import io
+import math
+import os
+import random
+import sys
+import threading
+import time
+import requests
+from PIL import Image
+from werkzeug.serving import make_server
+from werkzeug.wrappers import Request, Response
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ImageHeader import getImageSize
+from TransferFormats import containerOf, getTransferFormat, openImage
+
+class LatencyDistribution:
+  """Response delay of a fake service: `fixed:0.1`, `uniform:0.05,0.5` or `lognormal:0.2,0.5` (median, sigma)."""
+
+  def __init__(self, spec):
+    self.spec = spec
+    kind, _, args = spec.partition(":")
+    self.kind = kind
+    self.args = [float(a) for a in args.split(",") if a != ""]
+
+    if kind not in ("fixed", "uniform", "lognormal"):
+      raise Exception(f"Unknown latency distribution \"{spec}\"")
+
+  def sample(self):
+    if self.kind == "fixed":
+      return self.args[0]
+    elif self.kind == "uniform":
+      return random.uniform(self.args[0], self.args[1])
+    else:
+      return random.lognormvariate(math.log(self.args[0]), self.args[1])
+
+
+class FakeServiceFleet:
+  """Localhost MMGs and reducers that follow the middleware's request contract.
+
+  Every service listens on its own port.  An MMG answers with a mosaic of the
+  size the middleware requires (MMG `i` with the `i % distinctMosaics`th of
+  that many different mosaics, as cloned MMGs would, or, by default, a
+  mosaic of its own); a reducer answers with `mosaic1`.  Each
+  request is delayed by a sample of `latency` (plus `pixelSeconds` per
+  megapixel of the mosaic it answers with), then fails with HTTP 500 with
+  probability `errorRate`, answers with a wrongly sized mosaic with
+  probability `malformedRate`, or hangs for `hangSeconds` (so the middleware's
+  timeout fires) with probability `timeoutRate`.  Services registered with
+  the `baseImageDigest` capability download and cache the base image, and
+  mosaics are returned in the `transferFormat` the middleware asks for.
+  """
+
+  def __init__(self, mmgs = 16, reducers = 4, latency = "uniform:0.01,0.1", errorRate = 0, malformedRate = 0, timeoutRate = 0, hangSeconds = 30, capabilities = [], pixelSeconds = 0, distinctMosaics = 0):
+    self.mmgCount = mmgs
+    self.reducerCount = reducers
+    self.latency = LatencyDistribution(latency)
+    self.errorRate = errorRate
+    self.malformedRate = malformedRate
+    self.timeoutRate = timeoutRate
+    self.hangSeconds = hangSeconds
+    self.capabilities = capabilities
+    self.pixelSeconds = pixelSeconds
+    self.distinctMosaics = distinctMosaics
+
+    self.servers = []
+    self.mmgUrls = []
+    self.reducerUrls = []
+    self.lock = threading.Lock()
+    self.baseImages = {}
+    self.mosaics = {}
+    self.counters = {"requests": 0, "errors": 0, "malformed": 0, "timeouts": 0, "bytesIn": 0, "bytesOut": 0}
+
+  def start(self):
+    for i in range(self.mmgCount):
+      variant = i % self.distinctMosaics if self.distinctMosaics > 0 else i
+      self.mmgUrls.append(self.startServer(lambda request, variant = variant: self.mmg(request, variant)))
+    for i in range(self.reducerCount):
+      self.reducerUrls.append(self.startServer(self.reducer))
+
+  def startServer(self, handler):
+    server = make_server("127.0.0.1", 0, Request.application(handler), threaded = True)
+    server.daemon_threads = True
+    server.request_queue_size = 256
+    threading.Thread(target = server.serve_forever, daemon = True).start()
+    self.servers.append(server)
+    return f"http://127.0.0.1:{server.server_port}/"
+
+  def stop(self):
+    for server in self.servers:
+      server.shutdown()
+
+  def register(self, middlewareUrl, author = "benchmark"):
+    """Registers every service with the middleware under test."""
+    capabilities = ",".join(self.capabilities)
+    for i, url in enumerate(self.mmgUrls):
+      requests.put(f"{middlewareUrl}/addMMG", data = {"name": f"Fake MMG {i}", "url": url, "author": author, "tileImageCount": 100, "capabilities": capabilities})
+    for url in self.reducerUrls:
+      requests.put(f"{middlewareUrl}/registerReducer", data = {"url": url, "author": author, "capabilities": capabilities})
+
+  def count(self, key, amount = 1):
+    with self.lock:
+      self.counters[key] += amount
+
+  def snapshot(self):
+    with self.lock:
+      return dict(self.counters)
+
+  def baseImageSize(self, request):
+    if "baseImageDigest" in request.form:
+      digest = request.form["baseImageDigest"]
+      if digest not in self.baseImages:
+        image = requests.get(request.form["baseImageUrl"]).content
+        self.count("bytesIn", len(image))
+        with Image.open(io.BytesIO(image)) as img:
+          self.baseImages[digest] = img.size
+      return self.baseImages[digest]
+
+    fileName = "image" if "image" in request.files else "baseImage"
+    with Image.open(request.files[fileName].stream) as img:
+      return img.size
+
+  def mosaic(self, width, height, transferFormat = None, variant = 0):
+    # Encoding is cached so the fakes spend their time sleeping, not compressing:
+    key = (width, height, transferFormat, variant)
+    if key not in self.mosaics:
+      color = random.Random(variant)
+      img = Image.new("RGB", (width, height), (color.randint(0, 255), color.randint(0, 255), color.randint(0, 255)))
+      if transferFormat is not None:
+        self.mosaics[key] = getTransferFormat(transferFormat).encode(img)
+      else:
+        buffer = io.BytesIO()
+        img.save(buffer, "PNG")
+        self.mosaics[key] = buffer.getvalue()
+    return self.mosaics[key]
+
+  def convert(self, mosaic, transferFormat):
+    """Re-encodes a mosaic received in another format, as a real reducer's output would be."""
+    if transferFormat is None or containerOf(mosaic) == getTransferFormat(transferFormat).container:
+      return mosaic
+
+    with openImage(mosaic) as img:
+      return getTransferFormat(transferFormat).encode(img)
+
+  def respond(self, request, body, width, height):
+    """Applies the fleet's latency and failure behavior to a response with a `width` x `height` mosaic."""
+    self.count("requests")
+    self.count("bytesIn", request.content_length or 0)
+    time.sleep(self.latency.sample() + self.pixelSeconds * width * height / 1000000)
+
+    if random.random() < self.timeoutRate:
+      self.count("timeouts")
+      time.sleep(self.hangSeconds)
+
+    if random.random() < self.errorRate:
+      self.count("errors")
+      return Response("Simulated failure", status = 500)
+
+    body = body()
+    self.count("bytesOut", len(body))
+    return Response(body, mimetype = "application/octet-stream")
+
+  def mmg(self, request, variant):
+    if request.method != "POST":
+      return Response(status = 405)
+
+    tilesAcross = int(request.args["tilesAcross"])
+    renderedTileSize = int(request.args["renderedTileSize"])
+    width, height = self.baseImageSize(request)
+
+    verticalTiles = int(height / (width / tilesAcross))
+    mosaicWidth = tilesAcross * renderedTileSize
+    mosaicHeight = verticalTiles * renderedTileSize
+    if random.random() < self.malformedRate:
+      self.count("malformed")
+      mosaicWidth += 1
+
+    return self.respond(request, lambda: self.mosaic(mosaicWidth, mosaicHeight, request.args.get("transferFormat"), variant), mosaicWidth, mosaicHeight)
+
+  def reducer(self, request):
+    if request.method != "POST":
+      return Response(status = 405)
+
+    mosaic = request.files["mosaic1"].read()
+    transferFormat = request.args.get("transferFormat")
+    width, height = getImageSize(mosaic)
+    if random.random() < self.malformedRate:
+      self.count("malformed")
+      return self.respond(request, lambda: self.mosaic(width + 1, height, transferFormat), width, height)
+
+    return self.respond(request, lambda: self.convert(mosaic, transferFormat), width, height)
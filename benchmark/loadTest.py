@@ -0,0 +1,337 @@
+"""Offline load test of the middleware against a fleet of fake MMGs and reducers.
+
+The fake services run in a child process (so their work does not compete with
+the middleware for the GIL) and the middleware runs in this process, unless
+`--middleware` points at one that is already running.  Run from the
+repository root:
+
+    python benchmark/loadTest.py --jobs 50 --concurrency 8 --mmgs 32 --reducers 4
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import secrets
+import sys
+import threading
+import time
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from FakeServiceFleet import FakeServiceFleet
+
+repositoryRoot = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def runFleet(conn, options):
+  fleet = FakeServiceFleet(
+    mmgs = options["mmgs"],
+    reducers = options["reducers"],
+    latency = options["latency"],
+    errorRate = options["errorRate"],
+    malformedRate = options["malformedRate"],
+    timeoutRate = options["timeoutRate"],
+    hangSeconds = options["hangSeconds"],
+    capabilities = options["capabilities"],
+    pixelSeconds = options["pixelSeconds"],
+    distinctMosaics = options["distinctMosaics"],
+  )
+  fleet.start()
+  conn.send((fleet.mmgUrls, fleet.reducerUrls))
+
+  # Commands from the load test: "register <url>", "snapshot" or "stop".
+  while True:
+    command = conn.recv()
+    if command == "stop":
+      fleet.stop()
+      return
+    elif command == "snapshot":
+      conn.send(fleet.snapshot())
+    else:
+      fleet.register(command.split(" ", 1)[1])
+      conn.send(True)
+
+
+def startMiddleware():
+  """Imports and serves `app.py` on a free localhost port, returning its URL and module."""
+  from werkzeug.serving import make_server
+
+  os.chdir(repositoryRoot)
+  sys.path.insert(0, repositoryRoot)
+
+  # Without ADMIN_PASSCODE at import time the registry stays in memory (no
+  # MongoDB); it is set afterwards so the clients can call admin-only routes:
+  passcode = os.environ.pop("ADMIN_PASSCODE", None)
+  import app
+  os.environ["ADMIN_PASSCODE"] = passcode or secrets.token_hex(8)
+
+  server = make_server("127.0.0.1", 0, app.app, threaded = True)
+  server.daemon_threads = True
+  server.request_queue_size = 256
+  threading.Thread(target = server.serve_forever, daemon = True).start()
+  return f"http://127.0.0.1:{server.server_port}", app
+
+
+def percentile(values, p):
+  if len(values) == 0:
+    return None
+
+  values = sorted(values)
+  return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+class SaturationSampler:
+  """Samples the in-process middleware's queues and in-flight counts every `interval` seconds."""
+
+  def __init__(self, app, interval = 0.1):
+    self.app = app
+    self.interval = interval
+    self.samples = []
+    self.stopped = threading.Event()
+
+  def start(self):
+    threading.Thread(target = self.run, daemon = True).start()
+
+  def stop(self):
+    self.stopped.set()
+
+  def run(self):
+    while not self.stopped.wait(self.interval):
+      self.samples.append({
+        "threadPoolActive": self.app.threadPool.active,
+        "threadPoolQueued": self.app.threadPool.queued,
+        "dispatcherInFlight": self.app.dispatcher.inFlight,
+        "reductionsWaiting": self.app.reducerDispatcher.waiting,
+        "jobsRunning": self.app.jobManager.running,
+        "jobsQueued": self.app.jobManager.queued,
+      })
+
+  def report(self):
+    report = {}
+    if len(self.samples) == 0:
+      return report
+
+    for key in self.samples[0]:
+      values = [sample[key] for sample in self.samples]
+      report[key] = {"mean": round(sum(values) / len(values), 2), "max": max(values)}
+    report["dispatcherInFlight"]["limit"] = self.app.dispatcher.maxInFlight
+    return report
+
+
+class LoadDriver:
+  """Submits `jobs` jobs from `concurrency` client threads and records each job's latency."""
+
+  def __init__(self, middlewareUrl, options, image):
+    self.middlewareUrl = middlewareUrl
+    self.options = options
+    self.image = image
+
+    self.lock = threading.Lock()
+    self.remaining = options["jobs"]
+    self.latencies = []
+    self.failures = []
+    self.rejected = 0
+    self.bytesUploaded = 0
+
+  def nextJob(self):
+    with self.lock:
+      if self.remaining == 0:
+        return False
+      self.remaining -= 1
+      return True
+
+  def run(self):
+    threads = [threading.Thread(target = self.client, daemon = True) for i in range(self.options["concurrency"])]
+    startTime = time.time()
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    return time.time() - startTime
+
+  def client(self):
+    session = requests.Session()
+    if os.getenv("ADMIN_PASSCODE"):
+      session.cookies.set("admin", os.getenv("ADMIN_PASSCODE"))
+
+    while self.nextJob():
+      startTime = time.time()
+      try:
+        if self.options["endpoint"] == "testMosaic":
+          error = self.testMosaic(session)
+        else:
+          error = self.makeMosaic(session)
+      except Exception as e:
+        error = str(e)
+
+      with self.lock:
+        if error is None:
+          self.latencies.append(time.time() - startTime)
+        else:
+          self.failures.append(error)
+
+  def makeMosaic(self, session):
+    while True:
+      resp = session.post(
+        f"{self.middlewareUrl}/makeMosaic",
+        files = {"image": self.image},
+        data = {
+          "tilesAcross": self.options["tilesAcross"],
+          "renderedTileSize": self.options["renderedTileSize"],
+          "fileFormat": self.options["fileFormat"],
+          "filter": "",
+          "strips": self.options["strips"],
+        },
+      )
+      with self.lock:
+        self.bytesUploaded += len(self.image)
+
+      if resp.status_code != 429:
+        break
+
+      # Admission control pushed back; retry as a browser user would:
+      with self.lock:
+        self.rejected += 1
+      time.sleep(0.5)
+
+    status = resp.json()
+    if "error" in status:
+      return status["error"]
+
+    while status["status"] in ("queued", "running"):
+      time.sleep(0.05)
+      status = session.get(f"{self.middlewareUrl}{status['statusUrl']}").json()
+
+    if status["status"] != "done":
+      return status.get("error", status["status"])
+
+    resp = session.get(f"{self.middlewareUrl}{status['url']}")
+    if resp.status_code != 200:
+      return f"GET {status['url']}: HTTP Status {resp.status_code}"
+    return None
+
+  def testMosaic(self, session):
+    resp = session.get(f"{self.middlewareUrl}/testMosaic", params = {"author": "benchmark"})
+    status = resp.json()
+    if resp.status_code != 200 or "error" in status:
+      return status.get("error", f"HTTP Status {resp.status_code}")
+    return None
+
+
+def main():
+  parser = argparse.ArgumentParser(description = "Load test the mosaic middleware with fake MMGs and reducers.")
+  parser.add_argument("--middleware", help = "URL of a running middleware (default: start app.py in this process)")
+  parser.add_argument("--endpoint", choices = ["makeMosaic", "testMosaic"], default = "makeMosaic")
+  parser.add_argument("--jobs", type = int, default = 20)
+  parser.add_argument("--concurrency", type = int, default = 4)
+  parser.add_argument("--mmgs", type = int, default = 16)
+  parser.add_argument("--reducers", type = int, default = 4)
+  parser.add_argument("--latency", default = "uniform:0.01,0.1", help = "fixed:S, uniform:MIN,MAX or lognormal:MEDIAN,SIGMA (seconds)")
+  parser.add_argument("--error-rate", type = float, default = 0)
+  parser.add_argument("--malformed-rate", type = float, default = 0)
+  parser.add_argument("--timeout-rate", type = float, default = 0)
+  parser.add_argument("--hang-seconds", type = float, default = 30)
+  parser.add_argument("--capabilities", default = "", help = "comma-separated capabilities the fake services register with")
+  parser.add_argument("--pixel-seconds", type = float, default = 0, help = "extra latency of the fake services per megapixel of mosaic")
+  parser.add_argument("--distinct-mosaics", type = int, default = 0, help = "how many different mosaics the fake MMGs return (default: one per MMG)")
+  parser.add_argument("--strips", type = int, default = 1, help = "split each base image into this many strips (sharded mode)")
+  parser.add_argument("--image", default = os.path.join(repositoryRoot, "testFiles", "rainbow.png"))
+  parser.add_argument("--tiles-across", type = int, default = 50)
+  parser.add_argument("--rendered-tile-size", type = int, default = 10)
+  parser.add_argument("--file-format", default = "PNG")
+  parser.add_argument("--json", action = "store_true", help = "print the report as JSON")
+  parser.add_argument("--verbose", action = "store_true", help = "show the middleware's own output")
+  args = parser.parse_args()
+
+  # The middleware logs every request; only the report is printed unless asked for:
+  report = sys.stdout
+  if not args.verbose:
+    sys.stdout = open(os.devnull, "w")
+
+  options = {
+    "endpoint": args.endpoint,
+    "jobs": args.jobs,
+    "concurrency": args.concurrency,
+    "mmgs": args.mmgs,
+    "reducers": args.reducers,
+    "latency": args.latency,
+    "errorRate": args.error_rate,
+    "malformedRate": args.malformed_rate,
+    "timeoutRate": args.timeout_rate,
+    "hangSeconds": args.hang_seconds,
+    "capabilities": [c for c in args.capabilities.split(",") if c != ""],
+    "pixelSeconds": args.pixel_seconds,
+    "strips": args.strips,
+    "distinctMosaics": args.distinct_mosaics,
+    "tilesAcross": args.tiles_across,
+    "renderedTileSize": args.rendered_tile_size,
+    "fileFormat": args.file_format,
+  }
+
+  with open(args.image, "rb") as f:
+    image = f.read()
+
+  conn, childConn = multiprocessing.Pipe()
+  fleetProcess = multiprocessing.Process(target = runFleet, args = (childConn, options), daemon = True)
+  fleetProcess.start()
+  conn.recv()
+
+  sampler = None
+  middlewareUrl = args.middleware
+  if middlewareUrl is None:
+    middlewareUrl, app = startMiddleware()
+    sampler = SaturationSampler(app)
+
+  conn.send(f"register {middlewareUrl}")
+  conn.recv()
+
+  if sampler is not None:
+    sampler.start()
+  driver = LoadDriver(middlewareUrl, options, image)
+  elapsed = driver.run()
+  if sampler is not None:
+    sampler.stop()
+
+  conn.send("snapshot")
+  fleet = conn.recv()
+  conn.send("stop")
+  fleetProcess.join(timeout = 5)
+
+  output = report
+  report = {
+    "options": options,
+    "seconds": round(elapsed, 3),
+    "jobsCompleted": len(driver.latencies),
+    "jobsFailed": len(driver.failures),
+    "jobsRejected": driver.rejected,
+    "jobsPerSecond": round(len(driver.latencies) / elapsed, 3),
+    "latency": {f"p{p}": percentile(driver.latencies, p) for p in (50, 95, 99)},
+    "bytes": {
+      "uploadedByClients": driver.bytesUploaded,
+      "receivedByServices": fleet["bytesIn"],
+      "sentByServices": fleet["bytesOut"],
+    },
+    "services": fleet,
+    "saturation": sampler.report() if sampler is not None else None,
+    "errors": sorted(set(driver.failures)),
+  }
+
+  sys.stdout = output
+  if args.json:
+    print(json.dumps(report, indent = 2))
+    return
+
+  print(f"{report['jobsCompleted']} jobs completed, {report['jobsFailed']} failed, {report['jobsRejected']} rejected (429) in {report['seconds']}s: {report['jobsPerSecond']} jobs/sec")
+  print("Job latency: " + ", ".join(f"{p} {'-' if v is None else f'{v:.3f}s'}" for p, v in report["latency"].items()))
+  print(f"Bytes: {driver.bytesUploaded} uploaded by clients, {fleet['bytesIn']} received and {fleet['bytesOut']} sent by services")
+  print(f"Services: {fleet['requests']} requests, {fleet['errors']} errors, {fleet['malformed']} malformed, {fleet['timeouts']} timeouts")
+  if report["saturation"] is not None:
+    for key, value in report["saturation"].items():
+      print(f"  {key}: " + ", ".join(f"{k} {v}" for k, v in value.items()))
+  for error in report["errors"]:
+    print(f"  error: {error}")
+
+
+if __name__ == "__main__":
+  main()
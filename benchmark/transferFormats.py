@@ -0,0 +1,97 @@
+"""Bytes and CPU time of each transfer format for intermediate mosaics.
+
+Encodes and decodes each image (by default the mosaics in `testFiles`, tiled
+`--scale` times in each direction to approach a full-size mosaic) in every
+transfer format this process supports, next to the user-facing PNG and JPEG
+encodings they replace.  Run from the repository root:
+
+    python benchmark/transferFormats.py --scale 4
+"""
+
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from PIL import Image
+
+repositoryRoot = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repositoryRoot)
+import TransferFormats
+
+
+def loadImage(path, scale):
+  with Image.open(path) as img:
+    img = img.convert("RGB")
+    if scale == 1:
+      return img
+
+    tiled = Image.new("RGB", (img.width * scale, img.height * scale))
+    for y in range(scale):
+      for x in range(scale):
+        tiled.paste(img.transpose(Image.FLIP_LEFT_RIGHT) if (x + y) % 2 else img, (x * img.width, y * img.height))
+    return tiled
+
+
+def encoders():
+  """(name, encode) for every format measured, user-facing formats first."""
+  yield "PNG", lambda img: TransferFormats.encodeImage(img, "PNG")
+  yield "JPEG", lambda img: TransferFormats.encodeImage(img, "JPEG")
+  for name, transferFormat in TransferFormats.transferFormats.items():
+    yield name, transferFormat.encode
+
+
+def measure(images, repeat):
+  results = []
+  rawBytes = sum(img.width * img.height * 3 for img in images)
+  for name, encode in encoders():
+    encodeSeconds = 0
+    decodeSeconds = 0
+    encodedBytes = 0
+    for img in images:
+      for i in range(repeat):
+        start = time.process_time()
+        data = encode(img)
+        encodeSeconds += time.process_time() - start
+
+        start = time.process_time()
+        TransferFormats.openImage(data).load()
+        decodeSeconds += time.process_time() - start
+      encodedBytes += len(data)
+
+    megapixels = repeat * sum(img.width * img.height for img in images) / 1000000
+    results.append({
+      "format": name,
+      "bytes": encodedBytes,
+      "ratio": encodedBytes / rawBytes,
+      "encodeMsPerMegapixel": 1000 * encodeSeconds / megapixels,
+      "decodeMsPerMegapixel": 1000 * decodeSeconds / megapixels,
+    })
+  return results
+
+
+def main():
+  parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+  parser.add_argument("images", nargs = "*", help = "images to encode (default: testFiles/[A-D].png)")
+  parser.add_argument("--scale", type = int, default = 1, help = "tile each image this many times across and down")
+  parser.add_argument("--repeat", type = int, default = 3, help = "encodes and decodes per image")
+  parser.add_argument("--json", action = "store_true", help = "print the results as JSON")
+  args = parser.parse_args()
+
+  paths = args.images or sorted(glob.glob(os.path.join(repositoryRoot, "testFiles", "[A-D].png")))
+  images = [loadImage(path, args.scale) for path in paths]
+  results = measure(images, args.repeat)
+
+  if args.json:
+    print(json.dumps(results, indent = 2))
+    return
+
+  print(f"{len(images)} images, {images[0].width} x {images[0].height} px (CPU time per megapixel)")
+  print(f"{'format':<16}{'bytes':>12}{'of raw':>9}{'encode':>12}{'decode':>12}")
+  for result in results:
+    print(f"{result['format']:<16}{result['bytes']:>12}{result['ratio']:>9.1%}{result['encodeMsPerMegapixel']:>10.1f}ms{result['decodeMsPerMegapixel']:>10.1f}ms")
+
+
+if __name__ == "__main__":
+  main()
@@ -2,7 +2,7 @@ var socket;
 
 socket = io();
 socket.on(`mosaic ${author}`, function (mosaicInfo) {
-  var blob = new Blob( [ mosaicInfo.image ], { type: "image/png" } );
+  var blob = new Blob( [ mosaicInfo.image ], { type: mosaicInfo.mimeType } );
   var imageUrl = (window.URL || window.webkitURL).createObjectURL( blob );
 
   html = "";
@@ -45,7 +45,7 @@ socket.on(`mosaic ${author}`, function (mosaicInfo) {
 });
 
 socket.on("connect", () => {
-  fetch(`/testMosaic?author=${encodeURIComponent(author)}`)
+  fetch(`/testMosaic?author=${encodeURIComponent(author)}&socketId=${encodeURIComponent(socket.id)}`)
   .then((response) => response.json())
   .then((json) => {
     if (json.error) {
@@ -56,6 +56,15 @@ socket.on("connect", () => {
     } else {
       let e = document.getElementById("output");
       e.innerHTML += "Rendering Complete";
+
+      // Reducer results compared with the middleware's built-in reducer:
+      for (let result of json) {
+        if (result.error) {
+          e.innerHTML += `<div>${result.description}: ${result.error}</div>`;
+        } else {
+          e.innerHTML += `<div>${result.description}: ${(result.tilesFromInputs * 100).toFixed(1)}% of tiles taken unchanged from the inputs, ${(result.agreementWithReference * 100).toFixed(1)}% match the reference reducer</div>`;
+        }
+      }
     }
   });
 })
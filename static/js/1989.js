@@ -10,7 +10,7 @@ socket.on('progress update', function (d) {
 });
 
 socket.on('mosaic', function (mosaicInfo) {
-  var blob = new Blob( [ mosaicInfo.image ], { type: "image/png" } );
+  var blob = new Blob( [ mosaicInfo.image ], { type: mosaicInfo.mimeType } );
   var imageUrl = (window.URL || window.webkitURL).createObjectURL( blob );
 
   html = "";
@@ -38,6 +38,17 @@ socket.on('mosaic', function (mosaicInfo) {
   */
 });
 
+socket.on('mosaic final', function (finalInfo) {
+  html = "";
+  html += `<div class="mb-3">`;
+  html += `<a href="${finalInfo.url}" target="_blank"><img src="${finalInfo.url}" class="img-fluid"></a>`;
+  html += `<div style="font-size: 12px"><b>Final Mosaic</b> (<a href="${finalInfo.url}" download>full size</a>)</div>`;
+  html += `</div>`;
+
+  let e = document.getElementById("output");
+  e.innerHTML = html + e.innerHTML;
+});
+
 
 let doSubmit = function () {
   document.getElementById("output").innerHTML = `<div id="mosaics" class="row"></div>`;
@@ -56,6 +67,7 @@ let doSubmit = function () {
   data.append("renderedTileSize", renderedTileSize);
   data.append("fileFormat", fileFormat);
   data.append("filter", filter);
+  data.append("socketId", socket.id);
   if (verifiedOnly) {
     data.append("verified", "true");
   }
@@ -67,10 +79,29 @@ let doSubmit = function () {
   .then((response) => response.json())
   .then((json) => {
     if (json.error) {
-      let e = document.getElementById("output");
-      e.innerHTML =
-        `<div class="alert alert-danger mb-3" role="alert"><h3>Mosaic Generation Error</h3>${json.error}</div>`
-        + e.innerHTML;
+      showError(json.error);
+    } else {
+      pollJob(json.statusUrl);
+    }
+  });
+};
+
+let showError = function(error) {
+  let e = document.getElementById("output");
+  e.innerHTML =
+    `<div class="alert alert-danger mb-3" role="alert"><h3>Mosaic Generation Error</h3>${error}</div>`
+    + e.innerHTML;
+};
+
+// The mosaic itself arrives over the socket; the job status is only polled to report failures:
+let pollJob = function(statusUrl) {
+  fetch(statusUrl)
+  .then((response) => response.json())
+  .then((json) => {
+    if (json.error) {
+      showError(json.error);
+    } else if (json.status == "queued" || json.status == "running") {
+      setTimeout(() => pollJob(statusUrl), 1000);
     }
   });
 };
@@ -0,0 +1,58 @@
+import io
+import os
+import sys
+import pytest
+from PIL import Image
+
+# The middleware's modules live at the top of the repository:
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from MosaicWorker import MosaicWorker
+from PreviewStream import PreviewStream
+from ReducerDispatcher import ReducerDispatcher
+from ServersCollection import ServersCollection
+
+
+@pytest.fixture
+def servers():
+  return ServersCollection(False)
+
+
+@pytest.fixture
+def addReducer(servers):
+  """Registers a reducer with the given capabilities (each call gets its own URL)."""
+  count = [0]
+
+  def addReducer(*capabilities):
+    count[0] += 1
+    return servers.addReducer(url = f"http://reducer{count[0]}.test/", author = "test", capabilities = list(capabilities))
+
+  return addReducer
+
+
+def encodedImage(width, height, fileFormat = "PNG"):
+  buffer = io.BytesIO()
+  Image.new("RGB", (width, height), (200, 100, 50)).save(buffer, fileFormat)
+  return buffer.getvalue()
+
+
+@pytest.fixture
+def createWorker(servers, tmp_path, monkeypatch):
+  """Creates a `MosaicWorker` for a 100 x 100 base image, without sending any request."""
+  monkeypatch.chdir(tmp_path)
+
+  def createWorker(**options):
+    return MosaicWorker(
+      baseImage = encodedImage(100, 100),
+      tilesAcross = 10,
+      renderedTileSize = 4,
+      fileFormat = "PNG",
+      previewStream = PreviewStream(None),
+      servers = servers,
+      threadPool = None,
+      dispatcher = None,
+      reducerDispatcher = ReducerDispatcher(servers),
+      **options,
+    )
+
+  return createWorker
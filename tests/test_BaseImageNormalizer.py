@@ -0,0 +1,48 @@
+import io
+import pytest
+from PIL import Image
+from BaseImageNormalizer import BaseImageNormalizer
+from ImageHeader import getImageSize
+
+
+def noisyImage(width, height, fileFormat = "PNG", mode = "RGB"):
+  """An image that does not compress well, so a smaller copy is always smaller in bytes."""
+  img = Image.effect_noise((width, height), 64).convert(mode)
+  buffer = io.BytesIO()
+  img.save(buffer, fileFormat)
+  return buffer.getvalue()
+
+
+@pytest.fixture
+def normalizer():
+  return BaseImageNormalizer()
+
+
+def test_largeImagesAreShrunkToTheMosaicWidth(normalizer):
+  normalized = normalizer.normalize(noisyImage(1000, 750), tilesAcross = 20, renderedTileSize = 10)
+  assert getImageSize(normalized) == (200, 150)
+  assert normalized[:2] == b"\xff\xd8"
+
+
+def test_tileRowsAreKept(normalizer):
+  # 1000 / 20 = 50 pixels per tile, so 745 pixels are 14 rows (14.9, rounded down):
+  width, height = normalizer.targetSize(1000, 745, 20, 10)
+  assert width == 200
+  assert normalizer.verticalTiles(width, height, 20) == normalizer.verticalTiles(1000, 745, 20) == 14
+
+
+def test_transparencyIsKept(normalizer):
+  normalized = normalizer.normalize(noisyImage(1000, 500, mode = "RGBA"), tilesAcross = 20, renderedTileSize = 10)
+  assert normalized[:8] == b"\x89PNG\r\n\x1a\n"
+  with Image.open(io.BytesIO(normalized)) as img:
+    assert img.mode == "RGBA"
+
+
+def test_smallImagesAreUnchanged(normalizer):
+  baseImage = noisyImage(150, 100)
+  assert normalizer.normalize(baseImage, tilesAcross = 20, renderedTileSize = 10) is baseImage
+
+
+def test_unreadableImage(normalizer):
+  with pytest.raises(Exception):
+    normalizer.normalize(b"not an image", tilesAcross = 20, renderedTileSize = 10)
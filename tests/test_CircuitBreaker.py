@@ -0,0 +1,72 @@
+from CircuitBreaker import CircuitBreaker
+
+
+def test_opensAfterConsecutiveFailures():
+  circuit = CircuitBreaker(failureThreshold = 3)
+  assert not circuit.recordFailure()
+  assert not circuit.recordFailure()
+  assert circuit.isClosed()
+
+  assert circuit.recordFailure()
+  assert not circuit.isClosed()
+  assert circuit.state == CircuitBreaker.OPEN
+
+
+def test_successResetsTheFailureCount():
+  circuit = CircuitBreaker(failureThreshold = 2)
+  circuit.recordFailure()
+  circuit.recordSuccess()
+  assert not circuit.recordFailure()
+  assert circuit.isClosed()
+
+
+def test_openCircuitIsProbedAfterOpenDuration(monkeypatch):
+  now = [1000.0]
+  monkeypatch.setattr("CircuitBreaker.time.time", lambda: now[0])
+  circuit = CircuitBreaker(failureThreshold = 1, openDuration = 60)
+  circuit.recordFailure()
+  assert not circuit.readyForProbe()
+
+  now[0] += 60
+  assert circuit.readyForProbe()
+  assert circuit.state == CircuitBreaker.HALF_OPEN
+
+
+def test_halfOpenCircuitClosesOrReopens(monkeypatch):
+  now = [1000.0]
+  monkeypatch.setattr("CircuitBreaker.time.time", lambda: now[0])
+  circuit = CircuitBreaker(failureThreshold = 3, openDuration = 60)
+  for i in range(3):
+    circuit.recordFailure()
+
+  now[0] += 60
+  circuit.readyForProbe()
+  # A single failed probe re-opens a half-open circuit:
+  assert circuit.recordFailure()
+  assert circuit.state == CircuitBreaker.OPEN
+
+  now[0] += 60
+  circuit.readyForProbe()
+  circuit.recordSuccess()
+  assert circuit.isClosed()
+
+
+def test_openCircuitAllowsOneTrialRequest(monkeypatch):
+  now = [1000.0]
+  monkeypatch.setattr("CircuitBreaker.time.time", lambda: now[0])
+  circuit = CircuitBreaker(failureThreshold = 1, openDuration = 60)
+  assert circuit.allowRequest()
+  circuit.recordFailure()
+  assert not circuit.allowRequest()
+
+  now[0] += 60
+  assert circuit.allowRequest()
+  assert circuit.state == CircuitBreaker.HALF_OPEN
+  assert not circuit.allowRequest()
+
+  # A trial that never reports back is replaced:
+  now[0] += 60
+  assert circuit.allowRequest()
+  circuit.recordSuccess()
+  assert circuit.allowRequest()
+  assert circuit.isClosed()
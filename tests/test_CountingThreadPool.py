@@ -0,0 +1,46 @@
+import threading
+import pytest
+from CountingThreadPool import CountingThreadPool
+
+
+def test_countsQueuedAndActiveTasks():
+  pool = CountingThreadPool(max_workers = 1)
+  started = threading.Event()
+  release = threading.Event()
+
+  def task():
+    started.set()
+    release.wait()
+    return "done"
+
+  first = pool.submit(task)
+  started.wait()
+  second = pool.submit(lambda: "second")
+  assert pool.active == 1
+  assert pool.queued == 1
+
+  release.set()
+  assert first.result() == "done"
+  assert second.result() == "second"
+  pool.shutdown()
+  assert pool.active == 0 and pool.queued == 0
+
+
+def test_failedTasksAreNoLongerActive():
+  pool = CountingThreadPool(max_workers = 1)
+
+  def fail():
+    raise ValueError("failed")
+
+  with pytest.raises(ValueError):
+    pool.submit(fail).result()
+  pool.shutdown()
+  assert pool.active == 0
+
+
+def test_noTasksAfterShutdown():
+  pool = CountingThreadPool(max_workers = 1)
+  pool.shutdown()
+  with pytest.raises(RuntimeError):
+    pool.submit(lambda: None)
+  assert pool.queued == 0
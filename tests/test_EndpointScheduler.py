@@ -0,0 +1,60 @@
+from EndpointScheduler import EndpointScheduler
+
+
+def addMMG(servers, name = "mmg"):
+  return servers.addMMG(name = name, url = f"http://{name}.test/", author = "test", tiles = 10)
+
+
+def test_requestsOverTheLimitWait(servers):
+  scheduler = EndpointScheduler(servers, maxPerEndpoint = 2)
+  mmg = addMMG(servers)
+
+  started = []
+  for i in range(3):
+    scheduler.acquire(mmg, "job", lambda i = i: started.append(i))
+  assert started == [0, 1]
+  assert scheduler.waiting == 1
+
+  scheduler.release(mmg)
+  assert started == [0, 1, 2]
+  scheduler.release(mmg)
+  scheduler.release(mmg)
+  assert scheduler.inFlight == {}
+
+
+def test_endpointsHaveSeparateLimits(servers):
+  scheduler = EndpointScheduler(servers, maxPerEndpoint = 1)
+  mmg1 = addMMG(servers, "mmg1")
+  mmg2 = addMMG(servers, "mmg2")
+
+  started = []
+  scheduler.acquire(mmg1, "job", lambda: started.append(1))
+  scheduler.acquire(mmg2, "job", lambda: started.append(2))
+  assert started == [1, 2]
+
+
+def test_jobsTakeTurns(servers):
+  scheduler = EndpointScheduler(servers, maxPerEndpoint = 1)
+  mmg = addMMG(servers)
+
+  started = []
+  scheduler.acquire(mmg, "a", lambda: started.append("first"))
+  for i in range(3):
+    scheduler.acquire(mmg, "a", lambda: started.append("a"))
+  scheduler.acquire(mmg, "b", lambda: started.append("b"))
+
+  for i in range(3):
+    scheduler.release(mmg)
+  assert started == ["first", "a", "b", "a"]
+
+
+def test_failingEndpointsGetOneRequestAtATime(servers):
+  scheduler = EndpointScheduler(servers, maxPerEndpoint = 4, maxErrorRate = 0.2)
+  mmg = addMMG(servers)
+  for i in range(2):
+    servers.getStats(mmg).recordFailure()
+
+  started = []
+  for i in range(2):
+    scheduler.acquire(mmg, "job", lambda: started.append(1))
+  assert len(started) == 1
@@ -0,0 +1,41 @@
+import io
+import pytest
+from PIL import Image, features
+from ImageHeader import getImageSize
+
+
+def encodedImage(fileFormat, size = (37, 23), mode = "RGB", **options):
+  buffer = io.BytesIO()
+  Image.new(mode, size, "red").save(buffer, fileFormat, **options)
+  return buffer.getvalue()
+
+
+@pytest.mark.parametrize("fileFormat, options", [
+  ("PNG", {}),
+  ("JPEG", {}),
+  ("JPEG", {"progressive": True}),
+  ("GIF", {}),
+  ("BMP", {}),
+])
+def test_sizeFromHeader(fileFormat, options):
+  assert getImageSize(encodedImage(fileFormat, **options)) == (37, 23)
+
+
+@pytest.mark.skipif(not features.check("webp"), reason = "Pillow was built without WebP")
+@pytest.mark.parametrize("mode, options", [
+  ("RGB", {}),
+  ("RGB", {"lossless": True}),
+  ("RGBA", {}),
+])
+def test_webpSize(mode, options):
+  assert getImageSize(encodedImage("WEBP", mode = mode, **options)) == (37, 23)
+
+
+def test_pngSizeIgnoresTheRestOfTheFile():
+  header = encodedImage("PNG", size = (4000, 3000))[:24]
+  assert getImageSize(header) == (4000, 3000)
+
+
+def test_invalidJpeg():
+  with pytest.raises(Exception):
+    getImageSize(b"\xff\xd8\x00\x00")
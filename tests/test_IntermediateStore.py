@@ -0,0 +1,53 @@
+import os
+import pytest
+from IntermediateStore import IntermediateStore
+
+
+@pytest.fixture
+def store(tmp_path):
+  store = IntermediateStore(memoryBudget = 10, directory = str(tmp_path))
+  yield store
+  store.close()
+
+
+def test_mosaicsWithinTheBudgetStayInMemory(store):
+  key = store.put(b"12345")
+  assert store.get(key) == b"12345"
+  assert store.memoryBytes == 5
+  assert store.spillDirectory is None
+
+
+def test_mosaicsOverTheBudgetAreSpilled(store):
+  key1 = store.put(b"12345678")
+  key2 = store.put(b"abcdef")
+  assert store.memoryBytes == 8
+  assert os.listdir(store.spillDirectory) == [str(key2)]
+  assert store.get(key2) == b"abcdef"
+
+  file, size = store.open(key2)
+  with file:
+    assert (file.read(), size) == (b"abcdef", 6)
+
+  # Memory freed by a discarded mosaic can be used again:
+  store.discard(key1)
+  store.discard(key2)
+  assert store.memoryBytes == 0
+  assert os.listdir(store.spillDirectory) == []
+  assert store.get(store.put(b"12345678")) == b"12345678"
+  assert store.memoryBytes == 8
+
+
+def test_openInMemoryMosaic(store):
+  file, size = store.open(store.put(b"123"))
+  assert (file.read(), size) == (b"123", 3)
+
+
+def test_closeRemovesSpilledMosaics(store):
+  store.put(b"x" * 20)
+  spillDirectory = store.spillDirectory
+  store.close()
+  assert not os.path.exists(spillDirectory)
+
+  # A mosaic that arrives after the job has ended is not spilled:
+  key = store.put(b"y" * 20)
+  assert store.get(key) == b"y" * 20
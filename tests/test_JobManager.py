@@ -0,0 +1,109 @@
+import threading
+import time
+import pytest
+from JobManager import JobManager
+from Metrics import Metrics
+
+
+def waitFor(jobManager, jobId, status):
+  for i in range(200):
+    if jobManager.get(jobId)["status"] == status:
+      return jobManager.get(jobId)
+    time.sleep(0.01)
+  raise AssertionError(f"Job {jobId} is {jobManager.get(jobId)['status']}, not {status}")
+
+
+class Release:
+  """Jobs that run until `set` is called (also at the end of the test, if an assertion fails)."""
+
+  def __init__(self):
+    self.event = threading.Event()
+
+  def job(self):
+    self.event.wait()
+    return {}
+
+  def set(self):
+    self.event.set()
+
+
+@pytest.fixture
+def release():
+  release = Release()
+  yield release
+  release.set()
+
+
+def test_jobResultIsPartOfItsStatus():
+  jobManager = JobManager()
+  status = jobManager.submit("a", lambda: {"url": "/mosaic/a"})
+  assert status["statusUrl"] == "/job/a"
+
+  status = waitFor(jobManager, "a", "done")
+  assert status["url"] == "/mosaic/a"
+  assert "seconds" in status
+
+
+def test_failedJob():
+  jobManager = JobManager()
+
+  def fail():
+    raise Exception("No MMGs")
+
+  jobManager.submit("a", fail)
+  assert waitFor(jobManager, "a", "failed")["error"] == "No MMGs"
+
+
+def test_jobsBeyondTheQueueAreRejected(release):
+  metrics = Metrics()
+  jobManager = JobManager(maxRunningJobs = 1, maxQueuedJobs = 1, metrics = metrics)
+  jobManager.submit("a", release.job)
+  waitFor(jobManager, "a", "running")
+
+  assert jobManager.submit("b", release.job)["queuePosition"] == 0
+  assert jobManager.submit("c", release.job) is None
+  assert jobManager.get("c") is None
+  assert "mosaic_jobs_rejected_total 1" in metrics.render()
+
+  release.set()
+  waitFor(jobManager, "b", "done")
+  assert jobManager.running == 0 and jobManager.queued == 0
+
+
+def test_onlyFinishedJobsAreForgotten(release):
+  jobManager = JobManager(maxRunningJobs = 1, maxQueuedJobs = 5, maxJobHistory = 2)
+  jobManager.submit("a", lambda: {})
+  waitFor(jobManager, "a", "done")
+  jobManager.submit("b", release.job)
+  jobManager.submit("c", release.job)
+
+  assert jobManager.get("a") is None
+  assert jobManager.get("b") is not None
+  assert jobManager.get("c") is not None
+
+
+def test_jobsOnSeveralThreadsCountAsSeveralJobs(release):
+  jobManager = JobManager(maxRunningJobs = 4, maxQueuedJobs = 2)
+  jobManager.submit("a", release.job, threads = 3)
+  waitFor(jobManager, "a", "running")
+  assert jobManager.running == 3
+
+  # Admitted, but must wait for "a" to free its threads:
+  assert jobManager.submit("b", release.job, threads = 2) is not None
+  assert jobManager.submit("c", release.job, threads = 2) is None
+  # ...and so does every job after it:
+  jobManager.submit("d", lambda: {})
+  time.sleep(0.05)
+  assert jobManager.get("b")["status"] == "queued"
+  assert jobManager.get("d")["status"] == "queued"
+
+  release.set()
+  waitFor(jobManager, "d", "done")
+  waitFor(jobManager, "b", "done")
+  assert jobManager.running == 0 and jobManager.queued == 0
+
+
+def test_jobThreadsAreCappedAtTheRunningJobs():
+  jobManager = JobManager(maxRunningJobs = 2, maxQueuedJobs = 0)
+  jobManager.submit("a", lambda: {}, threads = 16)
+  waitFor(jobManager, "a", "done")
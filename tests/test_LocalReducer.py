@@ -0,0 +1,61 @@
+import io
+import numpy as np
+import pytest
+from PIL import Image
+from LocalReducer import LocalReducer
+from TransferFormats import containerOf, openImage
+
+# A 2 x 2 tile grid of 4-pixel tiles; the base image is black on the left and white on the right:
+tileSize = 4
+
+
+def encode(pixels, fileFormat = "PNG"):
+  buffer = io.BytesIO()
+  Image.fromarray(np.asarray(pixels, dtype = np.uint8), "RGB").save(buffer, fileFormat)
+  return buffer.getvalue()
+
+
+def solid(value):
+  return np.full((2 * tileSize, 2 * tileSize, 3), value)
+
+
+def decode(image):
+  with openImage(image) as img:
+    return np.asarray(img.convert("RGB"))
+
+
+@pytest.fixture
+def reducer():
+  base = np.zeros((20, 20, 3))
+  base[:, 10:] = 255
+  return LocalReducer(encode(base), tilesAcross = 2, renderedTileSize = tileSize, fileFormat = "PNG")
+
+
+def test_keepsTheCloserTile(reducer):
+  reduced = decode(reducer.reduce(encode(solid(0)), encode(solid(255))))
+  assert (reduced[:, :tileSize] == 0).all()
+  assert (reduced[:, tileSize:] == 255).all()
+
+
+def test_resultFormat(reducer):
+  mosaic1 = encode(solid(0))
+  mosaic2 = encode(solid(255))
+  assert containerOf(reducer.reduce(mosaic1, mosaic2)) == "png"
+  assert containerOf(reducer.reduce(mosaic1, mosaic2, "rgb-zlib")) == "rgb-zlib"
+
+
+def test_mosaicsOfDifferentSizes(reducer):
+  with pytest.raises(Exception):
+    reducer.reduce(encode(solid(0)), encode(np.zeros((tileSize, 2 * tileSize, 3))))
+
+
+def test_compare(reducer):
+  mosaic1 = encode(solid(0))
+  mosaic2 = encode(solid(255))
+  assert reducer.compare(mosaic1, mosaic2, reducer.reduce(mosaic1, mosaic2)) == (1.0, 1.0)
+
+  # Every tile is from an input, but only half are the tile the reference would keep:
+  assert reducer.compare(mosaic1, mosaic2, mosaic1) == (1.0, 0.5)
+
+  # No tile is from either input:
+  assert reducer.compare(mosaic1, mosaic2, encode(solid(128))) == (0.0, 0.0)
@@ -0,0 +1,222 @@
+import time
+import pytest
+from concurrent.futures import Future
+import MosaicWorker as MosaicWorkerModule
+from conftest import encodedImage
+
+
+def pendingMosaic(id, mosaics = 1):
+  return {"id": id, "mosaics": mosaics, "tiles": 100 * mosaics}
+
+
+@pytest.mark.parametrize("capabilities, batchSize", [
+  ([], 2),
+  (["reduceBatch:4"], 4),
+  (["reduceBatch:1"], 2),
+  (["reduceBatch:many"], 2),
+])
+def test_reducerBatchSize(createWorker, addReducer, capabilities, batchSize):
+  worker = createWorker()
+  assert worker.reducerBatchSize(addReducer(*capabilities)) == batchSize
+
+
+def test_batchMosaicsAreTakenAndReturned(createWorker):
+  worker = createWorker()
+  worker.reductionJobs = [pendingMosaic(1, 4), pendingMosaic(2), pendingMosaic(3)]
+  worker.expectedMosaics = 9
+
+  extras = worker.takeBatchMosaics(2)
+  assert sorted(mosaic["id"] for mosaic in extras) == [2, 3]
+  assert [mosaic["id"] for mosaic in worker.reductionJobs] == [1]
+  assert sorted(worker.mosaicsBeingReduced) == [2, 3]
+  # A batch of 4 (a pair and 2 extras) produces one mosaic instead of 3:
+  assert worker.expectedMosaics == 7
+
+  worker.returnBatchMosaics(extras)
+  assert sorted(mosaic["id"] for mosaic in worker.reductionJobs) == [1, 2, 3]
+  assert worker.mosaicsBeingReduced == {}
+  assert worker.expectedMosaics == 9
+
+
+def test_noBatchMosaicsOnceStopped(createWorker):
+  worker = createWorker()
+  worker.reductionJobs = [pendingMosaic(1), pendingMosaic(2)]
+  worker.isStopped = True
+  assert worker.takeBatchMosaics(2) == []
+  assert len(worker.reductionJobs) == 2
+
+
+def test_describeMosaics(createWorker):
+  worker = createWorker()
+  assert worker.describeMosaics([pendingMosaic(1), pendingMosaic(2)]) == "#1 and #2"
+  assert worker.describeMosaics([pendingMosaic(1), pendingMosaic(2), pendingMosaic(3)]) == "#1, #2 and #3"
+
+
+def test_noTransferFormatWithoutReducers(createWorker):
+  worker = createWorker(transferFormats = ["png-fast"])
+  assert worker.preferredTransferFormat() is None
+
+
+def test_transferFormatEveryReducerAccepts(createWorker, addReducer):
+  worker = createWorker(transferFormats = ["rgb-zlib", "png-fast"])
+  worker.addReducer(addReducer("transferFormat:png-fast", "transferFormat:rgb-zlib"))
+  assert worker.preferredTransferFormat() == "rgb-zlib"
+
+  worker.addReducer(addReducer("transferFormat:png-fast"))
+  assert worker.preferredTransferFormat() == "png-fast"
+
+  worker.addReducer(addReducer())
+  assert worker.preferredTransferFormat() is None
+
+
+def test_unsupportedTransferFormatsAreSkipped(createWorker, addReducer, monkeypatch):
+  monkeypatch.setattr(MosaicWorkerModule, "supportedTransferFormats", lambda: ["png-fast"])
+  worker = createWorker(transferFormats = ["rgb-zlib", "png-fast"])
+  reducer = addReducer("transferFormat:rgb-zlib", "transferFormat:png-fast")
+  worker.addReducer(reducer)
+
+  assert worker.acceptedTransferFormats(reducer) == ["png-fast"]
+  assert worker.preferredTransferFormat() == "png-fast"
+
+
+def test_outputTransferFormatOnlyForServicesThatAcceptIt(createWorker, servers, addReducer):
+  worker = createWorker(transferFormats = ["png-fast"])
+  worker.addReducer(addReducer("transferFormat:png-fast"))
+
+  mmg = servers.addMMG(name = "mmg", url = "http://mmg.test/", author = "test", tiles = 10, capabilities = ["transferFormat:png-fast"])
+  plainMMG = servers.addMMG(name = "plain", url = "http://plain.test/", author = "test", tiles = 10)
+  assert worker.outputTransferFormat(mmg) == "png-fast"
+  assert worker.outputTransferFormat(plainMMG) is None
+
+
+def test_hedgePercentileMustBeAPercentile(createWorker):
+  with pytest.raises(Exception):
+    createWorker(hedgePercentile = 150)
+  assert createWorker(hedgePercentile = 95).hedgePercentile == 95
+
+
+def test_stragglerMMGsAreCut(createWorker, servers):
+  worker = createWorker()
+  for i in range(3):
+    worker.addMMG(servers.addMMG(name = f"mmg{i}", url = f"http://mmg{i}.test/", author = "test", tiles = 10))
+  worker.mmgPending = {"a", "b"}
+  worker.mmgOutstanding = 2
+
+  worker.cutStragglerMMGs()
+  assert worker.mmgsFinished.is_set()
+  assert worker.stragglerStats() == {"hedgesSent": 0, "hedgesWon": 0, "mmgStragglersCut": 2}
+  # Each cut MMG would have added two mosaics (its own and a reduction):
+  assert worker.expectedMosaics == 1
+  assert not worker.isStopped
+
+
+def test_stragglerMMGsAreCutAtTheDeadline(createWorker, servers, monkeypatch):
+  worker = createWorker(deadline = 60)
+  worker.addMMG(servers.addMMG(name = "mmg", url = "http://mmg.test/", author = "test", tiles = 10))
+  worker.mmgPending = {"a"}
+  worker.mmgOutstanding = 1
+  monkeypatch.setattr(worker, "scheduleReductions", lambda: pytest.fail("No reductions after the deadline"))
+
+  worker.cutStragglerMMGs(isPastDeadline = True)
+  assert worker.isStopped
+  assert worker.mmgsFinished.is_set()
+
+
+class FakeResponse:
+  def __init__(self, content, status_code = 200):
+    self.content = content
+    self.status_code = status_code
+
+
+def reducerCall(worker, reducer, response):
+  worker.reducerDispatcher.reserve(reducer)
+  future = Future()
+  future.set_result(response)
+  return {"reducer": reducer, "future": future, "startTime": time.time()}
+
+
+def test_invalidReducerMosaicsOpenTheCircuit(createWorker, servers, addReducer):
+  reducer = addReducer()
+  for i in range(3):
+    worker = createWorker()
+    worker.addReducer(reducer)
+    assert worker.finishReducerCall(reducerCall(worker, reducer, FakeResponse(encodedImage(7, 7)))) is None
+    assert worker.reducersAvailable == []
+
+  # The reducer is not disabled for good: it recovers once its circuit closes again.
+  assert not reducer.get("disabled")
+  assert not servers.isHealthy(reducer)
+  servers.getCircuit(reducer).recordSuccess()
+  assert servers.isHealthy(reducer)
+
+
+def test_validReducerMosaic(createWorker, servers, addReducer):
+  worker = createWorker()
+  reducer = addReducer()
+  worker.addReducer(reducer)
+
+  mosaic = encodedImage(40, 40)
+  assert worker.finishReducerCall(reducerCall(worker, reducer, FakeResponse(mosaic))) == mosaic
+  assert worker.reducerDispatcher.inFlight[reducer["id"]] == 0
+  assert servers.getStats(reducer).successes == 1
+
+
+def test_failedReducerIsRemovedBeforeItIsReleased(createWorker, servers, addReducer, monkeypatch):
+  worker = createWorker()
+  reducer = addReducer()
+  worker.addReducer(reducer)
+  call = reducerCall(worker, reducer, FakeResponse(b"", status_code = 500))
+
+  stateOnRelease = []
+  release = worker.reducerDispatcher.release
+  def recordingRelease(reducer):
+    stateOnRelease.append((list(worker.reducersAvailable), servers.getStats(reducer).failures))
+    release(reducer)
+  monkeypatch.setattr(worker.reducerDispatcher, "release", recordingRelease)
+
+  assert worker.finishReducerCall(call) is None
+  assert stateOnRelease == [([], 1)]
+  assert worker.reducerDispatcher.inFlight[reducer["id"]] == 0
+
+
+def test_hedgeIsSentWithoutTheSchedulerLock(createWorker, addReducer, monkeypatch):
+  worker = createWorker()
+  first, second = addReducer(), addReducer()
+  worker.addReducer(first)
+  worker.addReducer(second)
+
+  locked = []
+  def startReducerCall(reducer, mosaics):
+    locked.append(worker.schedulerLock.locked())
+    return {"reducer": reducer, "future": Future(), "startTime": time.time()}
+  monkeypatch.setattr(worker, "startReducerCall", startReducerCall)
+
+  firstCall = reducerCall(worker, first, FakeResponse(b""))
+  firstCall["future"] = Future()
+  attempt = {"mosaics": [pendingMosaic(1), pendingMosaic(2)], "calls": [firstCall], "done": False, "hedgeTimer": None}
+  worker.hedgeReduction(attempt, 0.5)
+
+  assert locked == [False]
+  assert [call["reducer"] for call in attempt["calls"]] == [first, second]
+  assert attempt["calls"][1]["isHedge"]
+  assert worker.stragglerStats()["hedgesSent"] == 1
+
+
+def test_openedMosaicsAreClosedWhenAReducerCallCannotBeSent(createWorker, addReducer, monkeypatch):
+  worker = createWorker()
+  reducer = addReducer()
+  worker.addReducer(reducer)
+  mosaic1 = dict(pendingMosaic(1), mosaicKey = worker.intermediateStore.put(encodedImage(40, 40)))
+  mosaic2 = dict(pendingMosaic(2), mosaicKey = "missing")
+
+  opened = []
+  openMosaic = worker.intermediateStore.open
+  def recordingOpen(key):
+    file, size = openMosaic(key)
+    opened.append(file)
+    return file, size
+  monkeypatch.setattr(worker.intermediateStore, "open", recordingOpen)
+
+  with pytest.raises(KeyError):
+    worker.startReducerCall(reducer, [mosaic1, mosaic2])
+  assert len(opened) == 1 and opened[0].closed
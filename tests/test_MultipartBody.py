@@ -0,0 +1,53 @@
+import io
+from email.parser import BytesParser
+from email.policy import HTTP
+from MultipartBody import MultipartBody
+
+
+def parse(body):
+  """The body's parts as {name: bytes}, read with the standard library's MIME parser."""
+  message = BytesParser(policy = HTTP).parsebytes(f"Content-Type: {body.contentType}\r\n\r\n".encode("utf-8") + body.read())
+  return {part.get_param("name", header = "content-disposition"): part.get_payload(decode = True) for part in message.iter_parts()}
+
+
+def test_fieldsAndFiles():
+  spilled = io.BytesIO(b"\x89PNG spilled mosaic")
+  body = MultipartBody(
+    files = {"mosaic1": b"\xff\xd8 in memory", "mosaic2": (spilled, len(spilled.getvalue()))},
+    data = {"baseImageDigest": "abc", "tilesAcross": 20},
+  )
+
+  parts = parse(body)
+  assert parts == {
+    "baseImageDigest": b"abc",
+    "tilesAcross": b"20",
+    "mosaic1": b"\xff\xd8 in memory",
+    "mosaic2": b"\x89PNG spilled mosaic",
+  }
+
+
+def test_lengthIsKnownUpFront():
+  body = MultipartBody(files = {"mosaic1": b"x" * 1000}, data = {"a": "b"})
+  assert len(body) == len(b"".join(body))
+
+
+def test_readsInChunks():
+  data = bytes(range(256)) * 1000
+  body = MultipartBody(files = {"mosaic1": (io.BytesIO(data), len(data))})
+
+  chunks = []
+  while True:
+    chunk = body.read(1000)
+    if len(chunk) == 0:
+      break
+    assert len(chunk) <= 1000
+    chunks.append(chunk)
+  assert data in b"".join(chunks)
+  assert len(b"".join(chunks)) == len(body)
+
+
+def test_closeClosesFileParts():
+  file = io.BytesIO(b"mosaic")
+  body = MultipartBody(files = {"mosaic1": (file, 6)})
+  body.close()
+  assert file.closed
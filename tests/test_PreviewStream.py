@@ -0,0 +1,21 @@
+from PreviewStream import PreviewStream
+
+
+def test_finalImagesAreKeptUpToTheByteBudget():
+  previewStream = PreviewStream(None, finalImageBytes = 250)
+  previewStream.publishFinal(None, "mosaic final", "a", b"a" * 100, "PNG")
+  previewStream.publishFinal(None, "mosaic final", "b", b"b" * 100, "PNG")
+  assert previewStream.getFinal("a") == (b"a" * 100, "PNG")
+
+  previewStream.publishFinal(None, "mosaic final", "c", b"c" * 100, "PNG")
+  assert previewStream.getFinal("a") is None
+  assert previewStream.getFinal("b") is not None
+  assert previewStream.finalBytes == 200
+
+
+def test_newestFinalImageIsKeptOverTheBudget():
+  previewStream = PreviewStream(None, finalImageBytes = 250)
+  previewStream.publishFinal(None, "mosaic final", "a", b"a" * 100, "PNG")
+  previewStream.publishFinal(None, "mosaic final", "b", b"b" * 300, "PNG")
+  assert previewStream.getFinal("a") is None
+  assert previewStream.getFinal("b") == (b"b" * 300, "PNG")
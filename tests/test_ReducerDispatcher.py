@@ -0,0 +1,157 @@
+from ReducerDispatcher import ReducerDispatcher
+
+
+def measure(servers, reducer, latency, count = 3):
+  for i in range(count):
+    servers.getStats(reducer).recordSuccess(latency)
+
+
+def test_unmeasuredReducersAreTriedFirst(servers, addReducer):
+  dispatcher = ReducerDispatcher(servers)
+  measured = addReducer()
+  unmeasured = addReducer()
+  measure(servers, measured, 0.1)
+
+  assert dispatcher.selectReducer([measured, unmeasured]) is unmeasured
+
+
+def test_fasterReducersArePreferred(servers, addReducer):
+  dispatcher = ReducerDispatcher(servers)
+  slow = addReducer()
+  fast = addReducer()
+  measure(servers, slow, 1.0)
+  measure(servers, fast, 0.2)
+
+  assert dispatcher.selectReducer([slow, fast]) is fast
+
+  # ...until enough requests are in flight to it:
+  for i in range(5):
+    dispatcher.reserve(fast)
+  assert dispatcher.selectReducer([slow, fast]) is slow
+
+
+def test_errorsLowerAReducersRank(servers, addReducer):
+  dispatcher = ReducerDispatcher(servers)
+  failing = addReducer()
+  working = addReducer()
+  measure(servers, failing, 0.2)
+  measure(servers, working, 0.5)
+  servers.getStats(failing).recordFailure()
+
+  assert dispatcher.selectReducer([failing, working]) is working
+
+
+def test_capacity(servers, addReducer):
+  dispatcher = ReducerDispatcher(servers, maxConcurrency = 4, fastLatency = 2.0, minSamples = 3)
+  reducer = addReducer()
+  assert dispatcher.capacity(reducer) == 1
+
+  measure(servers, reducer, 0.5)
+  assert dispatcher.capacity(reducer) == 4
+
+  slow = addReducer()
+  measure(servers, slow, 5.0)
+  assert dispatcher.capacity(slow) == 1
+
+
+def test_reducersAtCapacityAreSkipped(servers, addReducer):
+  dispatcher = ReducerDispatcher(servers)
+  reducer = addReducer()
+
+  assert dispatcher.selectReducer([reducer]) is reducer
+  dispatcher.reserve(reducer)
+  assert dispatcher.selectReducer([reducer]) is None
+
+
+def test_tryAcquireExcludesAReducer(servers, addReducer):
+  dispatcher = ReducerDispatcher(servers)
+  reducer1 = addReducer()
+  reducer2 = addReducer()
+
+  assert dispatcher.tryAcquire([reducer1, reducer2], exclude = reducer1) is reducer2
+  assert dispatcher.tryAcquire([reducer1, reducer2], exclude = reducer1) is None
+
+
+def test_hedgeDelayPoolsUnmeasuredReducers(servers, addReducer):
+  dispatcher = ReducerDispatcher(servers, minSamples = 3)
+  reducer1 = addReducer()
+  reducer2 = addReducer()
+  assert dispatcher.hedgeDelay(reducer1, [reducer1, reducer2], 50) is None
+
+  for latency in [1, 2, 3, 4]:
+    servers.getStats(reducer2).recordSuccess(latency)
+  assert dispatcher.hedgeDelay(reducer1, [reducer1, reducer2], 50) == 3
+
+  for latency in [10, 20, 30]:
+    servers.getStats(reducer1).recordSuccess(latency)
+  assert dispatcher.hedgeDelay(reducer1, [reducer1, reducer2], 50) == 20
+
+
+def test_requestIsAssignedAReducerWithCapacity(servers, addReducer):
+  dispatcher = ReducerDispatcher(servers)
+  reducer = addReducer()
+
+  assigned = []
+  dispatcher.requestReducer([reducer], assigned.append)
+  assert assigned == [reducer]
+  assert dispatcher.inFlight[reducer["id"]] == 1
+
+
+def test_requestWaitsUntilReleased(servers, addReducer):
+  dispatcher = ReducerDispatcher(servers)
+  reducer = addReducer()
+
+  # An unmeasured reducer takes one request at a time:
+  assigned = []
+  dispatcher.requestReducer([reducer], assigned.append)
+  dispatcher.requestReducer([reducer], assigned.append)
+  assert assigned == [reducer]
+  assert dispatcher.waiting == 1
+
+  dispatcher.release(reducer)
+  assert assigned == [reducer, reducer]
+  assert dispatcher.waiting == 0
+  assert dispatcher.inFlight[reducer["id"]] == 1
+
+  dispatcher.release(reducer)
+  assert dispatcher.inFlight[reducer["id"]] == 0
+
+
+def test_waitingJobsTakeTurns(servers, addReducer):
+  dispatcher = ReducerDispatcher(servers)
+  reducer = addReducer()
+
+  assigned = []
+  dispatcher.requestReducer([reducer], lambda reducer: assigned.append("first"), jobId = "a")
+  for i in range(3):
+    dispatcher.requestReducer([reducer], lambda reducer: assigned.append("a"), jobId = "a")
+  dispatcher.requestReducer([reducer], lambda reducer: assigned.append("b"), jobId = "b")
+
+  for i in range(3):
+    dispatcher.release(reducer)
+  assert assigned == ["first", "a", "b", "a"]
+
+
+def test_noHealthyReducer(servers, addReducer):
+  dispatcher = ReducerDispatcher(servers)
+  reducer = addReducer()
+  servers.setValue(reducer, "disabled", True)
+
+  assigned = []
+  dispatcher.requestReducer([reducer], assigned.append)
+  assert assigned == [None]
+  assert dispatcher.waiting == 0
+
+
+def test_callbackErrorsDoNotLeakOtherAssignments(servers, addReducer):
+  dispatcher = ReducerDispatcher(servers)
+  reducer1 = addReducer()
+  reducer2 = addReducer()
+
+  def fail(reducer):
+    raise Exception("callback failed")
+
+  assigned = []
+  dispatcher.requestReducer([reducer1], fail, jobId = "a")
+  dispatcher.requestReducer([reducer2], assigned.append, jobId = "b")
+  assert assigned == [reducer2]
@@ -0,0 +1,76 @@
+import pytest
+from ReductionScheduler import BalancedReductionScheduler, LifoReductionScheduler, createReductionScheduler
+
+
+def job(id, mosaics, tiles = None):
+  return {"id": id, "mosaics": mosaics, "tiles": tiles if tiles is not None else 100 * mosaics}
+
+
+def ids(jobs):
+  return [job["id"] for job in jobs]
+
+
+def test_lifoPairsTheNewestMosaics():
+  pending = [job(1, 1), job(2, 8), job(3, 1)]
+  pair = LifoReductionScheduler().selectPair(pending, draining = False)
+  assert ids(pair) == [3, 2]
+  assert ids(pending) == [1]
+
+
+def test_lifoWaitsForTwoMosaics():
+  pending = [job(1, 1)]
+  assert LifoReductionScheduler().selectPair(pending, draining = True) is None
+  assert ids(pending) == [1]
+
+
+def test_balancedPairsMosaicsOfSimilarSize():
+  pending = [job(1, 8), job(2, 1), job(3, 4), job(4, 1)]
+  pair = BalancedReductionScheduler().selectPair(pending, draining = False)
+  assert sorted(ids(pair)) == [2, 4]
+  assert sorted(ids(pending)) == [1, 3]
+
+
+def test_balancedWaitsForAPartnerOfSimilarSize():
+  pending = [job(1, 8), job(2, 1)]
+  assert BalancedReductionScheduler().selectPair(pending, draining = False) is None
+  assert len(pending) == 2
+
+
+def test_balancedPairsAnythingWhenDraining():
+  pending = [job(1, 8), job(2, 1), job(3, 32)]
+  pair = BalancedReductionScheduler().selectPair(pending, draining = True)
+  assert ids(pair) == [2, 1]
+  assert ids(pending) == [3]
+
+
+def test_balancedTreeDepthIsLogarithmic():
+  scheduler = BalancedReductionScheduler()
+  pending = [dict(job(i, 1), depth = 0) for i in range(16)]
+  nextId = 16
+  while len(pending) > 1:
+    job1, job2 = scheduler.selectPair(pending, draining = True)
+    pending.append(dict(job(nextId, job1["mosaics"] + job2["mosaics"]), depth = max(job1["depth"], job2["depth"]) + 1))
+    nextId += 1
+
+  assert pending[0]["mosaics"] == 16
+  assert pending[0]["depth"] == 4
+
+
+@pytest.mark.parametrize("scheduler, expected", [
+  (LifoReductionScheduler(), [4, 5]),
+  (BalancedReductionScheduler(), [2, 3]),
+])
+def test_selectExtrasTakesUpToCount(scheduler, expected):
+  pending = [job(1, 8), job(2, 1), job(3, 2), job(4, 4), job(5, 4)]
+  extras = scheduler.selectExtras(pending, 2)
+  assert sorted(ids(extras)) == expected
+  assert len(pending) == 3
+
+  assert len(scheduler.selectExtras(pending, 5)) == 3
+  assert pending == []
+  assert scheduler.selectExtras(pending, 0) == []
+
+
+def test_unknownScheduler():
+  with pytest.raises(Exception):
+    createReductionScheduler("random")
@@ -0,0 +1,65 @@
+import os
+import pytest
+from ResultCache import ResultCache
+
+mmg = {"id": "mmg1"}
+otherMMG = {"id": "mmg2"}
+
+
+@pytest.fixture
+def cache(tmp_path):
+  return ResultCache(directory = str(tmp_path / "cache"), maxMemoryBytes = 100, maxDiskBytes = 1000)
+
+
+def test_keyDependsOnEveryParameter(cache):
+  key = cache.key(mmg, "digest", 10, 4, "PNG")
+  assert key[0] == "mmg1"
+  assert cache.key(mmg, "digest", 10, 4, "PNG") == key
+
+  assert cache.key(otherMMG, "digest", 10, 4, "PNG") != key
+  assert cache.key(mmg, "other", 10, 4, "PNG") != key
+  assert cache.key(mmg, "digest", 11, 4, "PNG") != key
+  assert cache.key(mmg, "digest", 10, 5, "PNG") != key
+  assert cache.key(mmg, "digest", 10, 4, "JPG") != key
+
+
+def test_keyDependsOnTheTransferFormat(cache):
+  key = cache.key(mmg, "digest", 10, 4, "PNG")
+  assert cache.key(mmg, "digest", 10, 4, "PNG", None) == key
+  assert cache.key(mmg, "digest", 10, 4, "PNG", "webp-lossless") != key
+  assert cache.key(mmg, "digest", 10, 4, "PNG", "webp-lossless") != cache.key(mmg, "digest", 10, 4, "PNG", "png-fast")
+
+
+def test_getReturnsWhatWasPut(cache):
+  key = cache.key(mmg, "digest", 10, 4, "PNG")
+  assert cache.get(key) is None
+
+  cache.put(key, b"mosaic")
+  assert cache.get(key) == b"mosaic"
+
+
+def test_largeResultsAreOnlyOnDisk(cache):
+  key = cache.key(mmg, "digest", 10, 4, "PNG")
+  cache.put(key, b"x" * 200)
+  assert cache.memoryBytes == 0
+  assert cache.get(key) == b"x" * 200
+
+
+def test_diskIndexSurvivesARestart(cache, tmp_path):
+  key = cache.key(mmg, "digest", 10, 4, "PNG")
+  cache.put(key, b"mosaic")
+
+  restarted = ResultCache(directory = str(tmp_path / "cache"))
+  assert restarted.get(key) == b"mosaic"
+
+
+def test_invalidateDropsOnlyThatMMG(cache, tmp_path):
+  key = cache.key(mmg, "digest", 10, 4, "PNG")
+  otherKey = cache.key(otherMMG, "digest", 10, 4, "PNG")
+  cache.put(key, b"mosaic")
+  cache.put(otherKey, b"other")
+
+  cache.invalidate("mmg1")
+  assert cache.get(key) is None
+  assert cache.get(otherKey) == b"other"
+  assert not os.path.exists(tmp_path / "cache" / "mmg1")
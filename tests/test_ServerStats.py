@@ -0,0 +1,41 @@
+import pytest
+from ServerStats import ServerStats, latencyPercentile
+
+
+def test_latencyEWMA():
+  stats = ServerStats(alpha = 0.5)
+  assert stats.latencyEWMA is None
+
+  stats.recordSuccess(1.0)
+  assert stats.latencyEWMA == 1.0
+  stats.recordSuccess(3.0)
+  assert stats.latencyEWMA == 2.0
+  assert stats.successes == 2
+
+
+def test_errorEWMA():
+  stats = ServerStats(alpha = 0.5)
+  stats.recordFailure()
+  assert stats.errorEWMA == 0.5
+  stats.recordFailure()
+  assert stats.errorEWMA == 0.75
+
+  stats.recordSuccess(1.0)
+  assert stats.errorEWMA == 0.375
+  assert stats.failures == 2
+
+
+def test_percentileOfRecentLatencies():
+  stats = ServerStats(sampleCount = 4)
+  assert stats.percentile(50) is None
+
+  for latency in [9, 1, 2, 3, 4]:
+    stats.recordSuccess(latency)
+  assert stats.snapshot() == [1, 2, 3, 4]
+  assert stats.percentile(50) == 3
+  assert stats.percentile(100) == 4
+
+
+@pytest.mark.parametrize("p, expected", [(0, 1), (50, 3), (90, 5), (100, 5)])
+def test_latencyPercentile(p, expected):
+  assert latencyPercentile([5, 1, 4, 2, 3], p) == expected
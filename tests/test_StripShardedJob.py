@@ -0,0 +1,49 @@
+import io
+import pytest
+from PIL import Image
+from ImageHeader import getImageSize
+from StripShardedJob import splitBaseImage
+
+
+def baseImage(width, height, mode = "RGB"):
+  buffer = io.BytesIO()
+  Image.new(mode, (width, height), "blue").save(buffer, "PNG")
+  return buffer.getvalue()
+
+
+def tileRows(strip, tilesAcross):
+  # Same math as `MosaicWorker.validateMosaicImageSize` and the MMGs:
+  width, height = getImageSize(strip)
+  return int(height / (width / tilesAcross))
+
+
+def test_stripsCoverEveryTileRow():
+  # 10 px tiles, 13 tile rows:
+  strips = splitBaseImage(baseImage(200, 130), tilesAcross = 20, strips = 4)
+  assert [tileRows(strip, 20) for strip in strips] == [3, 3, 4, 3]
+  assert all(getImageSize(strip)[0] == 200 for strip in strips)
+
+
+def test_fractionalTileSize():
+  # 7.5 px tiles, 13 tile rows (and a partial one):
+  strips = splitBaseImage(baseImage(150, 100), tilesAcross = 20, strips = 3)
+  assert sum(tileRows(strip, 20) for strip in strips) == 13
+  assert [tileRows(strip, 20) for strip in strips] == [4, 5, 4]
+
+
+def test_noMoreStripsThanTileRows():
+  strips = splitBaseImage(baseImage(200, 30), tilesAcross = 20, strips = 16)
+  assert [tileRows(strip, 20) for strip in strips] == [1, 1, 1]
+
+
+def test_stripFormat():
+  assert splitBaseImage(baseImage(200, 40), 20, 2)[0][:2] == b"\xff\xd8"
+  assert splitBaseImage(baseImage(200, 40, "RGBA"), 20, 2)[0][:8] == b"\x89PNG\r\n\x1a\n"
+
+
+def test_tilesTooSmallToSplit():
+  # Tiles of 1.1 pixels can not be cut on row boundaries:
+  with pytest.raises(Exception):
+    splitBaseImage(baseImage(22, 22), tilesAcross = 20, strips = 3)
+  # ...unless the image is not split at all:
+  assert len(splitBaseImage(baseImage(22, 22), tilesAcross = 20, strips = 1)) == 1
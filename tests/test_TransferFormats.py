@@ -0,0 +1,51 @@
+import io
+import pytest
+from PIL import Image
+import TransferFormats
+from ImageHeader import getImageSize
+from TransferFormats import containerOf, encodeImage, getTransferFormat, openImage, supportedTransferFormats, transcode
+
+
+def mosaic():
+  return Image.effect_noise((24, 16), 64).convert("RGB")
+
+
+def pixels(img):
+  return img.convert("RGB").tobytes()
+
+
+@pytest.mark.parametrize("name", supportedTransferFormats())
+def test_formatsAreLossless(name):
+  img = mosaic()
+  encoded = getTransferFormat(name).encode(img)
+
+  assert containerOf(encoded) == getTransferFormat(name).container
+  assert getImageSize(encoded) == (24, 16)
+  with openImage(encoded) as decoded:
+    assert pixels(decoded) == pixels(img)
+
+
+def test_alwaysSupported():
+  assert {"png-fast", "rgb-zlib"} <= set(supportedTransferFormats())
+
+
+def test_unknownFormat():
+  with pytest.raises(Exception):
+    getTransferFormat("bmp-fast")
+
+
+@pytest.mark.parametrize("fileFormat, container", [("PNG", "png"), ("JPG", "jpeg"), ("JPEG", "jpeg"), ("GIF", "gif")])
+def test_containerOfUserFormats(fileFormat, container):
+  assert containerOf(encodeImage(mosaic(), fileFormat)) == container
+  assert TransferFormats.fileFormatContainer(fileFormat) == container
+
+
+def test_transcode():
+  png = encodeImage(mosaic(), "PNG")
+  assert transcode(png, "PNG") is png
+
+  raw = getTransferFormat("rgb-zlib").encode(mosaic())
+  assert containerOf(transcode(raw, "PNG")) == "png"
+  assert containerOf(transcode(raw, "JPG")) == "jpeg"
+  with Image.open(io.BytesIO(transcode(raw, "PNG"))) as img:
+    assert pixels(img) == pixels(openImage(raw))
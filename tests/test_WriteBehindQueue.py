@@ -0,0 +1,83 @@
+import pymongo
+import pytest
+from WriteBehindQueue import WriteBehindQueue
+
+
+class FakeCollection:
+  """Records bulk writes (as `(id, update)` pairs) and raises the queued errors, one per call."""
+
+  def __init__(self):
+    self.writes = []
+    self.errors = []
+
+  def bulk_write(self, operations, ordered):
+    self.writes.append([(operation._filter["id"], operation._doc) for operation in operations])
+    if len(self.errors) > 0:
+      raise self.errors.pop(0)
+
+
+@pytest.fixture
+def collection():
+  return FakeCollection()
+
+
+@pytest.fixture
+def queue(collection):
+  # Only flushed explicitly:
+  return WriteBehindQueue({"mmg": collection}, flushInterval = 3600)
+
+
+def test_writesAreMerged(queue, collection):
+  queue.increment("mmg", "a", "count")
+  queue.increment("mmg", "a", "count", 2)
+  queue.set("mmg", "a", "error", "x")
+  queue.set("mmg", "a", "error", "y")
+  queue.flush()
+
+  assert collection.writes == [[("a", {"$set": {"error": "y"}, "$inc": {"count": 3}})]]
+  queue.flush()
+  assert len(collection.writes) == 1
+
+
+def test_replaceSupersedesPendingUpdates(queue, collection):
+  queue.increment("mmg", "a", "count")
+  queue.replace("mmg", "a", {"id": "a", "count": 7})
+  queue.increment("mmg", "a", "count")
+  queue.flush()
+
+  assert collection.writes == [[("a", {"id": "a", "count": 7}), ("a", {"$inc": {"count": 1}})]]
+
+
+def test_bulkWriteErrorRetriesOnlyUnappliedWrites(queue, collection):
+  collection.errors.append(pymongo.errors.BulkWriteError({"writeErrors": [{"index": 1, "errmsg": "failed"}]}))
+  for id in ["a", "b", "c"]:
+    queue.increment("mmg", id, "count")
+  queue.flush()
+  assert [id for id, update in collection.writes[0]] == ["a", "b", "c"]
+
+  # "a" was applied and must not be incremented again; newer increments are merged into "b":
+  queue.increment("mmg", "b", "count", 5)
+  queue.flush()
+  assert sorted(collection.writes[1]) == [("b", {"$inc": {"count": 6}}), ("c", {"$inc": {"count": 1}})]
+  assert queue.writesFlushed == 3
+
+
+def test_bulkWriteErrorAfterAReplace(queue, collection):
+  collection.errors.append(pymongo.errors.BulkWriteError({"writeErrors": [{"index": 1, "errmsg": "failed"}]}))
+  queue.replace("mmg", "a", {"id": "a", "count": 0})
+  queue.increment("mmg", "a", "count")
+  queue.flush()
+
+  queue.flush()
+  assert collection.writes[1] == [("a", {"$inc": {"count": 1}})]
+
+
+def test_otherErrorsRetryEverything(queue, collection):
+  collection.errors.append(pymongo.errors.AutoReconnect("connection lost"))
+  queue.increment("mmg", "a", "count")
+  queue.set("mmg", "b", "disabled", True)
+  queue.flush()
+
+  queue.set("mmg", "b", "disabled", False)
+  queue.flush()
+  assert sorted(collection.writes[1]) == [("a", {"$inc": {"count": 1}}), ("b", {"$set": {"disabled": False}})]